@@ -0,0 +1,52 @@
+# run from POC directory: python benchmarks/convert_scaling.py [pages] [-s PX | --dpi DPI] [-j MAX_JOBS]
+#
+# Times `convert` of every page of a synthetic pdf with 1..N worker
+# processes, where N defaults to the number of cores, and prints a table of
+# the pages rendered per second and the speedup over one process.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import convert
+from bench import make_pdf
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', type=int, nargs='?', default=200)
+    parser.add_argument('-s', '--size', type=int, help='thumbnail size in pixels, instead of --dpi')
+    parser.add_argument('--dpi', type=int, default=convert.DEFAULT_DPI)
+    parser.add_argument('-f', '--format', choices=convert.IMAGE_FORMATS, default='png')
+    parser.add_argument('-j', '--max-jobs', type=int, default=os.cpu_count() or 1)
+    bench_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    src_pdf_path = os.path.join(work_dir, 'source.pdf')
+    make_pdf(src_pdf_path, bench_args.pages, images=2, fonts=3)
+
+    print('pages: {}, {}, {}'.format(bench_args.pages, bench_args.format,
+          '{} px'.format(bench_args.size) if bench_args.size else '{} dpi'.format(bench_args.dpi)))
+    print('{:>5} {:>10} {:>10} {:>8}'.format('jobs', 'seconds', 'pages/s', 'speedup'))
+
+    try:
+        baseline = None
+        for jobs in range(1, bench_args.max_jobs+1):
+            arguments = argparse.Namespace(src_pdf=src_pdf_path, pages=[], format=bench_args.format,
+                                           dpi=None if bench_args.size else bench_args.dpi, size=bench_args.size,
+                                           quality=85, jobs=jobs, output_dir=os.path.join(work_dir, 'out'))
+            start = time.perf_counter()
+            out_image_paths = convert.convert(arguments)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print('{:>5} {:>10.3f} {:>10.1f} {:>7.2f}x'.format(jobs, elapsed, len(out_image_paths)/elapsed,
+                                                             baseline/elapsed))
+            for path in out_image_paths:
+                os.remove(path)
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
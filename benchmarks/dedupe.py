@@ -0,0 +1,57 @@
+# run from POC directory: python benchmarks/dedupe.py [documents ...]
+#
+# Merges a synthetic corpus of invoices, which all share the same letterhead
+# images and fonts, with and without --dedupe and the compact save profile,
+# and prints a table of the output size, the time taken to dedupe and save,
+# and the total time of each. The compact profile also removes duplicates
+# (garbage=4), but compares every pair of objects, so takes time that grows
+# with the square of the number of objects where --dedupe grows linearly.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import helpers
+import instrument
+from bench import make_pdf
+
+MODES = {
+    'plain': [],
+    'compact': ['--save-profile', 'compact'],
+    'dedupe': ['--dedupe'],
+    'dedupe+compact': ['--dedupe', '--save-profile', 'compact'],
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('documents', type=int, nargs='*', default=[100, 500, 2000])
+    parser.add_argument('-p', '--pages', type=int, default=3, help='pages per invoice')
+    bench_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    records = []
+    hook = instrument.add_hook(records.append)
+    print('| invoices | mode | output size (KB) | dedupe (s) | save (s) | total (s) |')
+    print('|---:|---|---:|---:|---:|---:|')
+    try:
+        invoice_path = make_pdf(os.path.join(work_dir, 'invoice.pdf'), bench_args.pages, images=2, fonts=3)
+        for document_count in bench_args.documents:
+            for mode, mode_args in MODES.items():
+                argv = ['merge'] + [invoice_path]*document_count + mode_args + ['-o', os.path.join(work_dir, 'out')]
+                arguments = helpers.set_args().parse_args(argv)
+                with instrument.command_trace('merge', argv):
+                    out_pdf_path = helpers.get_command_controls('merge')['execute'](arguments)
+                record = records[-1]
+                print('| {} | {} | {:.0f} | {:.3f} | {:.3f} | {:.3f} |'.format(
+                    document_count, mode, os.path.getsize(out_pdf_path)/1024,
+                    record['phases'].get('dedupe', {}).get('seconds', 0.0),
+                    record['phases']['save']['seconds'], record['seconds']))
+                os.remove(out_pdf_path)
+    finally:
+        instrument.remove_hook(hook)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# run from POC directory: python benchmarks/large_file.py [pages ...]
+#
+# Times `remove 3` with the fast save profile, with and without --large, on
+# synthetic pdfs of growing size, and prints a table of the time and peak
+# resident set size of each. Without --large both grow with the size of the
+# pdf; with it they should stay about the same, apart from copying the file.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+from bench import make_pdf, _timed_run
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', type=int, nargs='*', default=[1000, 10000, 100000])
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    bench_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    print('{:>8} {:>9} {:>8} {:>10} {:>10}'.format('pages', 'file MB', 'mode', 'seconds', 'peak MB'))
+    try:
+        for page_count in bench_args.pages:
+            src_pdf_path = os.path.join(work_dir, 'source_{}.pdf'.format(page_count))
+            make_pdf(src_pdf_path, page_count, images=1, fonts=3)
+            size = os.path.getsize(src_pdf_path)
+
+            for mode in ('fast', 'large'):
+                argv = ['remove', src_pdf_path, '3', '--save-profile', 'fast']
+                argv += ['--large'] if mode == 'large' else []
+                # a fresh process for each, so that the peak is its own
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(_timed_run, argv, work_dir, bench_args.repeats).result()
+                print('{:>8} {:>9.1f} {:>8} {:>10.3f} {:>10.1f}'.format(
+                    page_count, size/(1024*1024), mode, result['seconds'], result['peak_rss']/(1024*1024)))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# run from POC directory: python benchmarks/optimize.py [pages] [--scan-dpi DPI] [--dpi DPI] [-j MAX_JOBS]
+#
+# Makes a synthetic scanned pdf, each page of which is a single jpeg drawn
+# over the whole page, and times `optimize` of it with 1..N worker
+# processes, where N defaults to the number of cores. Prints a table of the
+# source and output sizes, and the time spent in each stage of the image
+# work (see images.optimize_images) and in total.
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import fitz
+import helpers
+import instrument
+from bench import make_pdf
+
+def make_scans(path, page_count, scan_dpi):
+    """
+    Writes a pdf of <page_count> pages, each a jpeg of a page of synthetic
+    text rendered at <scan_dpi>, to <path>.
+    """
+    text_pdf_path = make_pdf(path + '.text.pdf', page_count, images=2, fonts=3)
+    with fitz.open(text_pdf_path) as text_pdf, fitz.open() as scans:
+        for text_page in text_pdf:
+            jpeg = text_page.get_pixmap(dpi=scan_dpi).tobytes('jpg', jpg_quality=90)
+            page = scans.new_page(width=text_page.rect.width, height=text_page.rect.height)
+            page.insert_image(page.rect, stream=jpeg)
+        scans.save(path)
+    os.remove(text_pdf_path)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', type=int, nargs='?', default=20)
+    parser.add_argument('--scan-dpi', type=int, default=300)
+    parser.add_argument('--dpi', type=int, default=150)
+    parser.add_argument('-j', '--max-jobs', type=int, default=os.cpu_count() or 1)
+    bench_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    records = []
+    hook = instrument.add_hook(records.append)
+    try:
+        src_pdf_path = make_scans(os.path.join(work_dir, 'scans.pdf'), bench_args.pages, bench_args.scan_dpi)
+        print('pages: {}, scanned at {} dpi, optimized to {} dpi'.format(bench_args.pages, bench_args.scan_dpi,
+              bench_args.dpi))
+        print('| jobs | source (KB) | output (KB) | scan (s) | encode (s) | update (s) | total (s) |')
+        print('|---:|---:|---:|---:|---:|---:|---:|')
+        for jobs in range(1, bench_args.max_jobs+1):
+            argv = ['optimize', src_pdf_path, '--dpi', str(bench_args.dpi), '-j', str(jobs),
+                    '-o', os.path.join(work_dir, 'out')]
+            arguments = helpers.set_args().parse_args(argv)
+            with instrument.command_trace('optimize', argv):
+                out_pdf_path = helpers.get_command_controls('optimize')['execute'](arguments)
+            phases = records[-1]['phases']
+            print('| {} | {:.0f} | {:.0f} | {:.3f} | {:.3f} | {:.3f} | {:.3f} |'.format(
+                jobs, os.path.getsize(src_pdf_path)/1024, os.path.getsize(out_pdf_path)/1024,
+                *(phases['image_'+stage]['seconds'] for stage in ('scan', 'encode', 'update')),
+                records[-1]['seconds']))
+            os.remove(out_pdf_path)
+            # each run recompresses the images again
+            sys.modules['images'].clear_cache()
+    finally:
+        instrument.remove_hook(hook)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
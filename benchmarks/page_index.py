@@ -0,0 +1,70 @@
+# run from POC directory: python benchmarks/page_index.py [pages ...] [-r REPEATS]
+#
+# Times extracting a 3 page range near the end of synthetic pdfs of growing
+# size with split, removing it with `remove --large` and inserting a pdf
+# there with `insert --large`, without an index and then with one (see
+# pageindex), and prints a table of the best time of each and the time to
+# build the index. Without the index each grows with the size of the pdf;
+# with it split should stay about the same, and remove and insert grow only
+# with copying the file.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import commands
+import pageindex
+from helpers import set_args
+from bench import make_pdf
+
+def best_time(run, repeats):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', type=int, nargs='*', default=[1000, 10000, 50000])
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    bench_args = parser.parse_args()
+    poc_parser = set_args()
+
+    work_dir = tempfile.mkdtemp()
+    ins_pdf_path = make_pdf(os.path.join(work_dir, 'insert.pdf'), 3)
+    print('| pages | file MB | index (s) | index MB | command | without index (s) | with index (s) | speedup |')
+    print('|---:|---:|---:|---:|---|---:|---:|---:|')
+    try:
+        for page_count in bench_args.pages:
+            src_pdf_path = make_pdf(os.path.join(work_dir, 'source_{}.pdf'.format(page_count)), page_count,
+                                    images=1, fonts=3)
+            pages = '{}-{}'.format(page_count-9, page_count-7)
+            out = ['-o', os.path.join(work_dir, 'out')]
+            argvs = {'split': ['split', src_pdf_path, pages],
+                     'remove --large': ['remove', src_pdf_path, pages, '--large'],
+                     'insert --large': ['insert', src_pdf_path, ins_pdf_path, str(page_count-10), '--large']}
+            runs = {name: lambda argv=argv: getattr(commands, argv[0])(poc_parser.parse_args(argv + out))
+                    for name, argv in argvs.items()}
+
+            without = {name: best_time(run, bench_args.repeats) for name, run in runs.items()}
+            start = time.perf_counter()
+            pageindex.build_index(src_pdf_path)
+            index_seconds = time.perf_counter() - start
+            index_mb = os.path.getsize(pageindex.index_path(src_pdf_path))/(1024*1024)
+            with_index = {name: best_time(run, bench_args.repeats) for name, run in runs.items()}
+
+            for name in runs:
+                print('| {} | {:.1f} | {:.2f} | {:.1f} | {} | {:.3f} | {:.3f} | {:.1f}x |'.format(
+                      page_count, os.path.getsize(src_pdf_path)/(1024*1024), index_seconds, index_mb, name,
+                      without[name], with_index[name], without[name]/with_index[name]))
+            shutil.rmtree(os.path.join(work_dir, 'out'))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
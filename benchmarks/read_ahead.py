@@ -0,0 +1,98 @@
+# run from POC directory: python benchmarks/read_ahead.py [pdfs] [--pages N] [--latency MS] [--mb-per-s MB]
+#
+# Merges synthetic pdfs read through an artificially slowed file reader,
+# which sleeps for a fixed latency plus the time to transfer each file at a
+# given bandwidth (much as a read from network storage waits), reading each
+# pdf as the merge reaches it and then reading 1..8 pdfs ahead of it (see
+# prefetch.ReadAhead). The read ahead merges are run as the merge command
+# runs them, checking the pdfs first, which opens them from memory for the
+# merge to use (see commands.reading_ahead). Prints a table of the time
+# spent waiting on reads, the number of times the pdfs are parsed and the
+# total time of each, so that the overlap of reading with the rest shows.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import fitz
+import commands
+import instrument
+from prefetch import read_file
+from bench import make_pdf
+
+DEPTHS = (1, 2, 4, 8)
+
+def slow_reader(latency, bytes_per_second):
+    """
+    Returns a function which reads a file as prefetch.read_file does, after
+    sleeping for <latency> seconds and the time to transfer the file at
+    <bytes_per_second>.
+    """
+    def read(path):
+        time.sleep(latency + os.path.getsize(path)/bytes_per_second)
+        return read_file(path)
+    return read
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pdfs', type=int, nargs='?', default=40)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds')
+    parser.add_argument('--mb-per-s', type=float, default=50)
+    bench_args = parser.parse_args()
+    read = slow_reader(bench_args.latency/1000, bench_args.mb_per_s*1024*1024)
+
+    # count the pdfs parsed, by path or from memory
+    parsed = []
+    fitz_open = fitz.open
+    def counting_open(*args, **kwargs):
+        if args or 'stream' in kwargs:
+            parsed.append(1)
+        return fitz_open(*args, **kwargs)
+    fitz.open = counting_open
+
+    work_dir = tempfile.mkdtemp()
+    records = []
+    hook = instrument.add_hook(records.append)
+    try:
+        pdf_paths = [make_pdf(os.path.join(work_dir, '{}.pdf'.format(n)), bench_args.pages, images=2, fonts=2)
+                     for n in range(bench_args.pdfs)]
+        out_pdf_path = os.path.join(work_dir, 'out.pdf')
+        total_mb = sum(os.path.getsize(path) for path in pdf_paths)/(1024*1024)
+        print('pdfs: {} of {} pages, {:.1f} MB in all, read at {} ms + {} MB/s'.format(
+              bench_args.pdfs, bench_args.pages, total_mb, bench_args.latency, bench_args.mb_per_s))
+        print('| read ahead | waiting on reads (s) | pdfs parsed | total (s) | speedup |')
+        print('|---:|---:|---:|---:|---:|')
+
+        # each pdf read as the merge reaches it
+        waits = []
+        def read_in_turn():
+            for path in pdf_paths:
+                start = time.perf_counter()
+                data = read(path)
+                waits.append(time.perf_counter() - start)
+                yield data
+        start = time.perf_counter()
+        commands.merge_pdfs(read_in_turn(), out_pdf_path)
+        serial_seconds = time.perf_counter() - start
+        print('| 0 | {:.3f} | {} | {:.3f} | 1.00 |'.format(sum(waits), len(parsed), serial_seconds))
+
+        for depth in DEPTHS:
+            del parsed[:]
+            with instrument.command_trace('merge', ['merge', '--read-ahead', str(depth)]):
+                with commands.sharing_sources(pdf_paths), commands.reading_ahead(pdf_paths, depth, read=read):
+                    commands.check_sources(pdf_paths)
+                    commands.merge_pdfs(pdf_paths, out_pdf_path)
+            record = records[-1]
+            print('| {} | {:.3f} | {} | {:.3f} | {:.2f} |'.format(depth, record['phases']['read_wait']['seconds'],
+                  len(parsed), record['seconds'], serial_seconds/record['seconds']))
+    finally:
+        fitz.open = fitz_open
+        instrument.remove_hook(hook)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# run from POC directory: python benchmarks/save_profiles.py [repeats]
+#
+# Times each command with each save profile on the test files, and prints
+# a markdown table of the best time and the total size of the output/s.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import helpers
+import commands
+
+test_files_dir = os.path.abspath('tests/test_files')
+bigboy = os.path.join(test_files_dir, 'pdf_5_bigboy.pdf')
+
+COMMAND_ARGS = {
+    'merge': ['merge'] + [os.path.join(test_files_dir, 'pdf_{}.pdf'.format(i)) for i in range(1, 5)] + [bigboy],
+    'remove': ['remove', bigboy, '2', '4-7', '13'],
+    'insert': ['insert', bigboy, os.path.join(test_files_dir, 'pdf_4.pdf'), '14'],
+    'split': ['split', bigboy, '1-5', '6-10', '11-15', '16-20'],
+}
+
+def run(argv, repeats):
+    """
+    @return (seconds, size) : tuple
+        Best time of <repeats> runs, and total size in bytes of the outputs.
+    """
+    arguments = helpers.set_args().parse_args(argv)
+    execute = helpers.get_command_controls(argv[0])['execute']
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outputs = execute(arguments)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        size = sum(os.path.getsize(path) for path in outputs)
+        for path in outputs:
+            os.remove(path)
+    return best, size
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    profiles = [None] + list(commands.SAVE_PROFILES)
+
+    print('| command | profile | time (ms) | output size (bytes) |')
+    print('|---|---|---:|---:|')
+
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        for command, argv in COMMAND_ARGS.items():
+            for profile in profiles:
+                profile_args = ['--save-profile', profile] if profile else []
+                seconds, size = run(argv + profile_args, repeats)
+                print('| {} | {} | {:.1f} | {} |'.format(command, profile or '(plain)', seconds*1000, size))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# run from POC directory: python benchmarks/split_scaling.py [pages] [ranges]
+#
+# Times `split` over the same page ranges with 1..N worker processes, where N
+# is the number of cores, and prints a table of the results.
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'poc'))
+import commands
+from bench import make_pdf
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', type=int, nargs='?', default=2000)
+    parser.add_argument('ranges', type=int, nargs='?', default=200)
+    bench_args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    src_pdf_path = os.path.join(work_dir, 'source.pdf')
+    make_pdf(src_pdf_path, bench_args.pages)
+
+    # equal sized ranges covering the whole document
+    step = max(1, bench_args.pages // bench_args.ranges)
+    pages = ['{}-{}'.format(s, min(s+step-1, bench_args.pages)) if step > 1 else str(s)
+             for s in range(1, bench_args.pages+1, step)]
+
+    print('pages: {}, ranges: {}'.format(bench_args.pages, len(pages)))
+    print('{:>5} {:>10} {:>8}'.format('jobs', 'seconds', 'speedup'))
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        baseline = None
+        for jobs in range(1, (os.cpu_count() or 1)+1):
+            arguments = argparse.Namespace(src_pdf=src_pdf_path, pages=pages, jobs=jobs)
+            start = time.perf_counter()
+            output_pdf_paths = commands.split(arguments)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print('{:>5} {:>10.3f} {:>7.2f}x'.format(jobs, elapsed, baseline/elapsed))
+            for path in output_pdf_paths:
+                os.remove(path)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# run from POC directory: python -m pytest benchmarks [--benchmark-json=results.json]
+#
+# The commands timed by `poc bench`, as pytest-benchmark benchmarks. Page
+# counts can be set with POC_BENCH_PAGES e.g. POC_BENCH_PAGES=100,10000.
+# Skipped if pytest-benchmark is not installed.
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+pytest.importorskip('pytest_benchmark')
+import poc.bench as bench
+from poc.helpers import set_args, get_command_controls, JOB_COMMANDS
+
+PAGE_COUNTS = [int(pages) for pages in os.environ.get('POC_BENCH_PAGES', '10,1000').split(',')]
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('poc-bench'))
+
+@pytest.mark.parametrize('page_count', PAGE_COUNTS)
+@pytest.mark.parametrize('command', JOB_COMMANDS)
+def test_bench(benchmark, data_dir, tmp_path, command, page_count):
+    src_pdf_path = bench._synthetic_pdf(data_dir, page_count, 1, 3)
+    ins_pdf_path = bench._synthetic_pdf(data_dir, 10, 1, 3)
+    argv = bench._command_argv(command, src_pdf_path, ins_pdf_path, page_count)
+
+    arguments = set_args().parse_args(argv)
+    arguments.output_dir = str(tmp_path)
+    execute = get_command_controls(command)['execute']
+
+    def run():
+        outputs = execute(arguments)
+        for path in outputs if isinstance(outputs, tuple) else (outputs,):
+            os.remove(path)
+
+    benchmark(run)
+    return
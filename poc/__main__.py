@@ -1,5 +1,5 @@
-
-from poc import main
-
-if __name__ == '__main__':
+
+from poc import main
+
+if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,40 @@
+# Python interface to the commands, for callers which hold their pdfs in 
+# memory. Each function takes its pdfs as paths, bytes, bytearrays, 
+# memoryviews or binary file objects, and returns its output pdf/s as bytes,
+# or saves them to the given path/s or writes them to the given file 
+# object/s, so pdfs never have to go through the file system. The command
+# line commands are thin wrappers around these functions.
+#
+#   from poc.api import merge_pdfs
+#   merged = merge_pdfs([upload_1, upload_2], save_profile='compact')
+#
+# A Pipeline chains the commands, saving only the end result:
+#
+#   parts = Pipeline([upload_1, upload_2]).remove(['3-5']).split(every=10).run()
+#
+# The images of the pdfs saved in an optimized_images block are downsampled
+# and recompressed:
+#
+#   with optimized_images(dpi=150):
+#       merged = merge_pdfs([upload_1, upload_2])
+
+try:
+    from .pages import PageSet
+    from .commands import SAVE_PROFILES, merge_pdfs, remove_pages, insert_pages, split_pdf, optimize_pdf, \
+        rearrange_pages
+    from .images import optimized_images
+    from .pipeline import Pipeline
+    from .convert import IMAGE_FORMATS, convert_pdf
+    from .extract import EXTRACT_MODES, extract_pages
+except ImportError:
+    from pages import PageSet
+    from commands import SAVE_PROFILES, merge_pdfs, remove_pages, insert_pages, split_pdf, optimize_pdf, \
+        rearrange_pages
+    from images import optimized_images
+    from pipeline import Pipeline
+    from convert import IMAGE_FORMATS, convert_pdf
+    from extract import EXTRACT_MODES, extract_pages
+
+__all__ = ['PageSet', 'SAVE_PROFILES', 'merge_pdfs', 'remove_pages', 'insert_pages', 'split_pdf', 'Pipeline',
+           'IMAGE_FORMATS', 'convert_pdf', 'EXTRACT_MODES', 'extract_pages', 'optimize_pdf', 'optimized_images',
+           'rearrange_pages']
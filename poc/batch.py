@@ -0,0 +1,167 @@
+import os
+import re
+import csv
+import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from . import commands
+    from .doccache import DocumentCache
+    from .instrument import command_trace
+except ImportError:
+    import commands
+    from doccache import DocumentCache
+    from instrument import command_trace
+
+def read_manifest(manifest_path):
+    """
+    Reads the jobs from a batch manifest. A manifest is either a csv file,
+    with one job per row given as the command followed by its arguments,
+    or a json-lines file with one job per line given as a list in the same
+    form, or as an object with the keys 'command', 'args' and (optionally)
+    'id'. Blank lines, and lines starting with '#', are skipped.
+
+    @param  manifest_path : str
+        Path to the manifest file.
+
+    @return jobs : list
+        List of dicts with the keys 'id' and 'argv'.
+    """
+    jobs = []
+
+    with open(manifest_path, newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            rows = [row for row in csv.reader(f) if row and not row[0].startswith('#')]
+        else:
+            rows = [json.loads(line) for line in f if line.strip() and not line.startswith('#')]
+
+    for line_num, row in enumerate(rows, 1):
+        if isinstance(row, dict):
+            job_id = re.sub(r'[^\w.-]', '_', str(row.get('id', line_num)))
+            argv = [row['command']] + [str(arg) for arg in row.get('args', [])]
+        else:
+            job_id = str(line_num)
+            argv = [str(arg).strip() for arg in row if str(arg).strip()]
+        jobs.append({'id': job_id, 'argv': argv})
+
+    return jobs
+
+def run_job(job, out_dir):
+    """
+    Runs a single job, from a batch or sent to a poc serve daemon, through
+    the same argument parsing, argument checks and dispatch as the command
+    line.
+
+    @param  job : dict
+        Dict with the keys 'id' and 'argv'.
+    @param  out_dir : str
+        Directory to save the outputs of the job to.
+
+    @return result : dict
+        Log entry for the job, giving its status and outputs, or the error
+        that it raised.
+    """
+    # imported here so that helpers can import this module
+    try:
+        from . import helpers
+    except ImportError:
+        import helpers
+
+    result = {'id': job['id'], 'argv': job['argv']}
+    start = time.perf_counter()
+
+    try:
+        if not job['argv'] or job['argv'][0] not in helpers.JOB_COMMANDS:
+            raise ValueError('a job must be one of {}'.format(', '.join(helpers.JOB_COMMANDS)))
+
+        try:
+            cl_args = helpers.set_args().parse_args(job['argv'])
+        except SystemExit:
+            raise ValueError('invalid arguments for {}'.format(job['argv'][0]))
+
+        command = cl_args.invoked_command
+        CC = helpers.get_command_controls(command)
+        helpers.check_arguments(command, CC, cl_args)
+
+        # each job gets its own output directory, inside which the job may
+        # give a directory of its own
+        cl_args.output_dir = os.path.join(out_dir, cl_args.output_dir or '')
+        os.makedirs(cl_args.output_dir, exist_ok=True)
+
+        with command_trace(command, job['argv']):
+            outputs = CC['execute'](cl_args)
+        result['status'] = 'ok'
+        result['outputs'] = list(outputs) if isinstance(outputs, tuple) else [outputs]
+
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+def _init_batch_worker(max_docs, result_cache=None):
+    try:
+        from . import helpers
+    except ImportError:
+        import helpers
+    commands.set_document_cache(DocumentCache(max_docs))
+    helpers.set_result_cache(result_cache)
+
+def run_batch(arguments):
+    """
+    Runs every job in a manifest in one process, or shared between a pool
+    of worker processes, so that the start up cost is paid once per batch
+    rather than once per job. Source pdfs are kept open between jobs (per
+    worker) by a document cache. Outputs of each job are saved to a
+    directory named after the job id in the output directory, and the
+    result of every job is written to a json-lines log.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: manifest, jobs, output_dir,
+        log, max_docs
+
+    @return log_path : str
+        Path to the log file.
+    """
+    # imported here so that helpers can import this module
+    try:
+        from . import helpers
+    except ImportError:
+        import helpers
+
+    # args: manifest, jobs, output_dir, log, max_docs
+    jobs = read_manifest(arguments.manifest)
+    out_dir = os.path.abspath(arguments.output_dir or os.getcwd())
+    log_path = arguments.log or os.path.join(out_dir, 'batch_log.jsonl')
+    os.makedirs(out_dir, exist_ok=True)
+
+    failed = 0
+    with open(log_path, 'w') as log:
+
+        def write_result(result):
+            log.write(json.dumps(result)+'\n')
+            log.flush()
+            return result['status'] != 'ok'
+
+        if arguments.jobs > 1:
+            with ProcessPoolExecutor(max_workers=arguments.jobs, initializer=_init_batch_worker,
+                                     initargs=(arguments.max_docs, helpers._result_cache)) as executor:
+                futures = [executor.submit(run_job, job, os.path.join(out_dir, job['id'])) for job in jobs]
+                for future in futures:
+                    failed += write_result(future.result())
+        else:
+            document_cache = DocumentCache(arguments.max_docs)
+            commands.set_document_cache(document_cache)
+            try:
+                for job in jobs:
+                    failed += write_result(run_job(job, os.path.join(out_dir, job['id'])))
+            finally:
+                commands.set_document_cache(None)
+                document_cache.close()
+
+    print('{} of {} jobs failed, see {}'.format(failed, len(jobs), log_path), file=sys.stderr)
+
+    return log_path
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import zlib
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+try:
+    from . import helpers
+    from .memory import current_rss, peak_rss
+except ImportError:
+    import helpers
+    from memory import current_rss, peak_rss
+
+# the fonts built in to every pdf reader, which synthetic pdfs cycle through
+# to vary the number of fonts used
+BASE14_FONTS = ('Helvetica', 'Times-Roman', 'Courier', 'Helvetica-Bold', 'Times-Bold',
+                'Courier-Bold', 'Helvetica-Oblique', 'Times-Italic', 'Courier-Oblique',
+                'Helvetica-BoldOblique', 'Times-BoldItalic', 'Courier-BoldOblique',
+                'Symbol', 'ZapfDingbats')
+
+# number of distinct images in a synthetic pdf, each drawn on many pages
+IMAGE_POOL = 16
+
+def make_pdf(path, page_count, images=0, fonts=1):
+    """
+    Writes a synthetic pdf, with a heading and a paragraph of text on each
+    page, to <path>. The pdf is written out directly rather than built up 
+    with PyMuPDF, which takes minutes rather than seconds for 100k pages.
+    It is written to a temporary file first, so an interrupted run does not
+    leave a partial pdf at <path>.
+
+    @param  path : str
+        Path to write the pdf to.
+    @param  page_count : int
+        Number of pages.
+    @param  images : int
+        Number of images drawn on each page (at most 20). The images are 
+        taken in turn from a pool of IMAGE_POOL distinct images, each stored
+        once in the pdf. Defaults to 0.
+    @param  fonts : int
+        Number of the base 14 fonts the pages are written in, at most 14.
+        Defaults to 1.
+
+    @return path : str
+    """
+    if page_count < 1 or not 0 <= images <= 20 or not 1 <= fonts <= len(BASE14_FONTS):
+        raise ValueError('a synthetic pdf needs at least 1 page, 0 to 20 images per page '
+                         'and 1 to {} fonts'.format(len(BASE14_FONTS)))
+
+    # object numbers: catalog, page tree, fonts, images, then a page and its
+    # contents for each page
+    first_font = 3
+    first_image = first_font + fonts
+    first_page = first_image + (IMAGE_POOL if images else 0)
+    page_objects = range(first_page, first_page + 2*page_count, 2)
+
+    tmp_path = path + '.tmp'
+    offsets = []
+    with open(tmp_path, 'wb') as f:
+        def write_object(body, stream=None):
+            offsets.append(f.tell())
+            f.write('{} 0 obj\n'.format(len(offsets)).encode())
+            f.write(body.encode())
+            if stream is not None:
+                f.write(b'\nstream\n' + stream + b'\nendstream')
+            f.write(b'\nendobj\n')
+
+        f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        write_object('<< /Type /Catalog /Pages 2 0 R >>')
+        write_object('<< /Type /Pages /Count {} /Kids [{}] >>'.format(
+            page_count, ' '.join('{} 0 R'.format(n) for n in page_objects)))
+
+        for fontname in BASE14_FONTS[:fonts]:
+            encoding = '' if fontname in ('Symbol', 'ZapfDingbats') else ' /Encoding /WinAnsiEncoding'
+            write_object('<< /Type /Font /Subtype /Type1 /BaseFont /{}{} >>'.format(fontname, encoding))
+
+        for n in range(IMAGE_POOL if images else 0):
+            stream = _make_image(n)
+            write_object('<< /Type /XObject /Subtype /Image /Width 128 /Height 128 /ColorSpace /DeviceRGB '
+                         '/BitsPerComponent 8 /Filter /FlateDecode /Length {} >>'.format(len(stream)), stream)
+
+        for i in range(page_count):
+            font = i % fonts
+            pool = sorted({(i*images + j) % IMAGE_POOL for j in range(images)})
+            contents = ['BT /F{} 24 Tf 72 770 Td (synthetic page {}) Tj ET'.format(font, i+1),
+                        'BT /F{} 8 Tf 72 722 Td ({}) Tj ET'.format(font, 'lorem ipsum dolor sit amet '*8)]
+            for j in range(images):
+                x, y = 72 + (j % 4)*120, 582 - (j // 4)*120
+                contents.append('q 100 0 0 100 {} {} cm /Im{} Do Q'.format(x, y, (i*images + j) % IMAGE_POOL))
+            stream = zlib.compress('\n'.join(contents).encode())
+
+            # each page has its own resources, naming only what it uses
+            resources = '<< /Font << /F{} {} 0 R >> /XObject << {} >> >>'.format(font, first_font+font,
+                ' '.join('/Im{} {} 0 R'.format(n, first_image+n) for n in pool))
+            write_object('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources {} '
+                         '/Contents {} 0 R >>'.format(resources, len(offsets)+2))
+            write_object('<< /Filter /FlateDecode /Length {} >>'.format(len(stream)), stream)
+
+        xref_offset = f.tell()
+        f.write('xref\n0 {}\n0000000000 65535 f \n'.format(len(offsets)+1).encode())
+        f.write(''.join('{:010d} 00000 n \n'.format(offset) for offset in offsets).encode())
+        f.write('trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            len(offsets)+1, xref_offset).encode())
+
+    os.replace(tmp_path, path)
+    return path
+
+def _make_image(n):
+    # deflated samples of a 128x128 rgb image of coloured bands, different 
+    # for each n
+    samples = b''.join(bytes(((n*37 + band*29) % 256, (n*71 + band*13) % 256, 
+                              (n*11 + band*53) % 256)) * 128*16 for band in range(8))
+    return zlib.compress(samples)
+
+def _synthetic_pdf(data_dir, page_count, images, fonts):
+    # synthetic pdfs are kept in <data_dir> and reused by later runs
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, 'synthetic_{}p_{}i_{}f.pdf'.format(page_count, images, fonts))
+    if not os.path.exists(path):
+        print('generating {}'.format(path), file=sys.stderr)
+        make_pdf(path, page_count, images, fonts)
+    return path
+
+def _command_argv(command, src_pdf_path, ins_pdf_path, page_count):
+    # the work each command is timed on, for a source pdf of <page_count> pages
+    if command == 'merge':
+        return ['merge', src_pdf_path, src_pdf_path]
+    if command == 'remove':
+        return ['remove', src_pdf_path, 'even'] if page_count > 1 else ['remove', src_pdf_path, '1']
+    if command == 'insert':
+        return ['insert', src_pdf_path, ins_pdf_path, str(page_count // 2)]
+    return ['split', src_pdf_path, '--every', str(max(1, page_count // 10))]
+
+def _timed_run(argv, out_dir, repeats):
+    """
+    Runs a command <repeats> times, in a fresh worker process so that its
+    peak resident set size is its own.
+
+    @return result : dict
+        The time of each run in seconds, the total size in bytes of the
+        outputs, and the resident set size in bytes before the first run and
+        at its peak.
+    """
+    start_rss = current_rss()
+    arguments = helpers.set_args().parse_args(argv)
+    arguments.output_dir = out_dir
+    execute = helpers.get_command_controls(argv[0])['execute']
+
+    times = []
+    output_bytes = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outputs = execute(arguments)
+        times.append(time.perf_counter() - start)
+
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        output_bytes = sum(os.path.getsize(path) for path in outputs)
+        for path in outputs:
+            os.remove(path)
+
+    return {'seconds': min(times), 'seconds_all': times, 'output_bytes': output_bytes,
+            'start_rss': start_rss, 'peak_rss': peak_rss()}
+
+def compare_results(results, baseline, threshold):
+    """
+    Compares benchmark results with those of an earlier run.
+
+    @param  results : list
+        Results of this run, as written to the json file by bench.
+    @param  baseline : list
+        Results of the earlier run.
+    @param  threshold : float
+        Ratio to the baseline above which the time, peak resident set size
+        or output size of a benchmark counts as a regression e.g. 1.25.
+
+    @return regressions : list
+        (benchmark, measure, ratio) for each regression.
+    """
+    key = lambda result: (result['command'], result['pages'], result['images'], result['fonts'])
+    baseline = {key(result): result for result in baseline}
+
+    regressions = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        for measure in ('seconds', 'peak_rss', 'output_bytes'):
+            if old[measure] and result[measure] / old[measure] > threshold:
+                benchmark = '{} {}p {}i {}f'.format(*key(result))
+                regressions.append((benchmark, measure, result[measure] / old[measure]))
+
+    return regressions
+
+def bench(arguments):
+    """
+    Times merge, remove, insert and split on synthetic pdfs of each of the
+    given page counts, and writes the wall time, peak resident set size,
+    and output size of each to a json file, so that runs from different
+    versions can be compared (see compare_results). A markdown table of the
+    results is printed as well.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: pages, images, fonts, commands,
+        repeats, data_dir, output, compare, threshold
+
+    @return json_path : str
+        Path to the json file of results.
+    """
+    # args: pages, images, fonts, commands, repeats, data_dir, output, compare, threshold
+    data_dir = arguments.data_dir or os.path.join(tempfile.gettempdir(), 'poc-bench')
+    json_path = arguments.output or os.path.join(os.getcwd(),
+        'bench_'+datetime.datetime.now().strftime('%H%M%S_%d%m%Y')+'.json')
+
+    ins_pdf_path = _synthetic_pdf(data_dir, 10, arguments.images, arguments.fonts)
+    out_dir = tempfile.mkdtemp()
+    results = []
+
+    print('| command | pages | time (ms) | peak rss (MB) | output size (bytes) |')
+    print('|---|---:|---:|---:|---:|')
+    try:
+        for page_count in arguments.pages:
+            src_pdf_path = _synthetic_pdf(data_dir, page_count, arguments.images, arguments.fonts)
+            for command in arguments.commands:
+                argv = _command_argv(command, src_pdf_path, ins_pdf_path, page_count)
+
+                # a spawned (rather than forked) worker does not start out
+                # with this process's memory
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(_timed_run, argv, out_dir, arguments.repeats).result()
+
+                result = dict({'command': command, 'pages': page_count, 'images': arguments.images,
+                               'fonts': arguments.fonts, 'argv': argv}, **result)
+                results.append(result)
+                print('| {} | {} | {:.1f} | {:.1f} | {} |'.format(command, page_count, result['seconds']*1000,
+                      result['peak_rss']/2**20, result['output_bytes']))
+    finally:
+        shutil.rmtree(out_dir)
+
+    with open(json_path, 'w') as f:
+        json.dump({
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': arguments.repeats,
+            'results': results,
+        }, f, indent=1)
+
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, arguments.threshold)
+        for benchmark, measure, ratio in regressions:
+            print('{}: {} is {:.2f}x the baseline'.format(benchmark, measure, ratio), file=sys.stderr)
+        if regressions:
+            raise RuntimeError('{} regressions against {}, results in {}'.format(
+                len(regressions), arguments.compare, json_path))
+
+    return json_path
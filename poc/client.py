@@ -0,0 +1,77 @@
+import os
+import json
+import socket
+
+def default_address():
+    """
+    Returns the address of the poc serve daemon: the POC_SERVER environment
+    variable if it is set, otherwise a unix socket in the temp directory.
+
+    @return address : str
+        Path to a unix socket, or HOST:PORT.
+    """
+    if os.environ.get('POC_SERVER'):
+        return os.environ['POC_SERVER']
+
+    # imported here as it is slow to import, and only needed for the default
+    import tempfile
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'poc-{}.sock'.format(uid))
+
+def _is_tcp(address):
+    host, _, port = address.rpartition(':')
+    return bool(host) and port.isdigit()
+
+def _connect(address, timeout=None):
+    """
+    Opens a connection to the daemon at <address>.
+
+    @return sock : socket.socket (or raises OSError)
+    """
+    if _is_tcp(address):
+        host, _, port = address.rpartition(':')
+        return socket.create_connection((host, int(port)), timeout=timeout)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('unix sockets are not supported on this platform')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def send_request(argv, address=None):
+    """
+    Sends a command to a running poc serve daemon, to be run as if given at
+    the command line in the current working directory.
+
+    @param  argv : list
+        The command and its arguments e.g. ['split', 'in.pdf', '1-3'].
+    @param  address : str
+        Address of the daemon. Defaults to default_address().
+
+    @return result : dict
+        The result of the job (see batch.run_job), or None if no daemon is
+        running at <address>.
+    """
+    address = address or default_address()
+    if not _is_tcp(address) and not os.path.exists(address):
+        return None
+
+    try:
+        sock = _connect(address, timeout=1)
+    except OSError:
+        return None
+
+    with sock:
+        # wait as long as the job takes once it has been sent
+        sock.settimeout(None)
+        request = {'argv': list(argv), 'cwd': os.getcwd()}
+        sock.sendall((json.dumps(request)+'\n').encode())
+        with sock.makefile('rb') as f:
+            line = f.readline()
+
+    return json.loads(line) if line else None
@@ -1,183 +1,1626 @@
-
-import os
-import fitz
-import datetime
-
-def set_outfile_path(to_append=''):
-    current_date_and_time = datetime.datetime.now().strftime('%H%M%S_%d%m%Y')
-    out_pdf_path = os.path.join(os.getcwd(), current_date_and_time+to_append+'.pdf')
-    return out_pdf_path
-
-
-def merge(arguments):
-    """
-    Merges pdf files into a single pdf file in the order they are given in
-    at the command line. Output pdf file is saved to the current working 
-    directory. 
-
-    @param  arguments : arparse.Namespace
-        Command line arguments parsed by ArgumentParser.parse_args().
-        Will have the following attributes: pdfs
-    
-    @return out_pdf_path : str
-        Path to output pdf file.
-
-    """
-    # args: pdfs
-    pdfs = arguments.pdfs
-
-    # append pdfs
-    src_pdf = fitz.open(pdfs[0])
-    for pdf_path in pdfs[1:]:
-        with fitz.open(pdf_path) as f:
-            src_pdf.insert_pdf(f)
-
-    # save and close file
-    out_pdf_path = set_outfile_path() # set the output file
-    src_pdf.save(out_pdf_path)
-    src_pdf.close()
-
-    return out_pdf_path
-
-
-def remove(arguments):
-    """
-    Removes pages from the given pdf file. Output pdf file is saved to 
-    the current working directory. 
-
-    @param  arguments : arparse.Namespace
-        Command line arguments parsed by ArgumentParser.parse_args().
-        Will have the following attributes: src_pdf, pages
-    
-    @return out_pdf_path : str
-        Path to output pdf file.
-    
-    """
-    # args: src_pdf, pages
-    src_pdf_path = arguments.src_pdf
-    pages_to_rm = arguments.pages
- 
-    # convert page ranges to list of page numbers, and convert all page
-    # inputs to indices
-    pages_to_rm_corrected = set()
-    for p in pages_to_rm:
-        # page range
-        if '-' in p:
-            s, e = (int(i) for i in p.split('-'))
-            for i in range(s-1,e):
-                pages_to_rm_corrected.add(i)
-
-        # single page number
-        else:
-            pages_to_rm_corrected.add(int(p)-1)
-    
-    pages_to_rm_corrected = sorted(list(pages_to_rm_corrected))
-
-    # open pdf
-    src_pdf = fitz.open(src_pdf_path)
-
-    # check that page index does not exceed number of pages in the pdf
-    src_pdf_page_count = src_pdf.page_count
-    if not all(num <= src_pdf_page_count for num in pages_to_rm_corrected):
-        raise ValueError('Page numbers must be less than or equal to the \
-            total number of pages ({}) in the pdf.'.format(src_pdf_page_count))
-
-    # remove the pages
-    src_pdf.delete_pages(pages_to_rm_corrected)
-
-    # save and close  
-    out_pdf_path = set_outfile_path() # set the output file
-    src_pdf.save(out_pdf_path)
-    src_pdf.close()
-
-    return out_pdf_path
-
-def insert(arguments):
-    """
-    Inserts a pdf document into the source pdf document after the given
-    page number. The output pdf file is saved to the current working
-    directory. 
-
-    @param  arguments : arparse.Namespace
-        Command line arguments parsed by ArgumentParser.parse_args().
-        Will have the following attributes: src_pdf, ins_pdf, page
-    
-    @return out_pdf_path : str
-        Path to output pdf file. 
-    """
-
-    # args: src_pdf, ins_pdf, page
-    src_pdf_path = arguments.src_pdf
-    ins_pdf_path = arguments.ins_pdf
-    after_page = arguments.page
-
-    # open pdfs
-    src_pdf = fitz.open(src_pdf_path)
-    ins_pdf = fitz.open(ins_pdf_path)
-
-    # check that after_page does not exceed number of pages in src_pdf
-    if after_page > src_pdf.page_count :
-        raise ValueError('argument <page> exceeds the length of <src_pdf> ({} pages)'.format(src_pdf.page_count))
-
-    # insert ins_pdf into src_pdf
-    src_pdf.insert_pdf(ins_pdf, start_at=after_page)
-
-    # save and close  
-    out_pdf_path = set_outfile_path() # set the output file
-    src_pdf.save(out_pdf_path)
-    src_pdf.close()
-
-    return out_pdf_path
-
-
-def split(arguments):
-    """
-    Splits the source pdf into separate pdf files for each given page/page
-    range. Outputs are saved to the current woring directory.
-
-    @param  arguments : arparse.Namespace
-        Command line arguments parsed by ArgumentParser.parse_args().
-        Will have the following attributes: src_pdf, pages
-    
-    @return out_pdf_paths : tuple
-        Tuple containing the paths to the output pdf files.
-    
-    """
-
-    # args: src_pdf, pages
-    src_pdf_path = arguments.src_pdf
-    pages = arguments.pages
-    output_pdf_paths = []
-
-    # open source pdf
-    src_pdf = fitz.open(src_pdf_path)
-
-    for page_input in pages:
-
-        # open a new, empty pdf file
-        new_pdf = fitz.open()
-
-        # page range
-        if '-' in page_input:
-            start = int(page_input.split('-')[0])
-            end = int(page_input.split('-')[1])
-            new_pdf.insert_pdf(src_pdf, from_page=start-1, to_page=end-1)
-
-        # single page number
-        else:
-            new_pdf.insert_pdf(src_pdf, from_page=int(page_input)-1, to_page=int(page_input)-1)
-        
-        # save and close new pdf
-        out_pdf_path = set_outfile_path('_page_'+page_input) # set the output file
-        output_pdf_paths.append(out_pdf_path)
-        new_pdf.save(out_pdf_path)
-        new_pdf.close()
-
-    # close source pdf
-    src_pdf.close()
-
-    return tuple(output_pdf_paths)
-
-
-
-
+
+import os
+import re
+import sys
+import fitz
+import mmap
+import errno
+import shutil
+import inspect
+import itertools
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from .pages import PageSet, parse_page_order
+    from .doccache import DocumentCache
+    from .memory import current_rss, peak_rss
+    from .instrument import phase, count
+    from .dedupe import dedupe_objects
+    from .images import DEFAULT_DPI, DEFAULT_QUALITY, optimize_images, optimized_images, optimization_requested
+    from .prefetch import DEFAULT_DEPTH, DEFAULT_MAX_BYTES, ReadAhead, read_file
+    from .pageindex import load_index, page_tree_root, inherited_values, set_page_tree
+    from . import output
+except ImportError:
+    from pages import PageSet, parse_page_order
+    from doccache import DocumentCache
+    from memory import current_rss, peak_rss
+    from instrument import phase, count
+    from dedupe import dedupe_objects
+    from images import DEFAULT_DPI, DEFAULT_QUALITY, optimize_images, optimized_images, optimization_requested
+    from prefetch import DEFAULT_DEPTH, DEFAULT_MAX_BYTES, ReadAhead, read_file
+    from pageindex import load_index, page_tree_root, inherited_values, set_page_tree
+    import output
+
+# cache of open source pdfs, set by long running callers such as a batch
+_document_cache = None
+
+# source pdfs being read ahead of the command, set by reading_ahead
+_read_ahead = None
+
+# number of times each source pdf is still to be opened by the command, by
+# its absolute path, set by sharing_sources
+_source_uses = None
+
+# absolute paths of the source pdfs which check_sources only looked over,
+# for open_source_pdf to finish checking, set by sharing_sources
+_unchecked_sources = None
+
+# number of source pdfs kept open by sharing_sources, from check_sources 
+# to running the command
+MAX_SHARED_SOURCES = 32
+
+# bytes read from the start and end of a source pdf to look it over (see
+# _look_over_source), the most by which the pdf header and the end of file
+# marker may be off from the ends of the file
+PEEK_BYTES = 1024
+
+# options passed to fitz.Document.save for each save profile
+SAVE_PROFILES = {
+    # no clean up, as quick to write as possible
+    'fast': {},
+    # drop unused objects, merge duplicates, and compress everything
+    'compact': {'garbage': 4, 'clean': True, 'deflate': True, 'deflate_images': True, 
+                'deflate_fonts': True},
+    # arranged for display of the first page before the whole file arrives
+    'linearized': {'garbage': 3, 'deflate': True, 'linear': True},
+}
+
+# set once a linearized save has failed, so that it is not tried again
+_linear_unsupported = False
+
+# object streams are only supported by newer versions of PyMuPDF
+if 'use_objstms' in inspect.signature(fitz.Document.save).parameters:
+    SAVE_PROFILES['compact']['use_objstms'] = True
+
+def set_outfile_path(arguments, source=None, page_range='', seq=1, extension='.pdf'):
+    """
+    Reserves a unique path for an output of a command, named by the name
+    template given at the command line in the output directory given at
+    the command line (see output.format_name and output.reserve_path).
+
+    @param  arguments : arparse.Namespace
+        Command line arguments, which may have the attributes output_dir
+        and name.
+    @param  source : str
+        Path to the source pdf the output is named after.
+    @param  page_range : str
+        Page selection held by the output, for split.
+    @param  seq : int
+        Number of the output, counting from 1.
+    @param  extension : str
+        Extension of the output. Defaults to '.pdf'.
+
+    @return out_pdf_path : str
+    """
+    out_dir = getattr(arguments, 'output_dir', None)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    return output.output_path(out_dir, getattr(arguments, 'name', None), source, page_range, seq,
+                              getattr(arguments, 'invoked_command', ''), extension)
+
+
+def set_document_cache(document_cache):
+    """
+    Sets the cache that source pdfs are opened through. Sources are then
+    shared between commands rather than opened and closed by each one.
+
+    @param  document_cache : DocumentCache
+        The cache to use, or None to open (and close) sources directly.
+
+    @return None
+    """
+    global _document_cache
+    _document_cache = document_cache
+    return None
+
+def optimizing(arguments):
+    """
+    Context manager which optimizes the images of the pdfs saved in its
+    block (see images.optimized_images) as asked by the command line 
+    arguments --optimize and --image-quality, using the command's jobs.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments, which may have the attributes optimize, 
+        image_quality and jobs.
+    """
+    return optimized_images(getattr(arguments, 'optimize', None), getattr(arguments, 'image_quality', DEFAULT_QUALITY),
+                            getattr(arguments, 'jobs', 1))
+
+
+def save_pdf(pdf, out_pdf, save_profile=None, atomic=True, garbage=0):
+    """
+    Saves a pdf with the options of the given save profile. Newer versions
+    of MuPDF cannot linearize, in which case a linearized save falls back
+    to the same save without linearization.
+
+    A pdf saved to a path is written to a temporary file first, which is
+    then moved into place (see output.commit), so the path never holds a
+    part written pdf.
+
+    Inside an images.optimized_images block (see optimizing), the images of
+    the pdf are downsampled and recompressed before it is saved.
+
+    @param  pdf : fitz.Document
+        The pdf to save.
+    @param  out_pdf : str, file object or None
+        Path to save the pdf to, a binary file object to write it to, or 
+        None to return it as bytes.
+    @param  save_profile : str
+        One of the SAVE_PROFILES, or None for a plain save.
+    @param  atomic : bool
+        Write a path by way of a temporary file. Defaults to True.
+    @param  garbage : int
+        Garbage collection level to save with at least, whatever the save
+        profile. Defaults to 0.
+
+    @return pdf_bytes : bytes (or None if <out_pdf> is not None)
+    """
+    global _linear_unsupported
+    options = SAVE_PROFILES[save_profile] if save_profile else {}
+    if garbage > options.get('garbage', 0):
+        options = dict(options, garbage=garbage)
+    if options.get('linear') and _linear_unsupported:
+        options = dict(options, linear=False)
+
+    settings = optimization_requested()
+    if settings:
+        optimize_images(pdf, **settings)
+
+    target = output.temp_path(out_pdf) if atomic and _is_path(out_pdf) else out_pdf
+    try:
+        with phase('save'):
+            try:
+                pdf_bytes = _save(pdf, target, options)
+            except Exception as e:
+                # the error type differs between versions of PyMuPDF
+                if not options.get('linear') or 'linear' not in str(e).lower():
+                    raise
+                print('warning: linearized save is not supported ({}), saving without it'.format(e), file=sys.stderr)
+                _linear_unsupported = True
+                pdf_bytes = _save(pdf, target, dict(options, linear=False))
+    except BaseException:
+        if target is not out_pdf:
+            output.discard(target)
+        raise
+
+    _count_written(pdf, os.path.getsize(target) if _is_path(target) else len(pdf_bytes))
+    if target is not out_pdf:
+        output.commit(target, out_pdf)
+
+    return None if out_pdf is not None else pdf_bytes
+
+def _count_written(pdf, size):
+    count('pdfs_written')
+    count('pages_written', pdf.page_count)
+    count('bytes_written', size)
+
+def _save(pdf, out_pdf, options):
+    if _is_path(out_pdf):
+        pdf.save(out_pdf, **options)
+        return None
+    pdf_bytes = pdf.tobytes(**options)
+    if out_pdf is not None:
+        out_pdf.write(pdf_bytes)
+    return pdf_bytes
+
+def _is_path(pdf):
+    return isinstance(pdf, (str, os.PathLike))
+
+@contextlib.contextmanager
+def closing_on_error(pdf):
+    """
+    Context manager which closes a new pdf if its block raises, and leaves
+    it open otherwise, to be saved. Otherwise a pdf being built when a copy
+    fails stays open for as long as the traceback is kept, which a long 
+    running caller (e.g. serve, or a batch logging its errors) may do.
+
+    @param  pdf : fitz.Document
+
+    @return pdf : fitz.Document
+    """
+    try:
+        yield pdf
+    except BaseException:
+        pdf.close()
+        raise
+
+
+@contextlib.contextmanager
+def open_source_pdf(pdf):
+    """
+    Context manager that opens a source pdf, through the document cache if
+    one is set and the pdf is given by its path. Source pdfs are only read
+    from, never modified, since they may be shared with other commands.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the source pdf, its contents, or a binary file object to
+        read it from.
+
+    @return src_pdf : fitz.Document
+    """
+    # a pdf read ahead is opened from memory, unless check_sources has
+    # already opened it (from memory too) into the document cache
+    data = _read_ahead.take(pdf) if _is_path(pdf) and _read_ahead is not None else None
+
+    if _is_path(pdf) and _document_cache is not None:
+        misses = _document_cache.misses
+        with phase('open'):
+            src_pdf = _document_cache.get(pdf, data)
+        if _unchecked_sources and os.path.abspath(pdf) in _unchecked_sources:
+            _unchecked_sources.discard(os.path.abspath(pdf))
+            _check_document(src_pdf, pdf)
+        count('pdfs_read')
+        count('pages_read', src_pdf.page_count)
+        # a pdf already open in the document cache is not read again
+        if _document_cache.misses > misses:
+            count('bytes_read', os.path.getsize(pdf))
+        try:
+            yield src_pdf
+        finally:
+            _used_source(pdf)
+        return
+
+    with open_private_pdf(pdf if data is None else data) as src_pdf:
+        yield src_pdf
+
+@contextlib.contextmanager
+def open_private_pdf(pdf, count_bytes=True):
+    """
+    Context manager that opens a pdf for the caller alone, never through 
+    the document cache, so that it may be modified (e.g. by rearrange), 
+    and closes it on leaving the block.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  count_bytes : bool
+        Count the size of the pdf as bytes read. Defaults to True.
+
+    @return src_pdf : fitz.Document
+    """
+    with phase('open'):
+        if _is_path(pdf):
+            size = os.path.getsize(pdf)
+            src_pdf = fitz.open(pdf)
+        else:
+            # older versions of PyMuPDF only open bytes, bytearrays and 
+            # file objects
+            stream = pdf.read() if hasattr(pdf, 'read') else pdf
+            stream = bytes(stream) if isinstance(stream, memoryview) else stream
+            size = len(stream)
+            src_pdf = fitz.open(stream=stream, filetype='pdf')
+
+    with src_pdf:
+        count('pdfs_read')
+        count('pages_read', src_pdf.page_count)
+        if count_bytes:
+            count('bytes_read', size)
+        yield src_pdf
+
+@contextlib.contextmanager
+def open_mapped_pdf(pdf_path):
+    """
+    Context manager that opens a pdf file through a read only memory map,
+    for large-file mode. Objects are read from the map as they are needed,
+    so memory use depends on the parts of the pdf used rather than its
+    size, and the file, map and pdf are all closed on leaving the block,
+    even if it raises.
+
+    Versions of PyMuPDF which cannot open a memoryview open the file by
+    its path instead, which also reads objects as they are needed.
+
+    @param  pdf_path : str
+        Path to the pdf.
+
+    @return src_pdf : fitz.Document
+    """
+    with contextlib.ExitStack() as stack:
+        with phase('open'):
+            f = stack.enter_context(open(pdf_path, 'rb'))
+            size = os.fstat(f.fileno()).st_size
+            mapped = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) if size else None
+            view = stack.enter_context(memoryview(mapped)) if mapped is not None else None
+            try:
+                src_pdf = fitz.open(stream=view, filetype='pdf')
+            except (TypeError, ValueError, RuntimeError):
+                if view is None:
+                    raise
+                src_pdf = fitz.open(pdf_path)
+        # the pdf holds the view, so is closed first
+        with src_pdf:
+            count('pdfs_read')
+            count('pages_read', src_pdf.page_count)
+            count('bytes_read', size)
+            yield src_pdf
+
+def _copy_file(src_path, dst_path):
+    """
+    Copies a file within the kernel where the platform supports it (which
+    some file systems do by sharing the data between the files rather than
+    copying it), else by way of shutil.copyfile.
+
+    @return None
+    """
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(src_path, dst_path)
+        return None
+
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
+    return None
+
+
+def check_sources(pdf_paths):
+    """
+    Checks that source pdfs can be read, before any output is written, so
+    that a bad source fails a command at once rather than partway through
+    it. Opening a pdf reads only its trailer, cross reference table and 
+    page count, not its pages, so this is cheap even for large pdfs. The
+    pdfs are opened through the document cache, if one is set (see 
+    sharing_sources), so that they are not opened again to run the command
+    (or, in a batch, to check the next job with the same source), from 
+    memory if they are being read ahead (see reading_ahead). A pdf
+    with an up to date index (see pageindex) is not opened at all, since it
+    was checked when it was indexed.
+
+    Once sharing_sources holds as many pdfs open as it keeps, the rest are
+    only looked over (see _look_over_source) rather than opened, and the 
+    check is finished when the command opens them, so that the number of
+    files held open does not grow with the number of sources.
+
+    @param  pdf_paths : list
+        Paths to the source pdfs.
+
+    @return page_counts : list
+        The number of pages in each pdf, or None for those only looked
+        over.
+        (Or raises ValueError for a pdf which cannot be opened, needs a 
+        password, or has no pages, and OSError for one which cannot be 
+        read e.g. for want of file descriptors.)
+    """
+    page_counts = []
+    for pdf_path in pdf_paths:
+        with phase('check'):
+            page_counts.append(_check_source(pdf_path))
+
+    return page_counts
+
+def _check_source(pdf_path):
+    page_index = load_index(pdf_path)
+    if page_index is not None:
+        return page_index.page_count
+
+    # errors reading the file are raised as they are, since PyMuPDF reports
+    # them as the file not being a pdf
+    looks_sound = _look_over_source(pdf_path)
+    if _unchecked_sources is not None and len(_document_cache) >= _document_cache.max_docs and looks_sound:
+        _unchecked_sources.add(os.path.abspath(pdf_path))
+        return None
+
+    try:
+        if _document_cache is not None:
+            # a pdf being read ahead is opened from memory, into the cache, so
+            # that running the command neither reads nor parses it again
+            data = _read_ahead.take(pdf_path) if _read_ahead is not None else None
+            misses = _document_cache.misses
+            src_pdf = _document_cache.get(pdf_path, data)
+            # counted here, since running the command will not read it again
+            if _document_cache.misses > misses:
+                count('bytes_read', os.path.getsize(pdf_path))
+        else:
+            src_pdf = fitz.open(pdf_path)
+    except RuntimeError as e:
+        # the error type differs between versions of PyMuPDF
+        raise ValueError('{} cannot be read as a pdf ({})'.format(pdf_path, e))
+
+    try:
+        return _check_document(src_pdf, pdf_path)
+    finally:
+        if _document_cache is None:
+            src_pdf.close()
+
+def _look_over_source(pdf_path):
+    """
+    Looks over a source pdf without parsing it: that it has a pdf header,
+    and ends by pointing to a cross reference table whose trailer does not
+    encrypt the pdf. Reads only the ends of the file and the start of the
+    table, with the file's own errors (e.g. too many open files) raised as
+    they are.
+
+    @param  pdf_path : str
+
+    @return looks_sound : bool
+        Whether the pdf looks sound, or it must be opened to tell (e.g. a 
+        damaged pdf, which PyMuPDF may be able to repair, or an encrypted
+        one).
+    """
+    with open(pdf_path, 'rb') as f:
+        head = f.read(PEEK_BYTES)
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(0, size - PEEK_BYTES))
+        tail = f.read()
+        offsets = re.findall(rb'startxref\s+(\d+)', tail)
+        if b'%PDF-' not in head or not offsets or int(offsets[-1]) >= size:
+            return False
+        f.seek(int(offsets[-1]))
+        table = f.read(PEEK_BYTES)
+
+    # the trailer is after a cross reference table, or is the dictionary of
+    # a cross reference stream
+    if table.startswith(b'xref'):
+        trailer = tail[tail.rfind(b'trailer'):] if b'trailer' in tail else None
+    else:
+        trailer = table[:table.find(b'stream')] if re.match(rb'\d+\s+\d+\s+obj', table) and b'stream' in table \
+            else None
+    return trailer is not None and b'/Encrypt' not in trailer
+
+def _check_document(src_pdf, pdf_path):
+    # the checks of a source pdf made once it is open
+    if src_pdf.needs_pass:
+        raise ValueError('{} is encrypted, and needs a password to be read'.format(pdf_path))
+    if not src_pdf.page_count:
+        raise ValueError('{} has no pages'.format(pdf_path))
+    return src_pdf.page_count
+
+@contextlib.contextmanager
+def sharing_sources(pdf_paths):
+    """
+    Context manager which opens source pdfs through a document cache for
+    the length of its block, if one is not already set (e.g. by a batch), 
+    so that the pdfs opened by check_sources are used to run the command.
+    Up to MAX_SHARED_SOURCES are kept open from the check; the sources 
+    after them are only looked over by the check, and opened when the 
+    command reaches them. Each is closed once the command has opened it as
+    many times as it is given, rather than kept open to the end.
+
+    @param  pdf_paths : list
+        Paths to the source pdfs, once for each time the command opens
+        them.
+    """
+    global _source_uses, _unchecked_sources
+    if _document_cache is not None:
+        yield
+        return
+
+    source_uses = collections.Counter(os.path.abspath(path) for path in pdf_paths if _is_path(path))
+    document_cache = DocumentCache(max_docs=max(1, min(len(source_uses), MAX_SHARED_SOURCES)))
+    set_document_cache(document_cache)
+    _source_uses, _unchecked_sources = source_uses, set()
+    try:
+        yield
+    finally:
+        _source_uses = _unchecked_sources = None
+        set_document_cache(None)
+        document_cache.close()
+
+def _used_source(pdf_path):
+    # closes a source shared by sharing_sources once the command has opened
+    # it as many times as it was given
+    if _source_uses is None:
+        return
+    key = os.path.abspath(pdf_path)
+    _source_uses[key] -= 1
+    if _source_uses[key] <= 0:
+        _document_cache.discard(pdf_path)
+
+
+@contextlib.contextmanager
+def reading_ahead(pdf_paths, depth=DEFAULT_DEPTH, max_bytes=DEFAULT_MAX_BYTES, read=read_file):
+    """
+    Context manager which reads source pdfs into memory ahead of the 
+    command for the length of its block (see prefetch.ReadAhead), starting
+    at once. The pdfs are opened from memory by check_sources, or by 
+    open_source_pdf, when they are given their paths in the same order.
+    With a document cache (see sharing_sources) the pdfs are opened once,
+    by check_sources, and the command waits on the reads while they are 
+    checked, rather than while they are copied; without one (e.g. a 
+    chunked merge) check_sources opens them by their paths, and 
+    open_source_pdf from memory.
+
+    @param  pdf_paths : list
+        Paths to the source pdfs, in the order they will be opened.
+    @param  depth : int
+        Number of pdfs to read ahead at a time, or 0 to not read ahead.
+    @param  max_bytes : int
+        Total size in bytes of the pdfs read ahead but not yet opened.
+    @param  read : function
+        Called with a path to read the whole of it. Defaults to 
+        prefetch.read_file.
+    """
+    global _read_ahead
+    if not depth:
+        yield
+        return
+
+    previous = _read_ahead
+    with ReadAhead(pdf_paths, depth, max_bytes, read) as read_ahead:
+        _read_ahead = read_ahead
+        try:
+            yield
+        finally:
+            _read_ahead = previous
+
+def _read_ahead_options(arguments):
+    # depth and budget of the read ahead asked for at the command line
+    depth = getattr(arguments, 'read_ahead', DEFAULT_DEPTH)
+    max_mb = getattr(arguments, 'read_ahead_mb', None)
+    return depth, max_mb*1024*1024 if max_mb else DEFAULT_MAX_BYTES
+
+
+def merge(arguments):
+    """
+    Merges pdf files into a single pdf file in the order they are given in
+    at the command line. Output pdf file is saved to the current working 
+    directory. 
+
+    If a chunk size is given, the output is built up on disk that many 
+    input pdfs at a time (see _merge_in_chunks), so that memory use does 
+    not grow with the total size of the inputs.
+
+    With dedupe, objects repeated across the inputs (e.g. a letterhead 
+    image) are only saved once (see dedupe.dedupe_objects).
+
+    With optimize, images drawn at more than the given dpi are downsampled
+    and recompressed (see images.optimize_images).
+
+    Unless read_ahead is 0, the pdfs are read into memory a few ahead of 
+    the one being copied (see reading_ahead).
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: pdfs, from_file, chunk_size,
+        max_rss, dedupe, optimize, image_quality, read_ahead, 
+        read_ahead_mb, save_profile
+    
+    @return out_pdf_path : str
+        Path to output pdf file.
+
+    """
+    # args: pdfs, from_file, chunk_size, max_rss, dedupe, optimize, image_quality, read_ahead, read_ahead_mb, save_profile
+    pdfs = arguments.pdfs + (getattr(arguments, 'from_file', None) or [])
+    chunk_size = getattr(arguments, 'chunk_size', None)
+    dedupe = getattr(arguments, 'dedupe', False)
+    save_profile = getattr(arguments, 'save_profile', None)
+    if chunk_size and dedupe:
+        # each chunk is appended without reading the chunks before it
+        raise ValueError('--dedupe cannot be used with --chunk-size')
+    if chunk_size and getattr(arguments, 'optimize', None):
+        # the chunks after the first are appended without a full save
+        raise ValueError('--optimize cannot be used with --chunk-size')
+    # a chunked merge opens only a chunk of the pdfs at a time, so does not
+    # keep them open from the check
+    with (contextlib.nullcontext() if chunk_size else sharing_sources(pdfs)), \
+            reading_ahead(pdfs, *_read_ahead_options(arguments)):
+        check_sources(pdfs)
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+            out_pdf_path = set_outfile_path(arguments, pdfs[0] if pdfs else None) # set the output file
+
+            if chunk_size:
+                max_rss = getattr(arguments, 'max_rss', None)
+                _merge_in_chunks(pdfs, out_pdf_path, chunk_size, max_rss and max_rss*1024*1024, save_profile)
+            else:
+                _, dedupe_stats = _merge_pdfs(pdfs, out_pdf_path, save_profile, dedupe)
+
+    if dedupe:
+        print('dedupe: shared {} duplicate objects, saving {:.1f} KB'.format(dedupe_stats[0],
+              dedupe_stats[1]/1024), file=sys.stderr)
+
+    return out_pdf_path
+
+
+def merge_pdfs(pdfs, output=None, save_profile=None, dedupe=False):
+    """
+    Merges pdfs into a single pdf in the order they are given in, keeping
+    the metadata of the first one and the bookmarks of each.
+
+    @param  pdfs : list
+        The pdfs to merge, each given as a path, bytes, bytearray, 
+        memoryview or binary file object.
+    @param  output : str or file object
+        Path to save the merged pdf to, or a binary file object to write
+        it to. Defaults to None (return it as bytes).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+    @param  dedupe : bool
+        Share the images, fonts and page contents repeated across the pdfs
+        rather than saving a copy for each. Defaults to False.
+
+    @return pdf_bytes : bytes (or None if <output> is given)
+    """
+    return _merge_pdfs(pdfs, output, save_profile, dedupe)[0]
+
+def _merge_pdfs(pdfs, output=None, save_profile=None, dedupe=False):
+    # merge_pdfs, also returning (copies, copied_bytes) shared by dedupe, or
+    # None without it, for merge to report
+    with fitz.open() as out_pdf:
+        tocs = []
+        for pdf in pdfs:
+            with open_source_pdf(pdf) as f:
+                if not out_pdf.page_count:
+                    out_pdf.set_metadata(f.metadata)
+                tocs.append((f.get_toc(simple=False), _page_offset(out_pdf.page_count)))
+                with phase('insert_pdf'):
+                    out_pdf.insert_pdf(f)
+        _copy_toc(out_pdf, tocs)
+
+        if not dedupe:
+            return save_pdf(out_pdf, output, save_profile), None
+
+        with phase('dedupe'):
+            copies, copied_bytes = dedupe_objects(out_pdf)
+        count('dedupe_objects', copies)
+        count('dedupe_bytes', copied_bytes)
+        # the copies are no longer used, so are dropped by garbage collection,
+        # which at level 2 also renumbers the objects left
+        return save_pdf(out_pdf, output, save_profile, garbage=2), (copies, copied_bytes)
+
+
+def _merge_in_chunks(pdfs, out_pdf_path, chunk_size, max_rss=None, save_profile=None):
+    """
+    Merges pdf files into <out_pdf_path> <chunk_size> files at a time. The
+    first chunk is saved as a new pdf, and each chunk after that is 
+    appended to it with an incremental save, after which the output is 
+    closed and the pages copied into it are freed. Memory use is therefore
+    bounded by the size of a chunk rather than the size of all the inputs.
+
+    If the resident set size grows past <max_rss> after a chunk, the chunk
+    size is halved (down to a single pdf) for the rest of the merge. The
+    peak resident set size is reported on stderr at the end.
+
+    The save profile is applied in full to the first chunk only, since an
+    incremental save cannot garbage collect or linearize. The chunks after
+    it are compressed if the profile compresses.
+
+    @param  pdfs : list
+        Paths to the pdf files to merge.
+    @param  out_pdf_path : str
+        Path to the output pdf file.
+    @param  chunk_size : int
+        Number of pdf files to copy into the output before it is saved.
+    @param  max_rss : int
+        Resident set size, in bytes, to keep the merge under. Defaults to
+        None (no limit).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+    @return None
+    """
+    profile = SAVE_PROFILES[save_profile] if save_profile else {}
+    incremental_options = {k: v for k, v in profile.items() if k.startswith('deflate')}
+
+    # the output is built up in a temporary file, and moved into place
+    # once every chunk is in it
+    final_pdf_path = out_pdf_path
+    out_pdf_path = output.temp_path(final_pdf_path)
+    try:
+        _merge_chunks(pdfs, out_pdf_path, chunk_size, max_rss, save_profile, incremental_options)
+    except BaseException:
+        output.discard(out_pdf_path)
+        raise
+    output.commit(out_pdf_path, final_pdf_path)
+
+    print('merged {} pdfs, peak rss {:.1f} MB'.format(len(pdfs), peak_rss()/(1024*1024)), file=sys.stderr)
+
+    return None
+
+def _merge_chunks(pdfs, out_pdf_path, chunk_size, max_rss, save_profile, incremental_options):
+    start = 0
+    while start < len(pdfs):
+        chunk = pdfs[start:start+chunk_size]
+
+        # the output is reopened from disk for each chunk after the first,
+        # so only the objects it needs to append pages are loaded
+        with phase('open'):
+            out_pdf = fitz.open(out_pdf_path) if start else fitz.open()
+        with out_pdf:
+            # the bookmarks of the chunks before are rewritten with those of
+            # this chunk after them
+            tocs = [(out_pdf.get_toc(simple=False), _page_offset(0))]
+            for pdf_path in chunk:
+                with open_source_pdf(pdf_path) as f:
+                    if not out_pdf.page_count:
+                        out_pdf.set_metadata(f.metadata)
+                    tocs.append((f.get_toc(simple=False), _page_offset(out_pdf.page_count)))
+                    with phase('insert_pdf'):
+                        out_pdf.insert_pdf(f)
+            _copy_toc(out_pdf, tocs)
+
+            if start:
+                with phase('save'):
+                    out_pdf.save(out_pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP,
+                                 **incremental_options)
+                _count_written(out_pdf, os.path.getsize(out_pdf_path))
+            else:
+                save_pdf(out_pdf, out_pdf_path, save_profile, atomic=False)
+        start += len(chunk)
+
+        # release the objects mupdf has cached, then check memory use
+        with phase('store_shrink'):
+            fitz.TOOLS.store_shrink(100)
+        if max_rss and current_rss() > max_rss and chunk_size > 1:
+            chunk_size = max(1, chunk_size // 2)
+
+    return None
+
+
+def remove(arguments):
+    """
+    Removes pages from the given pdf file. Output pdf file is saved to 
+    the current working directory. 
+
+    With the 'fast' save profile the output is a copy of the source pdf 
+    with the removal appended as an incremental update, so only the changes
+    are written rather than every remaining page. With --large, the same is
+    done without reading the pages that are kept (see remove_pages).
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, pages, save_profile,
+        large, optimize, image_quality
+    
+    @return out_pdf_path : str
+        Path to output pdf file.
+    
+    """
+    # args: src_pdf, pages, save_profile, large, optimize, image_quality
+    large = getattr(arguments, 'large', False)
+    with sharing_sources([arguments.src_pdf]):
+        # large-file mode checks the pages from its own (mapped) open
+        if not large:
+            page_count, = check_sources([arguments.src_pdf])
+            PageSet.parse(arguments.pages, page_count).check(page_count)
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+            out_pdf_path = set_outfile_path(arguments, arguments.src_pdf) # set the output file
+            remove_pages(arguments.src_pdf, arguments.pages, out_pdf_path, getattr(arguments, 'save_profile', None),
+                         large)
+
+    return out_pdf_path
+
+def remove_pages(pdf, pages, output=None, save_profile=None, large=False):
+    """
+    Removes pages from a pdf, keeping its metadata, and its bookmarks to
+    the pages kept.
+
+    With the 'fast' save profile, and a pdf and output given by their 
+    paths, the output is a copy of the pdf with the removal appended as an
+    incremental update, so only the changes are written rather than every
+    remaining page (unless images are being optimized, see optimizing).
+
+    In large-file mode the same is done, but the pdf is opened through a 
+    memory map and the removed pages are unlinked from the page tree 
+    without the usual clean up of links and bookmarks that point to them,
+    which reads every page. Time and memory then depend on the pages 
+    removed rather than the size of the pdf. Links and bookmarks to the
+    removed pages are left pointing nowhere, which viewers ignore. If the 
+    pdf has an up to date index (see pageindex), the page tree is not read
+    either, but written out afresh listing the pages kept.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  pages : list, str or PageSet
+        The pages to remove, given as at the command line e.g. ['2-3', '9'].
+    @param  output : str or file object
+        Path to save the output pdf to, or a binary file object to write it
+        to. Defaults to None (return it as bytes).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+    @param  large : bool
+        Use large-file mode, which needs <pdf> and <output> to be paths, 
+        and a save profile of None or 'fast'. Defaults to False.
+
+    @return pdf_bytes : bytes (or None if <output> is given)
+    """
+    if large:
+        _check_large(pdf, output, save_profile)
+        with open_mapped_pdf(pdf) as src_pdf:
+            page_count = src_pdf.page_count
+            pages_to_rm = pages if isinstance(pages, PageSet) else PageSet.parse(pages, page_count)
+            pages_to_rm.check(page_count)
+            _check_incremental(src_pdf, pdf)
+        # with an up to date index, the page tree is written out with the
+        # pages kept, rather than read to remove the others one by one
+        page_index = load_index(pdf)
+        if page_index is not None:
+            update = lambda out_pdf: page_index.restrict(out_pdf, list(pages_to_rm.complement(page_count)))
+        else:
+            update = lambda out_pdf: _unlink_pages(out_pdf, pages_to_rm)
+        _update_copy(pdf, output, update, 'delete_pages')
+        return None
+
+    # open pdf
+    with open_source_pdf(pdf) as src_pdf:
+
+        # check that the pages to remove are in the pdf
+        src_pdf_page_count = src_pdf.page_count
+        pages_to_rm = pages if isinstance(pages, PageSet) else PageSet.parse(pages, src_pdf_page_count)
+        pages_to_rm.check(src_pdf_page_count)
+
+        if save_profile == 'fast' and _is_path(pdf) and _is_path(output) and src_pdf.can_save_incrementally() and \
+                not optimization_requested():
+            _remove_incremental(pdf, pages_to_rm, output)
+            return None
+
+        # copy the runs of pages between the removed pages to a new pdf
+        with closing_on_error(fitz.open()) as out_pdf:
+            out_pdf.set_metadata(src_pdf.metadata)
+            _insert_page_set(out_pdf, src_pdf, pages_to_rm.complement(src_pdf_page_count))
+            # each page kept moves up by the number of pages removed before it
+            removed_before = lambda page: len(pages_to_rm & PageSet([(1, page)]))
+            _copy_toc(out_pdf, [(src_pdf.get_toc(simple=False),
+                                 lambda page: None if page in pages_to_rm else page - removed_before(page))])
+
+    # save and close  
+    with out_pdf:
+        return save_pdf(out_pdf, output, save_profile)
+
+def _insert_page_set(out_pdf, src_pdf, page_set):
+    """
+    Copies the pages of a page set from the source pdf to the end of the 
+    output pdf, one run of pages at a time. The graft map is kept between
+    runs (final=False) so that objects shared by the runs, such as fonts,
+    are only copied once.
+
+    @param  out_pdf : fitz.Document
+        The pdf to copy the pages to.
+    @param  src_pdf : fitz.Document
+        The pdf to copy the pages from.
+    @param  page_set : PageSet
+        The pages to copy.
+
+    @return None
+    """
+    ranges = page_set.ranges()
+    with phase('insert_pdf'):
+        for i, (from_page, to_page) in enumerate(ranges):
+            out_pdf.insert_pdf(src_pdf, from_page=from_page, to_page=to_page, final=(i == len(ranges)-1))
+
+    return None
+
+def _page_offset(offset):
+    # page map of a pdf copied to the end of one of <offset> pages
+    return lambda page: page + offset
+
+def _copy_toc(out_pdf, tocs):
+    """
+    Sets the bookmarks of a pdf made of pages copied from other pdfs, from
+    their bookmarks, which fitz.Document.insert_pdf does not copy.
+
+    @param  out_pdf : fitz.Document
+    @param  tocs : list
+        (toc, page_map) for each pdf, in the order their bookmarks are to
+        be listed, where toc is as returned by get_toc(simple=False), and 
+        page_map is called with a page number of the pdf and returns its 
+        page number in <out_pdf>, or None if it was not copied. Bookmarks 
+        to pages not copied are dropped, and those under them moved up a
+        level where need be.
+
+    @return None
+    """
+    toc = []
+    for src_toc, page_map in tocs:
+        for level, title, page, *dest in src_toc:
+            # bookmarks without a page in the pdf (e.g. to other files) are
+            # kept as they are
+            if page > 0:
+                page = page_map(page)
+                if page is None:
+                    continue
+            toc.append([min(level, toc[-1][0]+1 if toc else 1), title, page] + dest)
+    if toc:
+        out_pdf.set_toc(toc)
+    return None
+
+def _remove_incremental(src_pdf_path, pages_to_rm, out_pdf_path):
+    """
+    Copies the source pdf file to <out_pdf_path>, then removes the pages 
+    from the copy and saves the change as an incremental update.
+
+    @param  src_pdf_path : str
+        Path to the source pdf.
+    @param  pages_to_rm : PageSet
+        The pages to remove.
+    @param  out_pdf_path : str
+        Path to the output pdf.
+
+    @return None
+    """
+    def delete_pages(out_pdf):
+        # from the end, so that the pages still to remove keep their indices
+        for from_page, to_page in reversed(pages_to_rm.ranges()):
+            out_pdf.delete_pages(from_page=from_page, to_page=to_page)
+
+    _update_copy(src_pdf_path, out_pdf_path, delete_pages, 'delete_pages')
+    return None
+
+def _unlink_pages(out_pdf, pages_to_rm):
+    """
+    Removes pages from the page tree only, leaving links and bookmarks to
+    them in place, for large-file mode.
+    """
+    # named _deletePage by older versions of PyMuPDF
+    delete_page = getattr(out_pdf, '_delete_page', None) or out_pdf._deletePage
+    for from_page, to_page in reversed(pages_to_rm.ranges()):
+        for page in range(to_page, from_page-1, -1):
+            delete_page(page)
+
+def _check_large(pdf, output, save_profile):
+    if not (_is_path(pdf) and _is_path(output)):
+        raise ValueError('large-file mode needs the source and output pdfs to be paths')
+    if save_profile not in (None, 'fast'):
+        raise ValueError('large-file mode appends the changes to a copy of the source pdf, so '
+                         'cannot be used with the {} save profile'.format(save_profile))
+    if optimization_requested():
+        raise ValueError('large-file mode appends the changes to a copy of the source pdf, so '
+                         'cannot be used with --optimize')
+
+def _check_incremental(src_pdf, pdf_path):
+    if not src_pdf.can_save_incrementally():
+        raise ValueError('{} cannot be updated in place (it may be damaged), so cannot be used in '
+                         'large-file mode'.format(pdf_path))
+
+def _update_copy(src_pdf_path, out_pdf_path, update, phase_name):
+    """
+    Copies the source pdf file to <out_pdf_path>, then makes a change to 
+    the copy and saves it as an incremental update, so only the change is
+    written. 
+
+    @param  src_pdf_path : str
+        Path to the source pdf.
+    @param  out_pdf_path : str
+        Path to the output pdf.
+    @param  update : callable
+        Makes the change, given the copy as a fitz.Document. 
+    @param  phase_name : str
+        Name of the instrument phase the change is timed under.
+
+    @return None
+    """
+    temp_pdf_path = output.temp_path(out_pdf_path)
+    try:
+        with phase('copy_file'):
+            _copy_file(src_pdf_path, temp_pdf_path)
+        with phase('open'):
+            out_pdf = fitz.open(temp_pdf_path)
+        with out_pdf:
+            with phase(phase_name):
+                update(out_pdf)
+            with phase('save'):
+                out_pdf.save(temp_pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            _count_written(out_pdf, os.path.getsize(temp_pdf_path))
+    except BaseException:
+        output.discard(temp_pdf_path)
+        raise
+    output.commit(temp_pdf_path, out_pdf_path)
+
+    return None
+
+def insert(arguments):
+    """
+    Inserts a pdf document into the source pdf document after the given
+    page number. The output pdf file is saved to the current working
+    directory. 
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, ins_pdf, page, 
+        save_profile, large, optimize, image_quality, read_ahead, 
+        read_ahead_mb
+    
+    @return out_pdf_path : str
+        Path to output pdf file. 
+    """
+
+    # args: src_pdf, ins_pdf, page, save_profile, large, optimize, image_quality, read_ahead, read_ahead_mb
+    large = getattr(arguments, 'large', False)
+    # both pdfs are read at once, rather than one after the other, except in
+    # large-file mode, which maps them instead
+    depth, max_bytes = (0, None) if large else _read_ahead_options(arguments)
+    with sharing_sources([arguments.src_pdf, arguments.ins_pdf]), \
+            reading_ahead([arguments.src_pdf, arguments.ins_pdf], depth, max_bytes):
+        # large-file mode checks the page from its own (mapped) open
+        if not large:
+            page_count, _ = check_sources([arguments.src_pdf, arguments.ins_pdf])
+            if arguments.page > page_count:
+                raise ValueError('argument <page> exceeds the length of <src_pdf> ({} pages)'.format(page_count))
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+            out_pdf_path = set_outfile_path(arguments, arguments.src_pdf) # set the output file
+            insert_pages(arguments.src_pdf, arguments.ins_pdf, arguments.page, out_pdf_path,
+                         getattr(arguments, 'save_profile', None), large)
+
+    return out_pdf_path
+
+
+def insert_pages(pdf, ins_pdf, after_page, output=None, save_profile=None, large=False):
+    """
+    Inserts the pages of one pdf into another after the given page number,
+    keeping the metadata and bookmarks of the pdf inserted into.
+
+    In large-file mode the output is a copy of <pdf> with the inserted 
+    pages appended as an incremental update, and both pdfs are opened 
+    through memory maps, so the pages of <pdf> are not copied one by one.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        The pdf to insert into, given as its path, its contents, or a 
+        binary file object to read it from.
+    @param  ins_pdf : str, bytes, bytearray, memoryview or file object
+        The pdf to insert, given in the same way.
+    @param  after_page : int
+        Page number in <pdf> to insert <ins_pdf> after, or 0 to insert it
+        before the first page.
+    @param  output : str or file object
+        Path to save the output pdf to, or a binary file object to write it
+        to. Defaults to None (return it as bytes).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+    @param  large : bool
+        Use large-file mode, which needs <pdf>, <ins_pdf> and <output> to
+        be paths, and a save profile of None or 'fast'. Defaults to False.
+
+    @return pdf_bytes : bytes (or None if <output> is given)
+    """
+    if large:
+        _check_large(pdf, output, save_profile)
+        if not _is_path(ins_pdf):
+            raise ValueError('large-file mode needs the pdf to insert to be a path')
+        with open_mapped_pdf(pdf) as src_pdf, open_mapped_pdf(ins_pdf) as ins_pdf:
+            if after_page > src_pdf.page_count :
+                raise ValueError('argument <page> exceeds the length of <src_pdf> ({} pages)'.format(src_pdf.page_count))
+            _check_incremental(src_pdf, pdf)
+            # with an up to date index, the pages are inserted without
+            # reading the page tree of the copy
+            page_index = load_index(pdf)
+            if page_index is not None:
+                update = lambda out_pdf: _insert_indexed(out_pdf, ins_pdf, after_page, page_index)
+            else:
+                # -1 appends
+                start_at = after_page if after_page < src_pdf.page_count else -1
+                update = lambda out_pdf: out_pdf.insert_pdf(ins_pdf, start_at=start_at)
+            _update_copy(pdf, output, update, 'insert_pdf')
+        return None
+
+    # open pdfs
+    with open_source_pdf(pdf) as src_pdf, open_source_pdf(ins_pdf) as ins_pdf:
+
+        # check that after_page does not exceed number of pages in src_pdf
+        if after_page > src_pdf.page_count :
+            raise ValueError('argument <page> exceeds the length of <src_pdf> ({} pages)'.format(src_pdf.page_count))
+
+        # copy src_pdf to a new pdf with ins_pdf inserted after after_page
+        with closing_on_error(fitz.open()) as out_pdf, phase('insert_pdf'):
+            out_pdf.set_metadata(src_pdf.metadata)
+            if after_page > 0:
+                # keep the graft map for src_pdf, so that objects shared by 
+                # the pages either side of ins_pdf are only copied once
+                out_pdf.insert_pdf(src_pdf, to_page=after_page-1, final=(after_page == src_pdf.page_count))
+            out_pdf.insert_pdf(ins_pdf)
+            if after_page < src_pdf.page_count:
+                out_pdf.insert_pdf(src_pdf, from_page=after_page)
+            ins_page_count = ins_pdf.page_count
+            _copy_toc(out_pdf, [(src_pdf.get_toc(simple=False),
+                                 lambda page: page if page <= after_page else page + ins_page_count)])
+
+    # save and close  
+    with out_pdf:
+        return save_pdf(out_pdf, output, save_profile)
+
+def _insert_indexed(out_pdf, ins_pdf, after_page, page_index):
+    """
+    Inserts the pages of <ins_pdf> into <out_pdf>, a copy of the indexed 
+    pdf, after <after_page>, for large-file mode. Its page tree is emptied 
+    so that the pages are inserted into a pdf of no pages, then written out
+    afresh from the index with the inserted pages in place.
+
+    @return None
+    """
+    set_page_tree(out_pdf, [])
+    out_pdf.insert_pdf(ins_pdf)
+    inserted = [out_pdf.page_xref(i) for i in range(out_pdf.page_count)]
+    page_xrefs = page_index.page_xrefs
+    set_page_tree(out_pdf, page_xrefs[:after_page] + inserted + page_xrefs[after_page:], page_index.inherited)
+    return None
+
+
+def rearrange(arguments):
+    """
+    Rearranges the pages of the source pdf by a page order: reordering,
+    repeating, rotating and leaving out pages in a single pass over the 
+    pdf, with one save, rather than a remove, split and insert for each 
+    step (see rearrange_pages). The output pdf file is saved to the current
+    working directory.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, order, save_profile,
+        optimize, image_quality
+
+    @return out_pdf_path : str
+        Path to output pdf file.
+    """
+    # args: src_pdf, order, save_profile, optimize, image_quality
+    # the source pdf is opened again to be rearranged, so is not kept open 
+    # from the check
+    page_count, = check_sources([arguments.src_pdf])
+    parse_page_order(arguments.order, page_count)
+
+    with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+        out_pdf_path = set_outfile_path(arguments, arguments.src_pdf) # set the output file
+        rearrange_pages(arguments.src_pdf, arguments.order, out_pdf_path, getattr(arguments, 'save_profile', None))
+
+    return out_pdf_path
+
+def rearrange_pages(pdf, order, output=None, save_profile=None):
+    """
+    Rearranges the pages of a pdf by a page order (see 
+    pages.parse_page_order) e.g. ['1-3', '10', '5-9', 'r90:4', 'last-1'].
+    The pdf is opened privately and its page tree rearranged in place, 
+    then the pages are rotated, and the pdf saved once. When every page is
+    kept (reordered, repeated or rotated), the page tree is rewritten 
+    directly (see _reorder_pages). Otherwise fitz.Document.select also
+    removes the bookmarks and links to the pages left out, which are then
+    dropped from the output by garbage collection.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  order : list or str
+        Page order terms given as at the command line.
+    @param  output : str or file object
+        Path to save the output pdf to, or a binary file object to write it
+        to. Defaults to None (return it as bytes).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+    @return pdf_bytes : bytes (or None if <output> is given)
+    """
+    with open_private_pdf(pdf) as src_pdf:
+        page_count = src_pdf.page_count
+        page_order = parse_page_order(order, page_count)
+        if not page_order:
+            raise ValueError('the page order selects no pages of the pdf')
+
+        pages = [page for page, _ in page_order]
+        every_page = len(set(pages)) == page_count
+        with phase('select'):
+            if every_page:
+                _reorder_pages(src_pdf, pages)
+            else:
+                src_pdf.select([page-1 for page in pages])
+        with phase('rotate'):
+            _rotate_pages(src_pdf, [rotation for _, rotation in page_order])
+
+        return save_pdf(src_pdf, output, save_profile, garbage=0 if every_page else 1)
+
+def _reorder_pages(pdf, pages):
+    """
+    Rearranges the page tree of a pdf as fitz.Document.select does, for a
+    page order that keeps every page, in time linear in the number of 
+    pages (select takes time growing with the square of it, over 2 
+    seconds for 5000 pages). No bookmark or link can point to a page left
+    out, so there is nothing else for select to clean up. Like select, 
+    this leaves a flat page tree, with the inherited attributes copied 
+    down to the pages, and a page given more than once listed as the same 
+    page object each time (see _rotate_pages).
+
+    @param  pdf : fitz.Document
+    @param  pages : list
+        Page numbers in the order they are to be output, including every
+        page of the pdf at least once.
+
+    @return None
+    """
+    root_xref = str(page_tree_root(pdf))
+    page_xrefs = [pdf.page_xref(i) for i in range(pdf.page_count)]
+    inherited = {xref: inherited_values(pdf, xref) for xref in page_xrefs
+                 if pdf.xref_get_key(xref, 'Parent')[1].split()[0] != root_xref}
+    set_page_tree(pdf, [page_xrefs[page-1] for page in pages], inherited)
+    return None
+
+def _rotate_pages(pdf, rotations):
+    """
+    Rotates each page of a pdf rearranged by fitz.Document.select by the 
+    given number of degrees, on top of its own rotation.
+
+    select lists a page given more than once as the same page object each
+    time, which could not be rotated on its own (and has one parent in the
+    page tree, which lists it more than once), so each repeat is first 
+    given a copy of the page object, sharing its contents and resources. 
+    select (and _reorder_pages) leave the page tree flat, with inherited
+    attributes such as Rotate copied down to the pages, so the page 
+    objects are changed directly rather than loading every page.
+
+    @param  pdf : fitz.Document
+        The pdf, just rearranged by select or _reorder_pages.
+    @param  rotations : list
+        Degrees to rotate each page by clockwise, a multiple of 90.
+
+    @return None
+    """
+    page_xrefs = [pdf.page_xref(i) for i in range(pdf.page_count)]
+    seen = set()
+    copied = False
+    for i, xref in enumerate(page_xrefs):
+        if xref in seen:
+            page_xrefs[i] = pdf.get_new_xref()
+            pdf.update_object(page_xrefs[i], pdf.xref_object(xref, compressed=True))
+            copied = True
+        seen.add(xref)
+    if copied:
+        set_page_tree(pdf, page_xrefs)
+
+    for xref, rotation in zip(page_xrefs, rotations):
+        if rotation:
+            kind, value = pdf.xref_get_key(xref, 'Rotate')
+            pdf.xref_set_key(xref, 'Rotate', str(((int(value) if kind == 'int' else 0) + rotation) % 360))
+
+    return None
+
+
+def split(arguments):
+    """
+    Splits the source pdf into separate pdf files for each given page/page
+    range. Outputs are saved to the current woring directory.
+
+    Instead of page ranges, the source pdf can be split into chunks of a
+    fixed number of pages (every), or at its bookmarks (by_bookmark), in 
+    which case the ranges are worked out from the open source pdf.
+
+    If more than one job is requested, the page ranges are shared out 
+    between a pool of worker processes, each of which opens the source pdf
+    once. The output paths, and their order, are the same either way.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, pages, every, 
+        by_bookmark, jobs, save_profile, optimize, image_quality
+    
+    @return out_pdf_paths : tuple
+        Tuple containing the paths to the output pdf files.
+    
+    """
+
+    # args: src_pdf, pages, every, by_bookmark, jobs, save_profile, optimize, image_quality
+    seq = itertools.count(1)
+    with sharing_sources([arguments.src_pdf]):
+        # the page selections are checked by split_pdf, before any output
+        check_sources([arguments.src_pdf])
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+            output_pdf_paths = split_pdf(arguments.src_pdf, arguments.pages, getattr(arguments, 'every', None),
+                getattr(arguments, 'by_bookmark', None),
+                lambda page_input: set_outfile_path(arguments, arguments.src_pdf, page_input, next(seq)),
+                getattr(arguments, 'save_profile', None), getattr(arguments, 'jobs', 1))
+
+    return tuple(output_pdf_paths)
+
+
+def split_pdf(pdf, pages=None, every=None, by_bookmark=None, output=None, save_profile=None, jobs=1):
+    """
+    Splits a pdf into separate pdfs for each given page selection, for 
+    each chunk of <every> pages, or at its bookmarks down to the 
+    <by_bookmark> level. Exactly one of these must be given.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  pages : list
+        Page selections given as at the command line e.g. ['1-3', '7'].
+    @param  every : int
+        Number of pages in each output pdf.
+    @param  by_bookmark : int
+        Deepest level of bookmark to split at (1 is the top level).
+    @param  output : function
+        Called with each page selection e.g. '1-3', in order, and returns 
+        the path to save its pdf to or a binary file object to write it to.
+        Defaults to None (return each pdf as bytes).
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+    @param  jobs : int
+        Number of worker processes to share the page selections between,
+        when <pdf> and the outputs are paths. Defaults to 1.
+
+    @return outputs : list
+        The bytes of each output pdf, or the outputs returned by <output>.
+    """
+    if bool(pages) + bool(every) + bool(by_bookmark) != 1:
+        raise ValueError('split expects either <pages>, --every or --by-bookmark')
+
+    # a pdf with an up to date index is split without reading its page 
+    # tree, except at its bookmarks, which are read from the whole pdf
+    page_index = load_index(pdf) if _is_path(pdf) and not by_bookmark and jobs <= 1 else None
+    if page_index is not None:
+        return _split_indexed(pdf, page_index, pages, every, output, save_profile)
+
+    # open source pdf
+    with open_source_pdf(pdf) as src_pdf:
+
+        if not pages:
+            pages = _split_page_ranges(src_pdf, every, by_bookmark)
+
+        # check every page selection before any output is written
+        for page_input in pages:
+            PageSet.parse(page_input, src_pdf.page_count).check(src_pdf.page_count)
+
+        # set the outputs up front so that they do not depend on the order
+        # in which the workers finish
+        outputs = [output(page_input) for page_input in pages] if output else [None]*len(pages)
+        tasks = list(zip(pages, outputs))
+
+        if jobs > 1 and len(tasks) > 1 and _is_path(pdf) and all(_is_path(out) for out in outputs):
+            # the phases of the workers are not traced, only their total
+            with phase('split_workers'):
+                _split_parallel(pdf, tasks, jobs, save_profile)
+            return outputs
+
+        pdf_bytes = _split_pages(src_pdf, tasks, save_profile)
+
+    return outputs if output else pdf_bytes
+
+
+def _split_indexed(pdf_path, page_index, pages=None, every=None, output=None, save_profile=None):
+    """
+    Splits a pdf as split_pdf does, using its index (see pageindex) to find
+    the pages selected without reading its page tree, which for a pdf of 
+    many pages means loading every page object. The pdf is opened 
+    privately and its page tree cut down to the pages selected (see 
+    pageindex.PageIndex.restrict) before they are copied, so that the 
+    time taken depends on the pages selected rather than the size of the
+    pdf.
+
+    @param  pdf_path : str
+        Path to the pdf.
+    @param  page_index : PageIndex
+        The up to date index of the pdf.
+
+    (the other arguments and the return value are those of split_pdf)
+    """
+    page_count = page_index.page_count
+    if not pages:
+        pages = page_ranges_from(range(1, page_count+1, every), page_count)
+
+    # check every page selection before any output is written
+    page_sets = [PageSet.parse(page_input, page_count) for page_input in pages]
+    for page_set in page_sets:
+        page_set.check(page_count)
+    outputs = [output(page_input) for page_input in pages] if output else [None]*len(pages)
+
+    # the pages selected, in order, and the position of each in the page
+    # tree they are cut down to
+    selected = PageSet([interval for page_set in page_sets for interval in page_set.intervals])
+    positions = {page: position for position, page in enumerate(selected, 1)}
+
+    with open_private_pdf(pdf_path) as src_pdf:
+        with phase('select'):
+            page_index.restrict(src_pdf, list(selected))
+        tasks = [(PageSet([(positions[start], positions[end]) for start, end in page_set.intervals]), out)
+                 for page_set, out in zip(page_sets, outputs)]
+        pdf_bytes = _split_pages(src_pdf, tasks, save_profile)
+
+    return outputs if output else pdf_bytes
+
+def _split_page_ranges(src_pdf, every=None, by_bookmark=None):
+    """
+    Works out the page ranges which split the source pdf into chunks of 
+    <every> pages, or at each of its bookmarks down to the <by_bookmark>
+    level. Pages before the first bookmark are kept as a range of their own.
+
+    @param  src_pdf : fitz.Document
+        The open source pdf.
+    @param  every : int
+        Number of pages in each chunk.
+    @param  by_bookmark : int
+        Deepest level of bookmark to split at (1 is the top level).
+
+    @return pages : list
+        Page numbers/page ranges in the same format as given at the command
+        line e.g. ['1-10', '11-20', '21']
+    """
+    page_count = src_pdf.page_count
+
+    if every:
+        starts = range(1, page_count+1, every)
+    else:
+        starts = {page for level, _, page in src_pdf.get_toc() if level <= by_bookmark}
+
+    return page_ranges_from(starts, page_count)
+
+def page_ranges_from(starts, page_count):
+    """
+    @param  starts : iterable
+        Page numbers at which ranges start. Page 1 is always a start, and 
+        any outside the pdf are ignored.
+    @param  page_count : int
+        Number of pages in the pdf.
+
+    @return pages : list
+        Page numbers/page ranges covering the pdf, in the same format as 
+        given at the command line e.g. ['1-10', '11-20', '21']
+    """
+    starts = sorted({1} | {start for start in starts if 1 <= start <= page_count})
+    ends = [start-1 for start in starts[1:]] + [page_count]
+    return [str(start) if start == end else '{}-{}'.format(start, end)
+            for start, end in zip(starts, ends) if page_count]
+
+
+def _split_pages(src_pdf, tasks, save_profile=None):
+    """
+    Saves each page selection of an open source pdf as a new pdf file. 
+    The objects shared by the pages of a selection (fonts, images etc.) are
+    only copied once to its pdf file (see _insert_page_set).
+
+    @param  src_pdf : fitz.Document
+        The open source pdf.
+    @param  tasks : list
+        List of (page_input, out_pdf) tuples, where page_input is a page
+        selection as given at the command line or a PageSet, and out_pdf 
+        is a path, a binary file object, or None.
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+    @return pdf_bytes : list
+        The bytes of each pdf whose out_pdf is None (see save_pdf).
+    """
+    pdf_bytes = []
+    for page_input, out_pdf in tasks:
+
+        # open a new, empty pdf file and copy the selected pages to it
+        with fitz.open() as new_pdf:
+            page_set = page_input if isinstance(page_input, PageSet) else PageSet.parse(page_input, src_pdf.page_count)
+            _insert_page_set(new_pdf, src_pdf, page_set)
+        
+            # save and close new pdf
+            pdf_bytes.append(save_pdf(new_pdf, out_pdf, save_profile))
+
+    return pdf_bytes
+
+
+# source pdf, opened once by each split worker process, save profile, and
+# image optimization settings
+_worker_src_pdf = None
+_worker_save_profile = None
+_worker_fsync = False
+_worker_images = None
+
+def _init_split_worker(src_pdf_path, save_profile, fsync=False, images=None):
+    global _worker_src_pdf, _worker_save_profile, _worker_fsync, _worker_images
+    _worker_src_pdf = fitz.open(src_pdf_path)
+    _worker_save_profile = save_profile
+    _worker_fsync = fsync
+    _worker_images = images
+
+def _split_worker(tasks):
+    with output.atomic_outputs(_worker_fsync), optimized_images(**(_worker_images or {})):
+        _split_pages(_worker_src_pdf, tasks, _worker_save_profile)
+    return len(tasks)
+
+def _split_parallel(src_pdf_path, tasks, jobs, save_profile=None):
+    """
+    Shares the split tasks out between a pool of <jobs> worker processes.
+    Tasks are handed out in small batches rather than as one share per 
+    worker, so that a worker given the long ranges does not hold up the rest.
+
+    @param  src_pdf_path : str
+        Path to the source pdf.
+    @param  tasks : list
+        List of (page_input, out_pdf_path) tuples.
+    @param  jobs : int
+        Number of worker processes.
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+    @return None
+    """
+    jobs = min(jobs, len(tasks))
+    batch_size = max(1, len(tasks) // (jobs*4))
+    batches = [tasks[i:i+batch_size] for i in range(0, len(tasks), batch_size)]
+
+    # each worker optimizes the images of its own outputs, without a pool
+    # of its own
+    images = optimization_requested()
+    images = dict(images, jobs=1) if images else None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_split_worker,
+                             initargs=(src_pdf_path, save_profile, output.fsync_requested(), images)) as executor:
+        # consume the results so that any error in a worker is raised here
+        for _ in executor.map(_split_worker, batches):
+            pass
+
+    return None
+
+
+def optimize(arguments):
+    """
+    Downsamples the images of the source pdf drawn at more than the given
+    dpi, and recompresses them (see images.optimize_images), saving the
+    result as a new pdf file. The images downsampled, the time spent on 
+    them, and the sizes of the source and output pdf files are reported on
+    stderr.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, dpi, quality, jobs,
+        save_profile
+
+    @return out_pdf_path : str
+        Path to output pdf file.
+    """
+    # args: src_pdf, dpi, quality, jobs, save_profile
+    with sharing_sources([arguments.src_pdf]):
+        check_sources([arguments.src_pdf])
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)):
+            out_pdf_path = set_outfile_path(arguments, arguments.src_pdf) # set the output file
+            _, stats = _optimize_pdf(arguments.src_pdf, out_pdf_path, getattr(arguments, 'dpi', DEFAULT_DPI),
+                                     getattr(arguments, 'quality', DEFAULT_QUALITY), getattr(arguments, 'jobs', 1),
+                                     getattr(arguments, 'save_profile', None))
+
+    seconds = stats['seconds']
+    print('images: downsampled {} of {} images ({} from cache), {:.1f} KB to {:.1f} KB (scan {:.2f} s, '
+          'encode {:.2f} s, update {:.2f} s)'.format(stats['downsampled'], stats['images'], stats['cached'],
+          stats['bytes_before']/1024, stats['bytes_after']/1024, seconds['scan'], seconds['encode'],
+          seconds['update']), file=sys.stderr)
+    src_size, out_size = os.path.getsize(arguments.src_pdf), os.path.getsize(out_pdf_path)
+    print('optimize: {:.1f} KB to {:.1f} KB ({:.0f}%)'.format(src_size/1024, out_size/1024,
+          100*out_size/src_size if src_size else 100), file=sys.stderr)
+
+    return out_pdf_path
+
+def optimize_pdf(pdf, output=None, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, jobs=1, save_profile=None):
+    """
+    Downsamples the images of a pdf drawn at more than <dpi>, and
+    recompresses them (see images.optimize_images). The pages, metadata
+    and bookmarks of the pdf are kept.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  output : str or file object
+        Path to save the output pdf to, or a binary file object to write it
+        to. Defaults to None (return it as bytes).
+    @param  dpi : int
+        Resolution to downsample images to. Defaults to images.DEFAULT_DPI.
+    @param  quality : int
+        Quality of jpeg images, from 1 to 100. Defaults to 
+        images.DEFAULT_QUALITY.
+    @param  jobs : int
+        Number of worker processes to share the images between. Defaults
+        to 1.
+    @param  save_profile : str
+        One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+    @return pdf_bytes : bytes (or None if <output> is given)
+    """
+    return _optimize_pdf(pdf, output, dpi, quality, jobs, save_profile)[0]
+
+def _optimize_pdf(pdf, output, dpi, quality, jobs, save_profile):
+    """
+    optimize_pdf, also returning the stats of the images optimized (see 
+    images.optimize_images), for the optimize command to report.
+
+    @return (pdf_bytes, stats) : tuple
+    """
+    # the source pdf may be shared, so its pages are copied to a new pdf
+    # whose images can be changed
+    with open_source_pdf(pdf) as src_pdf, closing_on_error(fitz.open()) as out_pdf:
+        out_pdf.set_metadata(src_pdf.metadata)
+        with phase('insert_pdf'):
+            out_pdf.insert_pdf(src_pdf)
+        out_pdf.set_toc(src_pdf.get_toc(simple=False))
+
+    # optimized here rather than by save_pdf, so that the stats are kept,
+    # and not again by save_pdf in an optimized_images block
+    with out_pdf, optimized_images():
+        stats = optimize_images(out_pdf, dpi, quality, jobs)
+        return save_pdf(out_pdf, output, save_profile), stats
@@ -0,0 +1,290 @@
+import math
+import inspect
+import itertools
+import fitz
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from .pages import PageSet
+    from .instrument import phase, count
+    from . import output
+    from .commands import open_source_pdf, set_outfile_path, check_sources, sharing_sources, _is_path
+except ImportError:
+    from pages import PageSet
+    from instrument import phase, count
+    import output
+    from commands import open_source_pdf, set_outfile_path, check_sources, sharing_sources, _is_path
+
+# image formats pages can be converted to
+IMAGE_FORMATS = ('png', 'jpg')
+
+# resolution pages are rendered at, unless a dpi or size is given
+DEFAULT_DPI = 150
+
+# jpeg output is only supported by newer versions of PyMuPDF
+JPEG_SUPPORTED = 'jpg_quality' in inspect.signature(fitz.Pixmap.tobytes).parameters
+
+def convert(arguments):
+    """
+    Renders pages of the source pdf to an image file each, png or jpeg,
+    saved to the output directory. Pages are selected as for remove, and
+    default to every page.
+
+    If more than one job is requested, the pages are shared out between a
+    pool of worker processes, each of which opens the source pdf once and
+    writes each image as soon as it is rendered.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, pages, format, dpi,
+        size, quality, jobs
+
+    @return out_image_paths : tuple
+        Tuple containing the paths to the output images, in page order.
+    """
+    # args: src_pdf, pages, format, dpi, size, quality, jobs
+    image_format = getattr(arguments, 'format', 'png')
+    seq = itertools.count(1)
+    with sharing_sources([arguments.src_pdf]):
+        check_sources([arguments.src_pdf])
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)):
+            out_image_paths = convert_pdf(arguments.src_pdf, arguments.pages,
+                lambda page: set_outfile_path(arguments, arguments.src_pdf, str(page), next(seq), '.'+image_format),
+                image_format, getattr(arguments, 'dpi', None), getattr(arguments, 'size', None),
+                getattr(arguments, 'quality', 85), getattr(arguments, 'jobs', 1))
+
+    return tuple(out_image_paths)
+
+
+def convert_pdf(pdf, pages=None, output=None, image_format='png', dpi=None, size=None, quality=85, jobs=1):
+    """
+    Renders pages of a pdf to images.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  pages : list
+        Page selections given as at the command line e.g. ['1-3', '7'].
+        Defaults to None (every page).
+    @param  output : function
+        Called with each page number, in order, and returns the path to
+        save its image to or a binary file object to write it to. Defaults
+        to None (return each image as bytes).
+    @param  image_format : str
+        One of the IMAGE_FORMATS. Defaults to 'png'.
+    @param  dpi : int
+        Resolution to render at. Defaults to DEFAULT_DPI.
+    @param  size : int
+        Instead of <dpi>, the size in pixels of the longer side of each
+        image, for thumbnails.
+    @param  quality : int
+        Quality of jpeg images, from 1 to 100. Defaults to 85.
+    @param  jobs : int
+        Number of worker processes to share the pages between, when <pdf>
+        and the outputs are paths. Defaults to 1.
+
+    @return outputs : list
+        The bytes of each image, or the outputs returned by <output>.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError('image format must be one of {}, not {}'.format(', '.join(IMAGE_FORMATS), image_format))
+    if image_format == 'jpg' and not JPEG_SUPPORTED:
+        raise ValueError('jpeg images need a newer version of PyMuPDF, convert to png instead')
+    if dpi and size:
+        raise ValueError('convert expects either a dpi or a size, not both')
+    options = {'image_format': image_format, 'dpi': dpi or (None if size else DEFAULT_DPI), 'size': size,
+               'quality': quality}
+
+    with open_source_pdf(pdf) as src_pdf:
+        page_count = src_pdf.page_count
+        page_set = PageSet.parse(pages, page_count) if pages else PageSet().complement(page_count)
+        page_set.check(page_count)
+
+        # set the outputs up front so that they do not depend on the order
+        # in which the workers finish
+        outputs = [output(page) for page in page_set] if output else [None]*len(page_set)
+        tasks = list(zip(page_set, outputs))
+
+        if jobs > 1 and _is_path(pdf) and all(_is_path(out) for out in outputs):
+            # the phases of the workers are not traced, only their total
+            with phase('convert_workers'):
+                _convert_parallel(pdf, src_pdf, tasks, jobs, options)
+            return outputs
+
+        image_bytes = _convert_pages(src_pdf, tasks, options)
+
+    return outputs if output else image_bytes
+
+
+def render_page(page, dpi=None, size=None, rows=None):
+    """
+    Renders a page, or a band of rows of its pixels, as RGB.
+
+    @param  page : fitz.Page
+    @param  dpi : int
+        Resolution to render at.
+    @param  size : int
+        Instead of <dpi>, the size in pixels of the longer side of the page.
+    @param  rows : tuple
+        (first, stop) rows of pixels of the whole page to render, stop
+        exclusive. Defaults to None (the whole page).
+
+    @return pixmap : fitz.Pixmap
+    """
+    zoom = _zoom(page, dpi, size)
+    clip = None
+    if rows is not None:
+        rect = page.rect
+        clip = fitz.Rect(rect.x0, rect.y0 + rows[0]/zoom, rect.x1, rect.y0 + rows[1]/zoom)
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+
+def _zoom(page, dpi=None, size=None):
+    if size:
+        return size / max(page.rect.width, page.rect.height)
+    return (dpi or DEFAULT_DPI) / 72
+
+def _page_height(page, options):
+    # height in pixels of the whole page, as rendered
+    zoom = _zoom(page, options['dpi'], options['size'])
+    return (page.rect * fitz.Matrix(zoom, zoom)).irect.height
+
+def _image_bytes(pixmap, options):
+    if options['image_format'] == 'jpg':
+        return pixmap.tobytes('jpg', jpg_quality=options['quality'])
+    return pixmap.tobytes('png')
+
+def _write_image(image_bytes, out_image):
+    """
+    Writes an image to a path (by way of a temporary file, see save_pdf) or
+    a binary file object. An image written to a path is moved into place
+    at once, rather than at the end of the command's atomic_outputs block,
+    so that the images of a long conversion appear as they are rendered.
+
+    @return image_bytes : bytes (or None if <out_image> is not None)
+    """
+    count('images_written')
+    count('bytes_written', len(image_bytes))
+    if _is_path(out_image):
+        with output.atomic_outputs(output.fsync_requested()):
+            temp = output.temp_path(out_image)
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(image_bytes)
+            except BaseException:
+                output.discard(temp)
+                raise
+            output.commit(temp, out_image)
+        return None
+    if out_image is not None:
+        out_image.write(image_bytes)
+        return None
+    return image_bytes
+
+def _convert_pages(src_pdf, tasks, options):
+    """
+    Renders each page of an open source pdf, writing each image as soon as
+    it is rendered.
+
+    @param  src_pdf : fitz.Document
+        The open source pdf.
+    @param  tasks : list
+        List of (page, out_image) tuples, where out_image is a path, a
+        binary file object, or None.
+    @param  options : dict
+        image_format, dpi, size and quality, as given to convert_pdf.
+
+    @return image_bytes : list
+        The bytes of each image whose out_image is None.
+    """
+    image_bytes = []
+    for page, out_image in tasks:
+        with phase('render'):
+            pixmap = render_page(src_pdf[page-1], options['dpi'], options['size'])
+            count('pages_rendered')
+        with phase('encode'):
+            data = _image_bytes(pixmap, options)
+        image_bytes.append(_write_image(data, out_image))
+    return image_bytes
+
+
+# source pdf, opened once by each convert worker process, and the options
+_worker_src_pdf = None
+_worker_options = None
+_worker_fsync = False
+
+def _init_convert_worker(src_pdf_path, options, fsync=False):
+    global _worker_src_pdf, _worker_options, _worker_fsync
+    _worker_src_pdf = fitz.open(src_pdf_path)
+    _worker_options = options
+    _worker_fsync = fsync
+
+def _convert_worker(tasks):
+    # each image is moved into place as soon as it is written (see 
+    # _write_image), rather than at the end of the batch
+    with output.atomic_outputs(_worker_fsync):
+        _convert_pages(_worker_src_pdf, tasks, _worker_options)
+    return len(tasks)
+
+def _render_rows_worker(page, rows):
+    pixmap = render_page(_worker_src_pdf[page-1], _worker_options['dpi'], _worker_options['size'], rows)
+    return pixmap.width, pixmap.height, pixmap.samples
+
+def _convert_parallel(src_pdf_path, src_pdf, tasks, jobs, options):
+    """
+    Shares the pages out between a pool of <jobs> worker processes. Pages
+    are handed out in small batches, so that a worker given slow pages does
+    not hold up the rest, and each worker writes its images itself.
+
+    When there are fewer pages than workers (e.g. a few large drawings at a
+    high dpi), each page is instead cut into bands of rows of pixels, one
+    for each worker, which are rendered at the same time and joined back
+    together (and the image written) here.
+
+    @param  src_pdf_path : str
+        Path to the source pdf.
+    @param  src_pdf : fitz.Document
+        The open source pdf.
+    @param  tasks : list
+        List of (page, out_image_path) tuples.
+    @param  jobs : int
+        Number of worker processes.
+    @param  options : dict
+        image_format, dpi, size and quality, as given to convert_pdf.
+
+    @return None
+    """
+    bands = math.ceil(jobs / len(tasks)) if len(tasks) < jobs else 1
+    jobs = min(jobs, len(tasks)*bands)
+    batch_size = max(1, len(tasks) // (jobs*4))
+    batches = [tasks[i:i+batch_size] for i in range(0, len(tasks), batch_size)]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_convert_worker,
+                             initargs=(src_pdf_path, options, output.fsync_requested())) as executor:
+        if bands == 1:
+            # consume the results so that any error in a worker is raised here
+            for _ in executor.map(_convert_worker, batches):
+                pass
+            return None
+
+        band_futures = []
+        for page, _ in tasks:
+            height = _page_height(src_pdf[page-1], options)
+            cuts = [height*i // bands for i in range(bands+1)]
+            band_futures.append([executor.submit(_render_rows_worker, page, rows) for rows in zip(cuts, cuts[1:])
+                                 if rows[0] < rows[1]])
+
+        for (page, out_image), futures in zip(tasks, band_futures):
+            results = [future.result() for future in futures]
+            width = results[0][0]
+            height = sum(band_height for _, band_height, _ in results)
+            if height == _page_height(src_pdf[page-1], options) and all(w == width for w, _, _ in results):
+                # full width bands, so the pixels of the page are those of
+                # the bands one after another
+                pixmap = fitz.Pixmap(fitz.csRGB, width, height, b''.join(samples for _, _, samples in results),
+                                     False)
+            else:
+                pixmap = render_page(src_pdf[page-1], options['dpi'], options['size'])
+            count('pages_rendered')
+            _write_image(_image_bytes(pixmap, options), out_image)
+
+    return None
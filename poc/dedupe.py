@@ -0,0 +1,143 @@
+import re
+import hashlib
+
+# an indirect reference, e.g. 12 0 R, in the source of a pdf object
+REFERENCE = re.compile(rb'(?<![\d.])(\d+) (\d+) R\b')
+
+# the keys of a page which hold what is drawn on it
+PAGE_KEYS = ('Resources', 'Contents')
+
+def dedupe_objects(pdf):
+    """
+    Finds the objects drawn on the pages of a pdf (content streams, fonts,
+    images and the other resources of the pages) which are exact copies of
+    each other, e.g. the letterhead image and fonts of many merged invoices,
+    and points every reference to a copy at the first one instead. The
+    copies are then unused, so are dropped when the pdf is saved with
+    garbage collection.
+
+    Objects are fingerprinted by a hash of their source and stream, with
+    the objects they refer to replaced by their own fingerprints, so two
+    fonts are copies if their font files are copies, wherever in the pdf
+    those are. Each object is read once, so the time taken grows with the
+    number of objects, where MuPDF's own removal of duplicates (garbage=4)
+    compares every pair of objects.
+
+    @param  pdf : fitz.Document
+        The pdf, which is changed in place.
+
+    @return objects, bytes : int, int
+        The number of copies found, and their total size in the pdf
+        (uncompressed source and raw stream).
+    """
+    deduper = _Deduper(pdf)
+    for page_xref in page_xrefs(pdf):
+        for key in PAGE_KEYS:
+            kind, value = pdf.xref_get_key(page_xref, key)
+            if kind in ('xref', 'dict', 'array'):
+                rewritten = deduper.rewrite(value.encode())
+                if rewritten is not None:
+                    pdf.xref_set_key(page_xref, key, rewritten.decode())
+
+    return deduper.copies, deduper.copied_bytes
+
+def page_xrefs(pdf):
+    """
+    @return xrefs : list
+        The xrefs of the pages of <pdf>, in order, found by walking its page
+        tree (pdf.page_xref looks each page up from the root of the tree, so
+        is slow for every page of a large pdf).
+    """
+    xrefs = []
+    kind, value = pdf.xref_get_key(pdf.pdf_catalog(), 'Pages')
+    to_visit = [int(value.split()[0])] if kind == 'xref' else []
+    seen = set()
+    while to_visit:
+        xref = to_visit.pop()
+        if xref in seen:
+            continue
+        seen.add(xref)
+        kind, value = pdf.xref_get_key(xref, 'Kids')
+        if kind == 'array':
+            # visited last first, so the pages come off the stack in order
+            to_visit += reversed([int(match.group(1)) for match in REFERENCE.finditer(value.encode())])
+        else:
+            xrefs.append(xref)
+    return xrefs
+
+class _Deduper:
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.fingerprints = {}
+        # the object kept for each fingerprint
+        self.kept = {}
+        self.visiting = set()
+        self.copies = 0
+        self.copied_bytes = 0
+
+    def rewrite(self, source):
+        """
+        Fingerprints the objects referred to in <source>.
+
+        @return source : bytes
+            <source> with its references to copies replaced by the objects
+            kept, or None if it has none.
+        """
+        changed = False
+        for match in REFERENCE.finditer(source):
+            xref = int(match.group(1))
+            if self.kept_xref(xref) != xref:
+                changed = True
+        if not changed:
+            return None
+        return REFERENCE.sub(self._replace, source)
+
+    def _replace(self, match):
+        xref = int(match.group(1))
+        kept_xref = self.kept_xref(xref)
+        return match.group(0) if kept_xref == xref else b'%d 0 R' % kept_xref
+
+    def kept_xref(self, xref):
+        fingerprint = self.fingerprint(xref)
+        return self.kept.get(fingerprint, xref)
+
+    def fingerprint(self, xref):
+        if xref in self.fingerprints:
+            return self.fingerprints[xref]
+        if xref in self.visiting or not 0 < xref < self.pdf.xref_length():
+            # part of a loop of references, or missing: never a copy
+            return b'xref %d' % xref
+
+        self.visiting.add(xref)
+        source = self.pdf.xref_object(xref, compressed=True).encode()
+        stream = self.pdf.xref_stream_raw(xref) if self.pdf.xref_is_stream(xref) else None
+
+        digest = hashlib.sha256(REFERENCE.sub(lambda match: self.fingerprint(int(match.group(1))), source))
+        if stream is not None:
+            digest.update(b'stream')
+            digest.update(stream)
+        fingerprint = digest.digest()
+        self.visiting.discard(xref)
+        self.fingerprints[xref] = fingerprint
+
+        if fingerprint in self.kept:
+            self.copies += 1
+            self.copied_bytes += len(source) + len(stream or b'')
+            return fingerprint
+        self.kept[fingerprint] = xref
+
+        # point the object kept at the objects kept for those it refers to
+        rewritten = self.rewrite(source)
+        if rewritten is not None:
+            if stream is None:
+                self.pdf.update_object(xref, rewritten.decode())
+            else:
+                # updating the source of a stream object would lose its stream
+                for key in self.pdf.xref_get_keys(xref):
+                    kind, value = self.pdf.xref_get_key(xref, key)
+                    if kind in ('xref', 'dict', 'array'):
+                        rewritten = self.rewrite(value.encode())
+                        if rewritten is not None:
+                            self.pdf.xref_set_key(xref, key, rewritten.decode())
+        return fingerprint
@@ -0,0 +1,109 @@
+import os
+import fitz
+from collections import OrderedDict
+
+class DocumentCache:
+    """
+    Least recently used cache of open source pdf documents, so that a
+    process running many commands (e.g. a batch) parses each source once.
+
+    Documents are keyed by their path, modification time and size, so a
+    source that is changed on disk is opened again rather than served stale.
+    The cache is limited by a number of documents and, optionally, by the
+    total size of their files, whichever is reached first.
+    Documents handed out by the cache are shared and must not be modified
+    or closed by the caller.
+    """
+
+    def __init__(self, max_docs=32, max_bytes=None):
+        """
+        @param  max_docs : int
+            Number of documents to keep open before the least recently
+            used one is closed. Defaults to 32.
+        @param  max_bytes : int
+            Total size of the files of the open documents, in bytes, to
+            keep the cache under. Defaults to None (no limit).
+        """
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._docs = OrderedDict()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, path, data=None):
+        """
+        Returns the open document for <path>, opening it if it is not
+        already in the cache.
+
+        @param  path : str
+            Path to the pdf file.
+        @param  data : bytes
+            The contents of the file, if they have already been read (e.g.
+            read ahead), to open it from rather than its path. Defaults to
+            None.
+
+        @return doc : fitz.Document
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+        doc = self._docs.get(key)
+        if doc is not None:
+            self.hits += 1
+            self._docs.move_to_end(key)
+            return doc
+
+        self.misses += 1
+        doc = fitz.open(path) if data is None else fitz.open(stream=data, filetype='pdf')
+        self._docs[key] = doc
+        self.total_bytes += stat.st_size
+
+        # close the least recently used documents, always keeping the one
+        # just opened
+        while len(self._docs) > 1 and (len(self._docs) > self.max_docs 
+                or (self.max_bytes and self.total_bytes > self.max_bytes)):
+            self._evict()
+
+        return doc
+
+    def stats(self):
+        """
+        @return stats : dict
+            The number of open documents, their total size in bytes, and the
+            number of hits, misses and evictions so far.
+        """
+        return {'docs': len(self._docs), 'bytes': self.total_bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def discard(self, path):
+        """
+        Closes the document for <path>, if it is in the cache, e.g. once the
+        command it was opened for has finished with it.
+
+        @return None
+        """
+        path = os.path.abspath(path)
+        for key in [key for key in self._docs if key[0] == path]:
+            self.total_bytes -= key[2]
+            self._docs.pop(key).close()
+        return None
+
+    def _evict(self):
+        (_, _, size), old_doc = self._docs.popitem(last=False)
+        self.total_bytes -= size
+        self.evictions += 1
+        old_doc.close()
+
+    def close(self):
+        """
+        Closes every document in the cache.
+        """
+        while self._docs:
+            _, doc = self._docs.popitem()
+            doc.close()
+        self.total_bytes = 0
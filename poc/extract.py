@@ -0,0 +1,163 @@
+import sys
+import json
+import itertools
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+try:
+    from .pages import PageSet
+    from .instrument import phase, count
+    from .commands import open_source_pdf, check_sources, sharing_sources, _is_path
+except ImportError:
+    from pages import PageSet
+    from instrument import phase, count
+    from commands import open_source_pdf, check_sources, sharing_sources, _is_path
+
+# what can be extracted from each page, as given to fitz.Page.get_text
+EXTRACT_MODES = ('text', 'words', 'blocks')
+
+# pages handed to a worker at a time, and batches handed out ahead of the
+# one being written, for each worker
+BATCH_PAGES = 16
+BATCHES_AHEAD = 4
+
+def extract(arguments):
+    """
+    Writes the text of pages of the source pdf (or its words or blocks,
+    with their positions) as a line of json for each page, in page order,
+    to stdout or a file. Each line is written as soon as its page has been
+    extracted, so the text of the whole pdf is never held in memory.
+
+    If more than one job is requested, the pages are shared out between a
+    pool of worker processes, each of which opens the source pdf once.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: src_pdf, pages, mode, jobs,
+        output
+
+    @return out_path : str
+        Path to the output file, or '-' for stdout.
+    """
+    # args: src_pdf, pages, mode, jobs, output
+    out_path = getattr(arguments, 'output', None) or '-'
+    with sharing_sources([arguments.src_pdf]):
+        check_sources([arguments.src_pdf])
+        records = extract_pages(arguments.src_pdf, arguments.pages, getattr(arguments, 'mode', 'text'),
+                                getattr(arguments, 'jobs', 1))
+        # the pages are checked when the first is extracted, before the
+        # output is opened
+        first = next(records, None)
+        records = itertools.chain([first] if first else [], records)
+
+        with (contextlib.nullcontext(sys.stdout) if out_path == '-' else open(out_path, 'w', encoding='utf-8')) as f:
+            write_json_lines(records, f)
+
+    return out_path
+
+
+def extract_pages(pdf, pages=None, mode='text', jobs=1):
+    """
+    Generator of the text, words or blocks of pages of a pdf, in page
+    order, as dicts e.g.
+        {'page': 3, 'text': 'Invoice...'}
+        {'page': 3, 'words': [[x0, y0, x1, y1, 'Invoice', block, line, word], ...]}
+        {'page': 3, 'blocks': [[x0, y0, x1, y1, 'Invoice...', block, type], ...]}
+    Pages are extracted as they are asked for (with workers, a few batches
+    ahead), so that only those being written are held in memory.
+
+    @param  pdf : str, bytes, bytearray, memoryview or file object
+        Path to the pdf, its contents, or a binary file object to read it
+        from.
+    @param  pages : list
+        Page selections given as at the command line e.g. ['1-3', '7'].
+        Defaults to None (every page).
+    @param  mode : str
+        One of the EXTRACT_MODES. Defaults to 'text'.
+    @param  jobs : int
+        Number of worker processes to share the pages between, when <pdf>
+        is a path. Defaults to 1.
+
+    @return records : generator
+    """
+    if mode not in EXTRACT_MODES:
+        raise ValueError('extract mode must be one of {}, not {}'.format(', '.join(EXTRACT_MODES), mode))
+
+    with open_source_pdf(pdf) as src_pdf:
+        page_count = src_pdf.page_count
+        page_set = PageSet.parse(pages, page_count) if pages else PageSet().complement(page_count)
+        page_set.check(page_count)
+
+        if jobs > 1 and len(page_set) > BATCH_PAGES and _is_path(pdf):
+            yield from _extract_parallel(pdf, page_set, mode, jobs)
+            return
+
+        for page in page_set:
+            yield _extract_page(src_pdf, page, mode)
+
+
+def write_json_lines(records, f):
+    """
+    Writes each record to a text file object as a line of json.
+
+    @return lines : int
+        The number of lines written.
+    """
+    lines = 0
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False))
+        f.write('\n')
+        lines += 1
+    f.flush()
+    return lines
+
+def _extract_page(src_pdf, page, mode):
+    with phase('extract'):
+        items = src_pdf[page-1].get_text(mode)
+    count('pages_extracted')
+    if mode == 'text':
+        return {'page': page, 'text': items}
+    # positions to a hundredth of a point are plenty, and keep lines short
+    return {'page': page, mode: [[round(value, 2) for value in item[:4]] + list(item[4:]) for item in items]}
+
+
+# source pdf, opened once by each extract worker process
+_worker_src_pdf = None
+
+def _init_extract_worker(src_pdf_path):
+    global _worker_src_pdf
+    _worker_src_pdf = fitz.open(src_pdf_path)
+
+def _extract_worker(pages, mode):
+    return [_extract_page(_worker_src_pdf, page, mode) for page in pages]
+
+def _extract_parallel(src_pdf_path, page_set, mode, jobs):
+    """
+    Shares the pages out between a pool of <jobs> worker processes, in
+    batches of BATCH_PAGES, and yields their records in page order. Only
+    BATCHES_AHEAD batches for each worker are handed out ahead of the one
+    being yielded, so that a slow consumer (e.g. writing to a pipe) does
+    not leave the records of the whole pdf waiting in memory.
+    """
+    pages = iter(page_set)
+    batches = iter(lambda: list(itertools.islice(pages, BATCH_PAGES)), [])
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_extract_worker,
+                             initargs=(src_pdf_path,)) as executor:
+        try:
+            for batch in batches:
+                pending.append(executor.submit(_extract_worker, batch, mode))
+                if len(pending) >= jobs*BATCHES_AHEAD:
+                    yield from _batch_records(pending.popleft())
+            while pending:
+                yield from _batch_records(pending.popleft())
+        finally:
+            # e.g. the consumer stopped early
+            for future in pending:
+                future.cancel()
+
+def _batch_records(future):
+    records = future.result()
+    count('pages_extracted', len(records))
+    return records
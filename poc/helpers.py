@@ -1,209 +1,936 @@
-
-import os
-import sys
-import argparse
-from commands import *
-
-def check_filepath(filepath, required_filetype=None):
-    """
-    Checks that <filepath> is 1) a valid path, and 2) of the required    \
-    filetype. An invalid filepath raises a FileNotFoundError, and valid  \
-    filepaths whose extension are not of <required_filetype> raise an    \
-    ArgumentError. 
-
-    @param  filepaths : str
-        path to the file
-    @param  required_filetype : str
-        file type without the preceeding '.' i.e. 'pdf', not '.pdf'. 
-        Defaults to None.
-    
-    @return True (or raises a FileNotFoundError or ArgumentError)
-    """
-
-    filename, file_extension = os.path.splitext(filepath)
-    if required_filetype:
-        required_filetype_lc = required_filetype.lower()
-
-    if not os.path.isfile(filepath):
-        raise FileNotFoundError('{} is not a valid filepath'.format(filepath))
-    elif required_filetype and '.'+required_filetype_lc != file_extension:
-        error_msg = '{} is not the expected filetype ({})'.format(filepath, required_filetype)
-        raise argparse.ArgumentTypeError(error_msg) 
-    else:
-        return True
-
-def check_page_format(page_input):
-    """
-    Checks that page_input is in the correct format - either a single,    \
-    non-zero page number or a page range in the format X-Y (where X < Y). 
-
-    @param  page_input : str
-        Page number or page range input by the user at the command line
-
-    @return True (or raises ValueError for invalid page input)
-    """
-    error_msg = 'Invalid argument. {} is not a valid page/page range'.format(page_input)
-
-    try:
-        # test if page_input is a page range
-        if '-' in page_input:
-            page_range_split = page_input.split('-')
-
-            if len(page_range_split) == 2:
-                start, end = int(page_range_split[0]), int(page_range_split[1])
-                if start < end:
-                    return True
-
-        # test if page_input is a single page number
-        elif int(page_input) > 0:
-            return True
- 
-        raise ValueError
-
-    except ValueError:
-        raise ValueError(error_msg)
-
-def set_args():
-    """
-    Set up parser for command line arguments. Creates subparsers to allow
-    different commands to be run from the command line.
-
-    @return parser : ArgumentParser
-    """
-    parser = argparse.ArgumentParser()
-
-    # initialise subparsers to handle different functionality
-    subparsers = parser.add_subparsers(help='command help', dest='invoked_command', required=True)
-
-    # subparser for 'merge' command
-    parser_merge = subparsers.add_parser('merge', 
-        help='merges two or more pdf files into a single pdf file')
-    parser_merge.add_argument('pdfs', 
-        help='paths to two or more pdf files',
-        nargs='+')
-
-    # subparser for 'remove' command
-    parser_remove = subparsers.add_parser('remove',
-        help='remove pages from a pdf file')
-    parser_remove.add_argument('src_pdf',
-        help='path to the pdf file to remove pages from')
-    parser_remove.add_argument('pages',
-        help='pages to remove from the source pdf, given as page number/s\
-            and/or page range/s in the format X-Y (inclusive) where X and\
-            Y are non-zero and X < Y e.g. \'2-3 5-7 9\' would remove \
-            pages 2, 3, 5, 6, 7, and 9 from the source pdf.',
-        nargs='+')
-
-    # subparser for 'insert' command
-    parser_insert = subparsers.add_parser('insert',
-        help='insert one pdf file into another pdf file, after the given \
-            page number')
-    parser_insert.add_argument('src_pdf',
-        help='path to the source pdf file into which <ins_pdf> will be \
-            inserted')
-    parser_insert.add_argument('ins_pdf',
-        help='path to the pdf file to insert into <src_pdf>')
-    parser_insert.add_argument('page',
-        help='page number in <src_pdf> which <ins_pdf> will be inserted \
-            after e.g. if <page> is 5, then <ins_pdf> will be inserted \
-            after page 5 of <src_pdf>, such that the first page of \
-            <ins_pdf> will be page 6 in the output pdf file',
-        type=int)
-    
-    # subparser for 'split' command
-    parser_split = subparsers.add_parser('split',
-        help='split a pdf file into separate pdf files')
-    parser_split.add_argument('src_pdf',
-        help='path to the source pdf file which is to be split')
-    parser_split.add_argument('pages',
-        help='pages to save as separate pdf files, given as single page \
-            numbers or a range of pages in the format X-Y (inclusive) \
-            where X and Y are non-zero and X < Y e.g. \'2-3 5-7 9\' would\
-            save pages 2-3, 5-7, and 9 in the source pdf as three separate\
-            pdf files.', 
-        nargs='+')
-
-    # more to come ...
-    # convert
-
-    # print(parser.parse_args(['merge', 'path1', 'path2', 'path3']))
-
-    return parser
-
-def get_command_controls(command):
-    """
-    Maps a command to 
-
-    @param  command : str
-        Command input by the user. E.g. merge, remove. 
-        
-    @return cc[command] : dict
-        dict containing the following properties for the given command: 
-        arg_name, arg_checks, min_args, 
-    """
-
-    cc = {
-        'merge':{
-            'arg_name': ['pdfs'],
-            'arg_checks': [lambda path: check_filepath(path, 'pdf')],
-            'min_args': 2,
-            'execute': merge
-        },
-        'remove': {
-            'arg_name': ['src_pdf', 'pages'],
-            'arg_checks': [check_filepath, check_page_format],
-            'min_args': 2,
-            'execute': remove
-        },
-        'insert': {
-            'arg_name': ['src_pdf', 'ins_pdf', 'page'],
-            'arg_checks': [check_filepath, check_filepath, lambda x: True],
-            'min_args': 3,
-            'execute': insert
-        },
-        'split': {
-            'arg_name': ['src_pdf', 'pages'],
-            'arg_checks': [check_filepath, check_page_format],
-            'min_args': 2,
-            'execute': split 
-        }
-    }
-
-    return cc[command]
-
-def check_arguments(command, command_control, cl_arguments):
-    """
-    Checks that all arguments given at the command line are valid. 
-
-    @param  command : str
-        Command input by the user. E.g. merge, remove.
-
-    @param  command_control : dict
-        Dict mapping a command to its argument names, argument checking
-        functions, and the function to execute the required behaviour.
-
-    @param  cl_arguments : argparse.Namespace
-        Parsed arguments returned from calling ArgumentParser.parse_args().
-    
-    @return None (or raises an exception)
-
-    """
-
-    # ensure correct number of arguments were given
-    if len(sys.argv[2:]) < command_control['min_args']:
-        raise Exception('{} expects at least {} arguments'.format(command, command_control['min_args']))
-
-    # ensure that the given arguments are valid
-    for arg_name, check_func in zip(command_control['arg_name'], command_control['arg_checks']):
-        arguments = getattr(cl_arguments, arg_name)
-        if arguments:
-            if isinstance(arguments, list):
-                for arg in arguments:
-                    check_func(arg)
-            else:
-                check_func(arguments)
-
-    return None
-
-
-
+
+import os
+import sys
+import argparse
+import importlib
+try:
+    from .pages import parse_page_input, parse_order_input
+    from .instrument import phase
+except ImportError:
+    from pages import parse_page_input, parse_order_input
+    from instrument import phase
+
+# commands that can be run as a job, by a batch or a poc serve daemon
+JOB_COMMANDS = ('merge', 'remove', 'insert', 'split')
+
+# ways of saving output pdfs (see commands.SAVE_PROFILES)
+SAVE_PROFILES = ('fast', 'compact', 'linearized')
+
+# image formats of convert (see convert.IMAGE_FORMATS)
+IMAGE_FORMATS = ('png', 'jpg')
+
+# what extract can write for each page (see extract.EXTRACT_MODES)
+EXTRACT_MODES = ('text', 'words', 'blocks')
+
+# operations run by soak (see soak.OPERATIONS)
+SOAK_OPERATIONS = ('merge', 'remove', 'insert', 'split', 'remove_error', 'insert_error', 'open_error')
+
+# cache of the outputs of job commands, set by --cache
+_result_cache = None
+
+def check_filepath(filepath, required_filetype=None):
+    """
+    Checks that <filepath> is 1) a valid path, and 2) of the required    \
+    filetype. An invalid filepath raises a FileNotFoundError, and valid  \
+    filepaths whose extension are not of <required_filetype> raise an    \
+    ArgumentError. 
+
+    @param  filepaths : str
+        path to the file
+    @param  required_filetype : str
+        file type without the preceeding '.' i.e. 'pdf', not '.pdf'. 
+        Defaults to None.
+    
+    @return True (or raises a FileNotFoundError or ArgumentError)
+    """
+
+    filename, file_extension = os.path.splitext(filepath)
+    if required_filetype:
+        required_filetype_lc = required_filetype.lower()
+
+    if not os.path.isfile(filepath):
+        raise FileNotFoundError('{} is not a valid filepath'.format(filepath))
+    elif required_filetype and '.'+required_filetype_lc != file_extension:
+        error_msg = '{} is not the expected filetype ({})'.format(filepath, required_filetype)
+        raise argparse.ArgumentTypeError(error_msg) 
+    else:
+        return True
+
+def check_page_format(page_input):
+    """
+    Checks that page_input is in the correct format - a single, non-zero \
+    page number, a page range in the format X-Y (where X < Y), an open   \
+    ended page range X- or -Y, 'last', 'even' or 'odd' (see              \
+    pages.parse_page_input). 
+
+    @param  page_input : str
+        Page number or page range input by the user at the command line
+
+    @return True (or raises ValueError for invalid page input)
+    """
+    parse_page_input(page_input)
+    return True
+
+def check_order_format(order_input):
+    """
+    Checks that order_input is in the correct format for a term of a page
+    order - a page selection as for check_page_format, a page range going
+    backwards, or either rotated, e.g. 'r90:4' (see 
+    pages.parse_order_input).
+
+    @param  order_input : str
+        Page order term input by the user at the command line
+
+    @return True (or raises ValueError for invalid page order input)
+    """
+    parse_order_input(order_input)
+    return True
+
+def positive_int(value):
+    """
+    Argument type for options which take a whole number of at least one,
+    e.g. the number of worker processes.
+
+    @param  value : str
+        Value input by the user at the command line
+
+    @return int (or raises argparse.ArgumentTypeError)
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+
+    if number < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive whole number'.format(value))
+
+    return number
+
+def percentage(value):
+    """
+    Argument type for options which take a whole number from 1 to 100,
+    e.g. the quality of jpeg images.
+
+    @param  value : str
+        Value input by the user at the command line
+
+    @return int (or raises argparse.ArgumentTypeError)
+    """
+    number = positive_int(value)
+    if number > 100:
+        raise argparse.ArgumentTypeError('{} is not from 1 to 100'.format(value))
+
+    return number
+
+def non_negative_int(value):
+    """
+    Argument type for options which take a whole number of at least zero,
+    where zero turns the option off e.g. the number of pdfs to read ahead.
+
+    @param  value : str
+        Value input by the user at the command line
+
+    @return int (or raises argparse.ArgumentTypeError)
+    """
+    if value.strip() == '0':
+        return 0
+    try:
+        return positive_int(value)
+    except argparse.ArgumentTypeError:
+        raise argparse.ArgumentTypeError('{} is not a whole number of at least 0'.format(value))
+
+def read_path_list(list_path):
+    """
+    Argument type for options which take a file listing paths, one per
+    line, for when there are too many to give at the command line. A 
+    <list_path> of '-' reads the paths from stdin.
+
+    @param  list_path : str
+        Path to the file listing the paths, or '-' for stdin.
+
+    @return paths : list (or raises argparse.ArgumentTypeError)
+    """
+    try:
+        if list_path == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(list_path) as f:
+                lines = f.read().splitlines()
+    except OSError as e:
+        raise argparse.ArgumentTypeError('cannot read {} ({})'.format(list_path, e.strerror))
+
+    return [line.strip() for line in lines if line.strip()]
+
+class CommandAction(argparse._SubParsersAction):
+    """
+    Subparsers action which also keeps the arguments given after the
+    command, as command_argv, so that they are told apart from the options
+    given before it.
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        super().__call__(parser, namespace, values, option_string)
+        setattr(namespace, 'command_argv', list(values[1:]))
+
+def set_args():
+    """
+    Set up parser for command line arguments. Creates subparsers to allow
+    different commands to be run from the command line.
+
+    @return parser : ArgumentParser
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--local',
+        help='run the command in this process, even if a poc serve daemon \
+            is running',
+        action='store_true')
+    parser.add_argument('--trace',
+        help='write a json line giving the time spent in each phase of the\
+            command (opening, copying and saving pdfs etc.), the pages and \
+            bytes read and written, and the peak memory use, to FILE (or \
+            to stderr if FILE is -). Runs the command in this process.',
+        metavar='FILE')
+    parser.add_argument('--profile',
+        help='print the time spent in each phase of the command to stderr.\
+            Runs the command in this process.',
+        action='store_true')
+    parser.add_argument('--cache',
+        help='directory of a cache of the outputs of merge, remove, insert\
+            and split. Running a command again on the same inputs, with \
+            the same options, links or copies its earlier outputs into \
+            place rather than running it again. Runs the command in this \
+            process.',
+        metavar='DIR')
+    parser.add_argument('--cache-mb',
+        help='size in MB to keep the cache under, removing the least \
+            recently used outputs first. Defaults to 1024.',
+        metavar='MB',
+        type=positive_int,
+        default=1024)
+    parser.add_argument('--cache-key',
+        help='how the cache tells input pdfs apart: \'content\' hashes \
+            them, \'stat\' uses their path, size and modification time, \
+            which is quicker for large files. Defaults to content.',
+        choices=('content', 'stat'),
+        default='content')
+
+    # options shared by the commands which save pdfs
+    save_parser = argparse.ArgumentParser(add_help=False)
+    save_parser.add_argument('--save-profile',
+        help='how to save output pdfs: \'fast\' skips all clean up (and \
+            for remove, appends the change to a copy of <src_pdf>), \
+            \'compact\' removes unused and duplicate objects and compresses\
+            everything, \'linearized\' arranges the pdf for web viewing. \
+            Defaults to a plain save.',
+        choices=SAVE_PROFILES)
+    save_parser.add_argument('-o', '--output-dir',
+        help='directory to save output pdfs to. Defaults to the current \
+            working directory.')
+    save_parser.add_argument('-n', '--name',
+        help='template for the names of output pdfs, from the fields \
+            {stem} (the source pdf\'s name), {range} (the pages of a split\
+            output), {seq} (the number of the output), {time} and \
+            {command} e.g. \'{stem}_{range}_{seq}\'. An output is never \
+            written over: if the name is taken, _2, _3 etc. is added to it.\
+            Defaults to \'{time}\', or \'{time}_page_{range}\' for split.')
+    save_parser.add_argument('--fsync',
+        help='flush output pdfs to disk before they are moved into place, \
+            so that they survive a crash or power loss',
+        action='store_true')
+
+    # options shared by the commands which copy pages into new pdfs
+    images_parser = argparse.ArgumentParser(add_help=False)
+    images_parser.add_argument('--optimize',
+        help='downsample the images of output pdfs drawn at more than 1.5 \
+            times DPI to DPI (defaults to 150), and recompress them: jpeg \
+            images as jpeg, the rest with flate. Cannot be used with \
+            --large or --chunk-size.',
+        metavar='DPI',
+        type=positive_int,
+        nargs='?',
+        const=150)
+    images_parser.add_argument('--image-quality',
+        help='quality of the jpeg images recompressed by --optimize, from 1 \
+            to 100. Defaults to 75.',
+        type=percentage,
+        default=75)
+
+    # options shared by the commands which read their source pdfs whole
+    read_ahead_parser = argparse.ArgumentParser(add_help=False)
+    read_ahead_parser.add_argument('--read-ahead',
+        help='number of pdf files to read into memory ahead of the one \
+            being opened, so that reading them overlaps with checking and \
+            copying them (e.g. on network storage), or 0 to open each one \
+            from disk. Defaults to 4.',
+        metavar='N',
+        type=non_negative_int,
+        default=4)
+    read_ahead_parser.add_argument('--read-ahead-mb',
+        help='total size in MB of the pdf files read ahead at a time. A pdf\
+            file larger than this is not read ahead. Defaults to 256.',
+        type=positive_int,
+        default=256)
+
+    # initialise subparsers to handle different functionality
+    subparsers = parser.add_subparsers(help='command help', dest='invoked_command', required=True,
+        action=CommandAction)
+
+    # subparser for 'merge' command
+    parser_merge = subparsers.add_parser('merge', parents=[save_parser, images_parser, read_ahead_parser],
+        help='merges two or more pdf files into a single pdf file')
+    parser_merge.add_argument('pdfs', 
+        help='paths to two or more pdf files',
+        nargs='*')
+    parser_merge.add_argument('-f', '--from-file',
+        help='path to a file listing pdf files to merge (after <pdfs>), one\
+            per line, or \'-\' to read them from stdin',
+        type=read_path_list)
+    parser_merge.add_argument('-c', '--chunk-size',
+        help='build the output on disk this many pdf files at a time, so\
+            that memory use is bounded by the size of a chunk rather than\
+            the size of all the pdf files',
+        type=positive_int)
+    parser_merge.add_argument('--max-rss',
+        help='memory use (resident set size) in MB to keep the merge under\
+            by shrinking the chunk size. Requires --chunk-size.',
+        type=positive_int)
+    parser_merge.add_argument('--dedupe',
+        help='save the images, fonts and page contents repeated across the\
+            pdf files (e.g. the letterhead of many invoices) only once.\
+            Cannot be used with --chunk-size.',
+        action='store_true')
+
+    # subparser for 'remove' command
+    parser_remove = subparsers.add_parser('remove', parents=[save_parser, images_parser],
+        help='remove pages from a pdf file')
+    parser_remove.add_argument('src_pdf',
+        help='path to the pdf file to remove pages from')
+    parser_remove.add_argument('pages',
+        help='pages to remove from the source pdf, given as page number/s\
+            and/or page range/s in the format X-Y (inclusive) where X and\
+            Y are non-zero and X < Y e.g. \'2-3 5-7 9\' would remove \
+            pages 2, 3, 5, 6, 7, and 9 from the source pdf. Ranges may be\
+            open ended (\'5-\' is page 5 to the end, \'-3\' is pages 1-3),\
+            and \'last\', \'even\' and \'odd\' select those pages.',
+        nargs='+')
+    parser_remove.add_argument('--large',
+        help='large-file mode: append the removal to a copy of <src_pdf> \
+            without reading the pages that are kept, so that time and \
+            memory depend on the pages removed rather than the size of \
+            <src_pdf>. Links and bookmarks to removed pages are left in \
+            place. Cannot be used with the compact or linearized save \
+            profiles.',
+        action='store_true')
+
+    # subparser for 'insert' command
+    parser_insert = subparsers.add_parser('insert', parents=[save_parser, images_parser, read_ahead_parser],
+        help='insert one pdf file into another pdf file, after the given \
+            page number')
+    parser_insert.add_argument('src_pdf',
+        help='path to the source pdf file into which <ins_pdf> will be \
+            inserted')
+    parser_insert.add_argument('ins_pdf',
+        help='path to the pdf file to insert into <src_pdf>')
+    parser_insert.add_argument('page',
+        help='page number in <src_pdf> which <ins_pdf> will be inserted \
+            after e.g. if <page> is 5, then <ins_pdf> will be inserted \
+            after page 5 of <src_pdf>, such that the first page of \
+            <ins_pdf> will be page 6 in the output pdf file',
+        type=int)
+    parser_insert.add_argument('--large',
+        help='large-file mode: append <ins_pdf> to a copy of <src_pdf> as\
+            an incremental update, rather than copying every page of \
+            <src_pdf>. Cannot be used with the compact or linearized save\
+            profiles.',
+        action='store_true')
+    
+    # subparser for 'split' command
+    parser_split = subparsers.add_parser('split', parents=[save_parser, images_parser],
+        help='split a pdf file into separate pdf files')
+    parser_split.add_argument('src_pdf',
+        help='path to the source pdf file which is to be split')
+    parser_split.add_argument('pages',
+        help='pages to save as separate pdf files, given as single page \
+            numbers or a range of pages in the format X-Y (inclusive) \
+            where X and Y are non-zero and X < Y e.g. \'2-3 5-7 9\' would\
+            save pages 2-3, 5-7, and 9 in the source pdf as three separate\
+            pdf files. Ranges may be open ended (e.g. \'5-\' or \'-3\'), \
+            and \'last\', \'even\' and \'odd\' select those pages.', 
+        nargs='*')
+    split_by = parser_split.add_mutually_exclusive_group()
+    split_by.add_argument('-e', '--every',
+        help='instead of <pages>, split <src_pdf> into pdf files of this \
+            many pages each (the last may be shorter)',
+        type=positive_int)
+    split_by.add_argument('-b', '--by-bookmark',
+        help='instead of <pages>, split <src_pdf> at each of its bookmarks \
+            down to this level (defaults to 1, the top level). Any pages \
+            before the first bookmark are saved as a pdf file of their own.',
+        metavar='LEVEL',
+        type=positive_int,
+        nargs='?',
+        const=1)
+    parser_split.add_argument('-j', '--jobs',
+        help='number of worker processes to share the page ranges between.\
+            Each worker opens <src_pdf> once. Defaults to 1.',
+        type=positive_int,
+        default=1)
+
+    # subparser for 'rearrange' command
+    parser_rearrange = subparsers.add_parser('rearrange', parents=[save_parser, images_parser],
+        help='reorder, repeat, rotate and leave out the pages of a pdf \
+            file in a single pass')
+    parser_rearrange.add_argument('src_pdf',
+        help='path to the pdf file to rearrange')
+    parser_rearrange.add_argument('order',
+        help='pages of <src_pdf> in the order they are to be output, given\
+            as for split, and also as ranges going backwards (X-Y where X \
+            > Y, or \'last-Y\') and as selections rotated clockwise by a \
+            multiple of 90 degrees (rN:S e.g. \'r90:4\'). Pages may be \
+            given more than once, and pages not given are left out, e.g. \
+            \'1-3 10 5-9 r90:4 last-1\'.',
+        nargs='+')
+
+    # subparser for 'optimize' command
+    parser_optimize = subparsers.add_parser('optimize', parents=[save_parser],
+        help='downsample and recompress the images of a pdf file')
+    parser_optimize.add_argument('src_pdf',
+        help='path to the pdf file to optimize')
+    parser_optimize.add_argument('-d', '--dpi',
+        help='resolution to downsample images to. Only images drawn at \
+            more than 1.5 times this resolution are downsampled. Defaults \
+            to 150.',
+        type=positive_int,
+        default=150)
+    parser_optimize.add_argument('-q', '--quality',
+        help='quality of recompressed jpeg images, from 1 to 100. Defaults \
+            to 75.',
+        type=percentage,
+        default=75)
+    parser_optimize.add_argument('-j', '--jobs',
+        help='number of worker processes to share the images between. \
+            Defaults to 1.',
+        type=positive_int,
+        default=1)
+
+    # subparser for 'extract' command
+    parser_extract = subparsers.add_parser('extract',
+        help='write the text of each page of a pdf file as json lines')
+    parser_extract.add_argument('src_pdf',
+        help='path to the pdf file to extract text from')
+    parser_extract.add_argument('pages',
+        help='pages to extract, given as for remove e.g. \'1-3 7 last\'.\
+            Defaults to every page.',
+        nargs='*')
+    parser_extract.add_argument('-m', '--mode',
+        help='what to write for each page: \'text\' its text, \'words\'\
+            each word and \'blocks\' each block of text, with their \
+            positions. Defaults to text.',
+        choices=EXTRACT_MODES,
+        default='text')
+    parser_extract.add_argument('-j', '--jobs',
+        help='number of worker processes to share the pages between. Each\
+            worker opens <src_pdf> once, and the lines are still written \
+            in page order. Defaults to 1.',
+        type=positive_int,
+        default=1)
+    parser_extract.add_argument('--output',
+        help='file to write the json lines to, as each page is extracted,\
+            or - for stdout. Defaults to stdout.',
+        metavar='FILE',
+        default='-')
+
+    # subparser for 'index' command
+    parser_index = subparsers.add_parser('index',
+        help='build an index file next to each of the given pdf files, \
+            which split, remove and insert use to find pages without \
+            reading the whole page tree')
+    parser_index.add_argument('pdfs',
+        help='paths to the pdf files to index. Each index is saved as \
+            <pdf>.pocidx, and is used for as long as the pdf is unchanged.',
+        nargs='+')
+
+    # subparser for 'pipeline' command
+    parser_pipeline = subparsers.add_parser('pipeline', parents=[save_parser, images_parser],
+        help='merge, remove pages from, insert into and split pdf files in\
+            one go, saving only the end result')
+    parser_pipeline.add_argument('steps',
+        help='the steps, separated by \'+\': first \'merge PDF [PDF ...]\',\
+            then any of \'merge PDF [PDF ...]\', \'remove PAGES\' and \
+            \'insert PDF PAGE\', and last, optionally, \'split PAGES\', \
+            \'split -e N\' or \'split -b [LEVEL]\', each working on the \
+            document made by the steps before it e.g. \'merge a.pdf b.pdf\
+            + remove 3-5 + insert c.pdf 10 + split -b\'. Options for \
+            pipeline itself go before the steps.',
+        nargs=argparse.REMAINDER)
+
+    # subparser for 'batch' command
+    parser_batch = subparsers.add_parser('batch',
+        help='run the merge, remove, insert and split jobs listed in a \
+            manifest file in one process')
+    parser_batch.add_argument('manifest',
+        help='path to a csv file with one job per row, given as the command\
+            followed by its arguments e.g. \'split,in.pdf,1-3,7\', or a \
+            json-lines file with one job per line, given as a list in the \
+            same form or as an object e.g. {"id": "a1", "command": "split",\
+            "args": ["in.pdf", "1-3", "7"]}')
+    parser_batch.add_argument('-j', '--jobs',
+        help='number of worker processes to run the jobs on. Defaults to 1.',
+        type=positive_int,
+        default=1)
+    parser_batch.add_argument('-o', '--output-dir',
+        help='directory in which the outputs of each job are saved, in a \
+            directory named after the job id. Defaults to the current \
+            working directory.')
+    parser_batch.add_argument('--log',
+        help='path to write the json-lines log of job results to. Defaults\
+            to batch_log.jsonl in the output directory.')
+    parser_batch.add_argument('--max-docs',
+        help='number of source pdfs each worker keeps open between jobs. \
+            Defaults to 32.',
+        type=positive_int,
+        default=32)
+
+    # subparser for 'serve' command
+    parser_serve = subparsers.add_parser('serve',
+        help='run a daemon that the merge, remove, insert and split \
+            commands are sent to, keeping source pdfs open between commands')
+    parser_serve.add_argument('-a', '--address',
+        help='path of the unix socket to listen on, or HOST:PORT to listen\
+            on a tcp port. Defaults to $POC_SERVER or poc-<uid>.sock in the\
+            temp directory, which is where commands are sent to.')
+    parser_serve.add_argument('--allow-remote',
+        help='listen on a tcp address other than the loopback one (e.g. \
+            0.0.0.0:PORT). The daemon does not authenticate its clients: \
+            anyone who can reach the port can run commands as the user \
+            running the daemon, reading and writing pdfs in any directory \
+            it can. Only use on a trusted network.',
+        action='store_true')
+    parser_serve.add_argument('-j', '--jobs',
+        help='number of worker processes to run commands on. Defaults to 2.',
+        type=positive_int,
+        default=2)
+    parser_serve.add_argument('--cache-mb',
+        help='total size in MB of the source pdfs each worker keeps open.\
+            Defaults to 512.',
+        type=positive_int,
+        default=512)
+
+    # subparser for 'watch' command
+    parser_watch = subparsers.add_parser('watch',
+        help='run merge, remove, insert or split on each pdf file that \
+            arrives in a directory, e.g. a scanner\'s hot folder')
+    parser_watch.add_argument('directory',
+        help='the directory to watch')
+    parser_watch.add_argument('operation',
+        help='the command to run on each pdf file, and its arguments, \
+            without the source pdf e.g. \'split --every 1\' or \
+            \'insert cover.pdf 0\', or \'merge\' with --group. Options \
+            for watch itself go before the operation.',
+        nargs=argparse.REMAINDER)
+    parser_watch.add_argument('-o', '--output-dir',
+        help='directory to save outputs, the log and the metrics file to.\
+            Defaults to the current working directory.')
+    parser_watch.add_argument('-j', '--jobs',
+        help='number of worker processes to run jobs on. Defaults to 1.',
+        type=positive_int,
+        default=1)
+    parser_watch.add_argument('--queue',
+        help='most jobs handed to the workers at a time. Files arriving \
+            while the queue is full wait in the directory. Defaults to \
+            twice the number of jobs.',
+        metavar='N',
+        type=positive_int)
+    parser_watch.add_argument('--settle',
+        help='seconds a file must be unchanged for to be taken as fully \
+            written, unless it is seen being closed (with inotify). \
+            Defaults to 2.',
+        metavar='SECONDS',
+        type=float,
+        default=2.0)
+    parser_watch.add_argument('--poll',
+        help='look at the directory every this many seconds rather than \
+            use inotify, e.g. for network file systems. Polling is used \
+            anyway where inotify is not available.',
+        metavar='SECONDS',
+        type=float)
+    parser_watch.add_argument('--group',
+        help='for merge, a regular expression whose first group (or whole\
+            match) gives the group each file name belongs to e.g. \
+            \'^(.*)_p\\d+\\.pdf$\'. The files of a group are merged in \
+            name order.',
+        metavar='REGEX')
+    parser_watch.add_argument('--group-wait',
+        help='seconds after the last file of a group arrives that the \
+            group is taken as complete. Defaults to 10.',
+        metavar='SECONDS',
+        type=float,
+        default=10.0)
+    parser_watch.add_argument('--done',
+        help='directory to move files to once processed. Defaults to done\
+            in <directory>.',
+        metavar='DIR')
+    parser_watch.add_argument('--failed',
+        help='directory to move files to whose job failed. Defaults to \
+            failed in <directory>.',
+        metavar='DIR')
+    parser_watch.add_argument('--log',
+        help='path to append the json-lines log of job results to. \
+            Defaults to watch_log.jsonl in the output directory.')
+    parser_watch.add_argument('--metrics',
+        help='path of a json file kept up to date with the files waiting,\
+            the queue depth and the latency from a file arriving to its \
+            job finishing. Defaults to watch_metrics.json in the output \
+            directory.',
+        metavar='FILE')
+    parser_watch.add_argument('--idle-exit',
+        help='stop once nothing has been waiting or running for this many\
+            seconds, e.g. to process what has arrived from cron. Defaults\
+            to running until stopped.',
+        metavar='SECONDS',
+        type=float)
+
+    # subparser for 'bench' command
+    parser_bench = subparsers.add_parser('bench',
+        help='time merge, remove, insert and split on synthetic pdfs and \
+            write the results to a json file')
+    parser_bench.add_argument('-p', '--pages',
+        help='page counts of the synthetic pdfs to time the commands on. \
+            Defaults to 10 100 1000.',
+        type=positive_int,
+        nargs='+',
+        default=[10, 100, 1000])
+    parser_bench.add_argument('--images',
+        help='number of images on each page of the synthetic pdfs. \
+            Defaults to 0.',
+        type=int,
+        default=0)
+    parser_bench.add_argument('--fonts',
+        help='number of fonts (1 to 14) the synthetic pdfs are written in.\
+            Defaults to 1.',
+        type=positive_int,
+        default=1)
+    parser_bench.add_argument('-c', '--commands',
+        help='commands to time. Defaults to all of them.',
+        choices=JOB_COMMANDS,
+        nargs='+',
+        default=list(JOB_COMMANDS))
+    parser_bench.add_argument('-r', '--repeats',
+        help='number of times to run each command, of which the best time \
+            is reported. Defaults to 3.',
+        type=positive_int,
+        default=3)
+    parser_bench.add_argument('--data-dir',
+        help='directory the synthetic pdfs are generated in, and reused \
+            from by later runs. Defaults to poc-bench in the temp directory.')
+    parser_bench.add_argument('-o', '--output',
+        help='path to write the json results to. Defaults to \
+            bench_<time>.json in the current working directory.')
+    parser_bench.add_argument('--compare',
+        help='json results of an earlier run to compare with. Any time, \
+            peak memory or output size over <threshold> times the earlier\
+            one is reported, and the command fails.',
+        metavar='BASELINE')
+    parser_bench.add_argument('--threshold',
+        help='ratio to the baseline which counts as a regression. \
+            Defaults to 1.25.',
+        type=float,
+        default=1.25)
+
+    # subparser for 'soak' command
+    parser_soak = subparsers.add_parser('soak',
+        help='run merge, remove, insert and split thousands of times on \
+            synthetic pdfs, failing if memory, file descriptors, documents\
+            or threads are left behind, and report their latency')
+    parser_soak.add_argument('-n', '--iterations',
+        help='number of times to run each operation, after the warmup. \
+            Defaults to 1000.',
+        type=positive_int,
+        default=1000)
+    parser_soak.add_argument('--warmup',
+        help='number of times to run each operation before resources are \
+            first sampled. Defaults to 20.',
+        type=non_negative_int,
+        default=20)
+    parser_soak.add_argument('--sample-every',
+        help='number of iterations between samples of the resources of \
+            each process. Defaults to 100.',
+        type=positive_int,
+        default=100)
+    parser_soak.add_argument('-j', '--jobs',
+        help='number of worker processes to run the soak in at once, each \
+            running every operation. Defaults to 1 (run in this process).',
+        type=positive_int,
+        default=1)
+    parser_soak.add_argument('-p', '--pages',
+        help='number of pages in the synthetic source pdf. Defaults to 20.',
+        type=positive_int,
+        default=20)
+    parser_soak.add_argument('-c', '--operations',
+        help='operations to run: merge, remove, insert and split, and \
+            remove_error and insert_error failing on a page past the end \
+            of the pdf and open_error (split) failing on a file which is \
+            not a pdf. Defaults to all of them.',
+        metavar='OPERATION',
+        choices=SOAK_OPERATIONS,
+        nargs='+',
+        default=list(SOAK_OPERATIONS))
+    parser_soak.add_argument('--max-rss-growth',
+        help='growth of the resident set size of a process, in MB, allowed\
+            for over the soak. Defaults to 32.',
+        metavar='MB',
+        type=positive_int,
+        default=32)
+    parser_soak.add_argument('-o', '--output',
+        help='path to write the json results to. Defaults to \
+            soak_<time>.json in the current working directory.')
+
+    # subparser for 'convert' command
+    parser_convert = subparsers.add_parser('convert',
+        help='render pages of a pdf file to png or jpeg images')
+    parser_convert.add_argument('src_pdf',
+        help='path to the pdf file to render')
+    parser_convert.add_argument('pages',
+        help='pages to render, given as for remove e.g. \'1-3 7 last\',\
+            each saved as an image file of its own. Defaults to every page.',
+        nargs='*')
+    parser_convert.add_argument('-f', '--format',
+        help='image format. Defaults to png.',
+        choices=IMAGE_FORMATS,
+        default='png')
+    convert_size = parser_convert.add_mutually_exclusive_group()
+    convert_size.add_argument('--dpi',
+        help='resolution to render pages at. Defaults to 150.',
+        type=positive_int)
+    convert_size.add_argument('-s', '--size',
+        help='instead of --dpi, render each page to fit in a square of \
+            this many pixels, for thumbnails',
+        metavar='PX',
+        type=positive_int)
+    parser_convert.add_argument('-q', '--quality',
+        help='quality of jpeg images, from 1 to 100. Defaults to 85.',
+        type=percentage,
+        default=85)
+    parser_convert.add_argument('-j', '--jobs',
+        help='number of worker processes to share the pages between. Each\
+            worker opens <src_pdf> once, and writes each image as soon as \
+            it is rendered. Pages are cut into bands shared between the \
+            workers when there are fewer pages than workers. Defaults to 1.',
+        type=positive_int,
+        default=1)
+    parser_convert.add_argument('-o', '--output-dir',
+        help='directory to save images to. Defaults to the current working\
+            directory.')
+    parser_convert.add_argument('-n', '--name',
+        help='template for the names of images, from the same fields as \
+            for pdfs, {range} being the page number. Defaults to \
+            \'{time}_page_{range}\'.')
+    parser_convert.add_argument('--fsync',
+        help='flush images to disk before they are moved into place',
+        action='store_true')
+
+    # print(parser.parse_args(['merge', 'path1', 'path2', 'path3']))
+
+    return parser
+
+def lazy_execute(module_name, function_name):
+    """
+    Returns a function that runs <function_name> from the poc module 
+    <module_name>, importing the module only when it is called. Commands
+    are looked up this way so that PyMuPDF (and the other heavy imports)
+    are not imported for -h, or for arguments which fail their checks.
+
+    @param  module_name : str
+        Name of the module in poc e.g. 'commands'.
+    @param  function_name : str
+        Name of the function in the module e.g. 'merge'.
+
+    @return execute : function
+    """
+    def execute(arguments):
+        with phase('import'):
+            if __package__:
+                module = importlib.import_module('.'+module_name, __package__)
+            else:
+                module = importlib.import_module(module_name)
+        return getattr(module, function_name)(arguments)
+
+    execute.__name__ = function_name
+    return execute
+
+def cached_execute(command, execute):
+    """
+    Returns a function that runs a command through the result cache, if 
+    one is set (see set_result_cache), or else runs it directly.
+
+    @param  command : str
+        e.g. 'split'.
+    @param  execute : function
+        Runs the command, given its arguments.
+
+    @return execute : function
+    """
+    def run(arguments):
+        if _result_cache is None:
+            return execute(arguments)
+        return _result_cache.run(command, arguments, execute)
+
+    run.__name__ = execute.__name__
+    return run
+
+def set_result_cache(result_cache):
+    """
+    Sets the cache that the outputs of job commands are kept in.
+
+    @param  result_cache : ResultCache
+        The cache to use, or None to always run commands.
+
+    @return None
+    """
+    global _result_cache
+    _result_cache = result_cache
+    return None
+
+def get_command_controls(command):
+    """
+    Maps a command to 
+
+    @param  command : str
+        Command input by the user. E.g. merge, remove. 
+        
+    @return cc[command] : dict
+        dict containing the following properties for the given command: 
+        arg_name, arg_checks, min_args, 
+    """
+
+    cc = {
+        'merge':{
+            'arg_name': ['pdfs', 'from_file'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf'), lambda path: check_filepath(path, 'pdf')],
+            'min_args': 2,
+            'execute': cached_execute('merge', lazy_execute('commands', 'merge'))
+        },
+        'remove': {
+            'arg_name': ['src_pdf', 'pages'],
+            'arg_checks': [check_filepath, check_page_format],
+            'min_args': 2,
+            'execute': cached_execute('remove', lazy_execute('commands', 'remove'))
+        },
+        'insert': {
+            'arg_name': ['src_pdf', 'ins_pdf', 'page'],
+            'arg_checks': [check_filepath, check_filepath, lambda x: True],
+            'min_args': 3,
+            'execute': cached_execute('insert', lazy_execute('commands', 'insert'))
+        },
+        'split': {
+            'arg_name': ['src_pdf', 'pages'],
+            'arg_checks': [check_filepath, check_page_format],
+            'min_args': 2,
+            'execute': cached_execute('split', lazy_execute('commands', 'split'))
+        },
+        'rearrange': {
+            'arg_name': ['src_pdf', 'order'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf'), check_order_format],
+            'min_args': 2,
+            'execute': lazy_execute('commands', 'rearrange')
+        },
+        'optimize': {
+            'arg_name': ['src_pdf'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf')],
+            'min_args': 1,
+            'execute': lazy_execute('commands', 'optimize')
+        },
+        'convert': {
+            'arg_name': ['src_pdf', 'pages'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf'), check_page_format],
+            'min_args': 1,
+            'execute': lazy_execute('convert', 'convert')
+        },
+        'extract': {
+            'arg_name': ['src_pdf', 'pages'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf'), check_page_format],
+            'min_args': 1,
+            'execute': lazy_execute('extract', 'extract')
+        },
+        'index': {
+            'arg_name': ['pdfs'],
+            'arg_checks': [lambda path: check_filepath(path, 'pdf')],
+            'min_args': 1,
+            'execute': lazy_execute('pageindex', 'index')
+        },
+        'pipeline': {
+            'arg_name': [],
+            'arg_checks': [],
+            'min_args': 2,
+            'execute': lazy_execute('pipeline', 'pipeline')
+        },
+        'batch': {
+            'arg_name': ['manifest'],
+            'arg_checks': [check_filepath],
+            'min_args': 1,
+            'execute': lazy_execute('batch', 'run_batch')
+        },
+        'serve': {
+            'arg_name': [],
+            'arg_checks': [],
+            'min_args': 0,
+            'execute': lazy_execute('server', 'serve')
+        },
+        'watch': {
+            'arg_name': [],
+            'arg_checks': [],
+            'min_args': 2,
+            'execute': lazy_execute('watch', 'watch')
+        },
+        'soak': {
+            'arg_name': [],
+            'arg_checks': [],
+            'min_args': 0,
+            'execute': lazy_execute('soak', 'soak')
+        },
+        'bench': {
+            'arg_name': ['compare'],
+            'arg_checks': [check_filepath],
+            'min_args': 0,
+            'execute': lazy_execute('bench', 'bench')
+        }
+    }
+
+    return cc[command]
+
+def check_arguments(command, command_control, cl_arguments):
+    """
+    Checks that all arguments given at the command line are valid. 
+
+    @param  command : str
+        Command input by the user. E.g. merge, remove.
+
+    @param  command_control : dict
+        Dict mapping a command to its argument names, argument checking
+        functions, and the function to execute the required behaviour.
+
+    @param  cl_arguments : argparse.Namespace
+        Parsed arguments returned from calling ArgumentParser.parse_args().
+    
+    @return None (or raises an exception)
+
+    """
+
+    # ensure correct number of arguments were given, counting only those 
+    # after the command (not e.g. --profile before it)
+    if len(cl_arguments.command_argv) < command_control['min_args']:
+        raise Exception('{} expects at least {} arguments'.format(command, command_control['min_args']))
+
+    # ensure that the given arguments are valid
+    for arg_name, check_func in zip(command_control['arg_name'], command_control['arg_checks']):
+        arguments = getattr(cl_arguments, arg_name)
+        if arguments:
+            if isinstance(arguments, list):
+                for arg in arguments:
+                    check_func(arg)
+            else:
+                check_func(arguments)
+
+    return None
+
+
+
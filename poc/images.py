@@ -0,0 +1,357 @@
+import math
+import time
+import zlib
+import hashlib
+import inspect
+import contextlib
+import collections
+import fitz
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from .instrument import phase, count
+except ImportError:
+    from instrument import phase, count
+
+# resolution images are downsampled to, and the quality of the jpeg images
+# they are recompressed as, unless others are given
+DEFAULT_DPI = 150
+DEFAULT_QUALITY = 75
+
+# images are only downsampled when drawn at more than this many times the
+# target resolution, as smaller reductions save little for the detail lost
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# jpeg output is only supported by newer versions of PyMuPDF, and without
+# it every image is recompressed with flate
+JPEG_SUPPORTED = 'jpg_quality' in inspect.signature(fitz.Pixmap.tobytes).parameters
+
+# filters of images which are recompressed as jpeg, the rest with flate
+JPEG_FILTERS = ('/DCTDecode', '/JPXDecode')
+
+# colour spaces of the images handled, by their number of components
+DEVICE_SPACES = {1: '/DeviceGray', 3: '/DeviceRGB'}
+
+# size in bytes of the images kept in the digest cache
+CACHE_BYTES = 64*1024*1024
+
+# images recompressed by this process, keyed by a digest of the image and
+# the size and format it was recompressed to, so that an image repeated in
+# a pdf (or seen again by a long running process) is only recompressed once
+_cache = collections.OrderedDict()
+_cache_bytes = 0
+
+# settings of the optimized_images block being run in, or None outside of one
+_settings = None
+
+@contextlib.contextmanager
+def optimized_images(dpi=None, quality=DEFAULT_QUALITY, jobs=1):
+    """
+    Context manager which has every pdf saved in its block (see
+    commands.save_pdf) optimized first (see optimize_images).
+
+    @param  dpi : int
+        Resolution to downsample images to. Defaults to None (save the
+        images as they are).
+    @param  quality : int
+        Quality of jpeg images, from 1 to 100. Defaults to DEFAULT_QUALITY.
+    @param  jobs : int
+        Number of worker processes to share the images between. Defaults
+        to 1.
+    """
+    global _settings
+    outer = _settings
+    _settings = {'dpi': dpi, 'quality': quality, 'jobs': jobs} if dpi else None
+    try:
+        yield _settings
+    finally:
+        _settings = outer
+
+def optimization_requested():
+    """
+    @return settings : dict (or None)
+        The dpi, quality and jobs of the optimized_images block being run
+        in, for passing on to worker processes, or None if images are saved
+        as they are.
+    """
+    return _settings
+
+def optimize_images(pdf, dpi=DEFAULT_DPI, quality=DEFAULT_QUALITY, jobs=1):
+    """
+    Downsamples the images of a pdf which are drawn at more than
+    DOWNSAMPLE_THRESHOLD times <dpi> to <dpi>, and recompresses them: jpeg
+    (and jpeg 2000) images as jpeg at <quality>, the rest with flate. An
+    image drawn more than once is given the resolution of its largest
+    drawing. An image is only replaced if it comes out smaller.
+
+    Only 8 bit gray and RGB images are handled. Masks, images with a mask
+    or decode array, and CMYK, indexed and other colour spaces are left as
+    they are, as are images drawn inline in page contents.
+
+    The images are decoded, resized and encoded by a pool of <jobs> worker
+    processes. Each result is kept in a digest cache, so an image repeated
+    in the pdf (e.g. the letterhead of merged invoices) or already handled
+    by this process is not worked on again.
+
+    @param  pdf : fitz.Document
+        The pdf, which is changed in place.
+    @param  dpi : int
+        Resolution to downsample images to. Defaults to DEFAULT_DPI.
+    @param  quality : int
+        Quality of jpeg images, from 1 to 100. Defaults to DEFAULT_QUALITY.
+    @param  jobs : int
+        Number of worker processes. Defaults to 1.
+
+    @return stats : dict
+        images (the number drawn in the pdf), downsampled, cached (the
+        number of images not recompressed again, being copies of another
+        image or in the cache), bytes_before and bytes_after
+        (the total size of the images downsampled), and seconds (the time
+        spent in each stage: scan, encode and update).
+    """
+    stats = {'images': 0, 'downsampled': 0, 'cached': 0, 'bytes_before': 0, 'bytes_after': 0, 'seconds': {}}
+
+    with _stage('scan', stats):
+        sizes = _target_sizes(pdf, dpi)
+        stats['images'] = len(sizes.pop(None))
+        # the images to recompress, and each xref holding a copy of them,
+        # by their cache key
+        work = collections.OrderedDict()
+        for xref, size in sizes.items():
+            source = _image_source(pdf, xref)
+            if source is not None:
+                key = (source['digest'], size, source['image_format'], quality)
+                work.setdefault(key, (source, []))[1].append((xref, source['size']))
+
+    with _stage('encode', stats):
+        results = {key: _cache[key] for key in work if key in _cache}
+        for key in results:
+            _cache.move_to_end(key)
+        tasks = [(key, source, xrefs[0][0]) for key, (source, xrefs) in work.items() if key not in results]
+        stats['cached'] = sum(len(xrefs) for _, xrefs in work.values()) - len(tasks)
+        for key, data in _recompress_all(pdf, tasks, quality, jobs):
+            results[key] = data
+            _cache_result(key, data)
+
+    with _stage('update', stats):
+        for key, (_, xrefs) in work.items():
+            data = results[key]
+            for xref, size in xrefs:
+                if data is None or len(data) >= size:
+                    continue
+                _replace_image(pdf, xref, data, key[1], key[2])
+                stats['downsampled'] += 1
+                stats['bytes_before'] += size
+                stats['bytes_after'] += len(data)
+
+    count('images_downsampled', stats['downsampled'])
+    count('images_cached', stats['cached'])
+    count('image_bytes_before', stats['bytes_before'])
+    count('image_bytes_after', stats['bytes_after'])
+
+    return stats
+
+def clear_cache():
+    """
+    Empties the digest cache of recompressed images.
+
+    @return None
+    """
+    global _cache_bytes
+    _cache.clear()
+    _cache_bytes = 0
+    return None
+
+@contextlib.contextmanager
+def _stage(name, stats):
+    # timed for the report, and as a phase of the command being traced
+    start = time.perf_counter()
+    with phase('image_' + name):
+        yield
+    stats['seconds'][name] = time.perf_counter() - start
+
+def _target_sizes(pdf, dpi):
+    """
+    Works out the size in pixels to downsample each image to, from the
+    largest it is drawn on any page (the one needing the most pixels).
+
+    Each drawing is matched to the images of its page by its size in
+    pixels, as matching it to its xref exactly means hashing the pixels of
+    every image on the page. An image of the same size as another drawn on
+    the same page gets the resolution of the larger drawing of the two.
+
+    @return sizes : dict
+        {xref: (width, height)} of the images to downsample, and under the
+        key None the xrefs of every image drawn.
+    """
+    resolutions = {}
+    dimensions = {}
+    for page in pdf:
+        xrefs = collections.defaultdict(set)
+        for item in page.get_images(full=True):
+            xrefs[item[2], item[3]].add(item[0])
+            dimensions[item[0]] = (item[2], item[3])
+        for info in page.get_image_info():
+            # the lengths on the page, in inches, of the image's sides
+            a, b, c, d = info['transform'][:4]
+            inches = (math.hypot(a, b)/72, math.hypot(c, d)/72)
+            resolution = min(info['width']/inches[0] if inches[0] else math.inf,
+                             info['height']/inches[1] if inches[1] else math.inf)
+            # images drawn inline in the page contents have no xref
+            for xref in xrefs.get((info['width'], info['height']), ()):
+                resolutions[xref] = min(resolutions.get(xref, math.inf), resolution)
+
+    sizes = {None: list(resolutions)}
+    for xref, resolution in resolutions.items():
+        width, height = dimensions[xref]
+        if dpi*DOWNSAMPLE_THRESHOLD < resolution < math.inf:
+            scale = dpi / resolution
+            sizes[xref] = (max(1, round(width*scale)), max(1, round(height*scale)))
+    return sizes
+
+def _image_source(pdf, xref):
+    """
+    Reads what a worker needs to decode an image, or None if the image is
+    not one that is handled.
+    """
+    keys = {key: pdf.xref_get_key(xref, key) for key in
+            ('Width', 'Height', 'BitsPerComponent', 'ColorSpace', 'Filter', 'DecodeParms', 'ImageMask', 'Mask',
+             'Decode')}
+    if keys['ImageMask'][1] == 'true' or keys['Mask'][0] != 'null' or keys['Decode'][0] != 'null':
+        return None
+    if keys['BitsPerComponent'][1] != '8' or keys['Filter'][0] not in ('name', 'array', 'null') or \
+            keys['DecodeParms'][0] not in ('dict', 'array', 'null'):
+        return None
+    components = _components(pdf, keys['ColorSpace'])
+    if components not in DEVICE_SPACES:
+        return None
+
+    filters = keys['Filter'][1] if keys['Filter'][0] != 'null' else None
+    decode_parms = keys['DecodeParms'][1] if keys['DecodeParms'][0] != 'null' else None
+    jpeg = JPEG_SUPPORTED and filters is not None and any(name in filters for name in JPEG_FILTERS)
+    raw = pdf.xref_stream_raw(xref)
+    digest = hashlib.sha1(raw)
+    digest.update(repr((keys['Width'], keys['Height'], components, filters, decode_parms)).encode())
+    return {'digest': digest.hexdigest(), 'size': len(raw), 'width': int(keys['Width'][1]), 'height': int(keys['Height'][1]),
+            'components': components, 'filters': filters, 'decode_parms': decode_parms,
+            'image_format': 'jpg' if jpeg else 'flate'}
+
+def _components(pdf, colorspace):
+    """
+    @return components : int (or None)
+        The number of components of a device gray or RGB colour space, or
+        of an ICC based one, else None.
+    """
+    kind, value = colorspace
+    if kind == 'name':
+        return {'/DeviceGray': 1, '/DeviceRGB': 3}.get(value)
+    if kind == 'xref':
+        value = pdf.xref_object(int(value.split()[0]), compressed=True)
+    # [/ICCBased 12 0 R]
+    parts = value.strip('[] ').split()
+    if len(parts) != 4 or parts[0] != '/ICCBased':
+        return None
+    kind, n = pdf.xref_get_key(int(parts[1]), 'N')
+    return int(n) if kind == 'int' else None
+
+def _recompress_all(pdf, tasks, quality, jobs):
+    """
+    Recompresses an image for each task, in a pool of worker processes if
+    more than one job is given. Only a few images for each worker are read
+    ahead of those being recompressed, so the images of a large pdf are not
+    all held in memory at once.
+
+    @param  tasks : list
+        List of (key, source, xref) tuples, where key is the cache key of
+        the image, and source is as read by _image_source.
+
+    @return results : generator
+        (key, data) for each task, in order, where data is the recompressed
+        image, or None if it could not be decoded.
+    """
+    def arguments(key, source, xref):
+        return (pdf.xref_stream_raw(xref), source['width'], source['height'], source['components'],
+                source['filters'], source['decode_parms'], key[1], key[2], quality)
+
+    if jobs <= 1 or len(tasks) <= 1:
+        for key, source, xref in tasks:
+            yield key, recompress_image(*arguments(key, source, xref))
+        return
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        try:
+            for key, source, xref in tasks:
+                pending.append((key, executor.submit(recompress_image, *arguments(key, source, xref))))
+                if len(pending) >= jobs*2:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def recompress_image(raw, width, height, components, filters, decode_parms, size, image_format, quality):
+    """
+    Decodes the stream of an image, resizes it, and encodes it again.
+
+    @param  raw : bytes
+        The stream of the image, as stored in the pdf.
+    @param  width, height : int
+        Size of the image in pixels.
+    @param  components : int
+        Number of colour components (1 for gray, 3 for RGB).
+    @param  filters : str
+        The image's /Filter, a name or array of names, or None.
+    @param  decode_parms : str
+        The image's /DecodeParms, or None.
+    @param  size : tuple
+        (width, height) in pixels to resize the image to.
+    @param  image_format : str
+        'jpg' or 'flate'.
+    @param  quality : int
+        Quality of a jpeg image, from 1 to 100.
+
+    @return data : bytes (or None if the image cannot be decoded)
+    """
+    # the image is decoded by MuPDF as part of a pdf of its own, so that
+    # every filter a pdf can use is handled
+    with fitz.open() as image_pdf:
+        xref = image_pdf.get_new_xref()
+        image_pdf.update_object(xref, '<< /Type /XObject /Subtype /Image /Width {} /Height {} /BitsPerComponent 8 '
+                                      '/ColorSpace {} >>'.format(width, height, DEVICE_SPACES[components]))
+        image_pdf.update_stream(xref, raw, new=True, compress=False)
+        # set after the stream, which clears them
+        if filters:
+            image_pdf.xref_set_key(xref, 'Filter', filters)
+        if decode_parms:
+            image_pdf.xref_set_key(xref, 'DecodeParms', decode_parms)
+        try:
+            pixmap = fitz.Pixmap(image_pdf, xref)
+        except RuntimeError:
+            # the error type differs between versions of PyMuPDF
+            return None
+
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    pixmap = fitz.Pixmap(pixmap, size[0], size[1], None)
+    if image_format == 'jpg':
+        return pixmap.tobytes('jpg', jpg_quality=quality)
+    return zlib.compress(pixmap.samples, 6)
+
+def _replace_image(pdf, xref, data, size, image_format):
+    pdf.update_stream(xref, data, compress=False)
+    # set after the stream, which clears the filter
+    pdf.xref_set_key(xref, 'Filter', '/DCTDecode' if image_format == 'jpg' else '/FlateDecode')
+    pdf.xref_set_key(xref, 'DecodeParms', 'null')
+    pdf.xref_set_key(xref, 'Width', str(size[0]))
+    pdf.xref_set_key(xref, 'Height', str(size[1]))
+
+def _cache_result(key, data):
+    global _cache_bytes
+    _cache[key] = data
+    _cache_bytes += len(data) if data else 0
+    while _cache_bytes > CACHE_BYTES and _cache:
+        _, dropped = _cache.popitem(last=False)
+        _cache_bytes -= len(dropped) if dropped else 0
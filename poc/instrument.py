@@ -0,0 +1,176 @@
+import sys
+import json
+import time
+import contextlib
+try:
+    from .memory import peak_rss
+except ImportError:
+    from memory import peak_rss
+
+# functions called with the record of each traced command (see add_hook)
+_hooks = []
+
+# record of the command being traced, or None when there is nothing to trace
+_record = None
+
+# returned by phase() when nothing is being traced
+_NO_PHASE = contextlib.nullcontext()
+
+def add_hook(hook):
+    """
+    Adds a function to be called with the record of each command run in
+    this process from then on. The record is a dict of:
+        command     the command e.g. 'merge'
+        argv        the arguments it was run with
+        status      'ok' or 'error'
+        error       the error, if there was one
+        seconds     wall time of the whole command
+        phases      {name: {'seconds': ..., 'calls': ...}} for each phase
+                    of the command e.g. open, insert_pdf, save
+        counters    {name: total} e.g. pages_read, bytes_written
+        peak_rss    peak resident set size of the process so far, in bytes
+    Commands are only timed while there is at least one hook.
+
+    @param  hook : function
+        Called with the record once the command has finished.
+
+    @return hook : function
+    """
+    _hooks.append(hook)
+    return hook
+
+def remove_hook(hook):
+    """
+    Removes a hook added by add_hook.
+
+    @return None
+    """
+    _hooks.remove(hook)
+    return None
+
+class _Phase:
+    __slots__ = ('phases', 'name', 'start')
+
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phase = self.phases.get(self.name)
+        if phase is None:
+            phase = self.phases[self.name] = {'seconds': 0.0, 'calls': 0}
+        phase['seconds'] += time.perf_counter() - self.start
+        phase['calls'] += 1
+        return False
+
+def phase(name):
+    """
+    Context manager which adds the time spent in its block to the phase
+    <name> of the command being traced. Does nothing when no command is
+    being traced.
+
+    @param  name : str
+        Name of the phase e.g. 'save'.
+    """
+    if _record is None:
+        return _NO_PHASE
+    return _Phase(_record['phases'], name)
+
+def count(name, n=1):
+    """
+    Adds <n> to the counter <name> of the command being traced, if any.
+
+    @return None
+    """
+    if _record is not None:
+        _record['counters'][name] = _record['counters'].get(name, 0) + n
+    return None
+
+def tracing():
+    """
+    @return bool
+        Whether commands are being traced (there is at least one hook).
+    """
+    return bool(_hooks)
+
+@contextlib.contextmanager
+def command_trace(command, argv=None):
+    """
+    Context manager which traces the command run in its block, and calls
+    the hooks with its record at the end. Traces can be nested e.g. for
+    the jobs of a batch, in which case the phases of the inner command
+    are only recorded in its own record.
+
+    @param  command : str
+        The command e.g. 'merge'.
+    @param  argv : list
+        The arguments it was run with.
+
+    @return record : dict (or None if nothing is being traced)
+    """
+    global _record
+    if not _hooks:
+        yield None
+        return
+
+    outer_record = _record
+    record = _record = {'command': command, 'argv': list(argv or []), 'status': 'ok',
+                        'seconds': 0.0, 'phases': {}, 'counters': {}}
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'error'
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+        raise
+    finally:
+        _record = outer_record
+        record['seconds'] = time.perf_counter() - start
+        record['peak_rss'] = peak_rss()
+        for hook in list(_hooks):
+            hook(record)
+
+def json_lines_hook(path='-'):
+    """
+    Returns a hook which writes each record as a line of json to <path>,
+    appending to the file, or to stderr if <path> is '-'.
+
+    @return hook : function
+    """
+    def hook(record):
+        line = json.dumps(record) + '\n'
+        if path == '-':
+            sys.stderr.write(line)
+        else:
+            with open(path, 'a') as f:
+                f.write(line)
+    return hook
+
+def print_profile(record, file=None):
+    """
+    Hook which prints a breakdown of the time a command spent in each of
+    its phases, and its counters, to stderr.
+
+    @return None
+    """
+    file = file or sys.stderr
+    seconds = record['seconds']
+    print('{}: {} in {:.3f} s, peak rss {:.1f} MB'.format(record['command'], record['status'],
+          seconds, record['peak_rss']/(1024*1024)), file=file)
+
+    phases = sorted(record['phases'].items(), key=lambda item: -item[1]['seconds'])
+    for name, phase in phases:
+        print('  {:<14} {:>6} calls {:>9.3f} s {:>5.1f}%'.format(name, phase['calls'], phase['seconds'],
+              100*phase['seconds']/seconds if seconds else 0), file=file)
+    other = seconds - sum(phase['seconds'] for _, phase in phases)
+    print('  {:<14} {:>12} {:>9.3f} s {:>5.1f}%'.format('(other)', '', other,
+          100*other/seconds if seconds else 0), file=file)
+
+    for name, total in sorted(record['counters'].items()):
+        print('  {:<14} {:>12}'.format(name, total), file=file)
+
+    return None
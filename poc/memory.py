@@ -0,0 +1,37 @@
+import sys
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+def current_rss():
+    """
+    Returns the resident set size of this process, in bytes. Reads
+    /proc/self/statm where it exists (Linux), and falls back to the peak
+    resident set size elsewhere.
+
+    @return rss : int
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        return peak_rss()
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process, in bytes, or 0
+    where it cannot be measured.
+
+    @return rss : int
+    """
+    if resource is None:
+        return 0
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS, and kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
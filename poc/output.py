@@ -0,0 +1,244 @@
+import os
+import errno
+import datetime
+import contextlib
+
+# output names used when no template is given, which are those poc has
+# always used e.g. 142501_05032021.pdf and 142501_05032021_page_1-3.pdf
+DEFAULT_TEMPLATE = '{time}'
+DEFAULT_RANGE_TEMPLATE = '{time}_page_{range}'
+
+# (temp_path, path) pairs written in an atomic_outputs block, and the paths
+# it reserved, or None outside of one
+_pending = None
+
+# the naming fields of each output made in a record_outputs block, or None
+# outside of one
+_recorded = None
+
+def format_name(template=None, source=None, page_range='', seq=1, command='', extension='.pdf'):
+    """
+    Fills in an output name template. The fields are:
+        {time}      the time and date e.g. 142501_05032021
+        {stem}      the name of the source pdf without its extension
+        {range}     the page selection an output of split holds e.g. 1-3
+        {seq}       the number of the output, counting from 1
+        {command}   the command e.g. split
+
+    @param  template : str
+        e.g. '{stem}_{range}_{seq}'. Defaults to DEFAULT_TEMPLATE, or
+        DEFAULT_RANGE_TEMPLATE for outputs with a page range.
+    @param  source : str
+        Path to the source pdf. Defaults to None (an empty stem).
+    @param  extension : str
+        Extension of the output e.g. '.png'. Defaults to '.pdf'.
+
+    @return name : str
+        The name, with <extension> added unless the template gives it.
+        (Or raises ValueError for an unknown field.)
+    """
+    if template is None:
+        template = DEFAULT_RANGE_TEMPLATE if page_range else DEFAULT_TEMPLATE
+
+    stem = os.path.splitext(os.path.basename(source))[0] if isinstance(source, str) else ''
+    try:
+        name = template.format(time=datetime.datetime.now().strftime('%H%M%S_%d%m%Y'), stem=stem,
+                               range=page_range, seq=seq, command=command)
+    except (KeyError, IndexError) as e:
+        raise ValueError('unknown field {} in output name template {}'.format(e, template))
+
+    if os.sep in name or (os.altsep and os.altsep in name):
+        raise ValueError('output name template {} gives a path, not a file name'.format(template))
+    return name if name.lower().endswith(extension) else name+extension
+
+def output_path(out_dir=None, template=None, source=None, page_range='', seq=1, command='', extension='.pdf'):
+    """
+    Reserves a path for an output in <out_dir>, named by <template> (see 
+    format_name and reserve_path).
+
+    @return path : str
+    """
+    path = reserve_path(out_dir, format_name(template, source, page_range, seq, command, extension))
+    if _recorded is not None:
+        _recorded.append({'path': path, 'source': source, 'range': page_range, 'seq': seq})
+    return path
+
+@contextlib.contextmanager
+def record_outputs():
+    """
+    Context manager which records the naming fields (source, range and 
+    seq) of the outputs reserved by output_path in its block, in order, so
+    that the same outputs can be named again later e.g. by the result 
+    cache.
+
+    @return recorded : list
+        List of dicts with the keys 'path', 'source', 'range' and 'seq'.
+    """
+    global _recorded
+    outer = _recorded
+    recorded = _recorded = []
+    try:
+        yield recorded
+    finally:
+        _recorded = outer
+
+def reserve_path(out_dir, name):
+    """
+    Reserves a path for an output by creating a hidden placeholder for it
+    (see placeholder_path), if neither exists. If one does (e.g. from
+    another call in the same second, or another process writing to the
+    same directory), '_2', '_3' etc. is added to the name until a free one
+    is found. Creating the placeholder is atomic, so processes sharing a
+    directory never get the same path, without needing a lock.
+
+    Nothing is made at the path itself until the output is moved into
+    place by commit, which removes the placeholder after it, so a process
+    killed before then leaves only the hidden placeholder behind, never an
+    empty file under the output's name.
+
+    @param  out_dir : str
+        Directory of the output. Defaults to the current working directory.
+    @param  name : str
+        File name of the output e.g. 'report_1-3.pdf'.
+
+    @return path : str
+    """
+    stem, ext = os.path.splitext(name)
+    n = 1
+    while True:
+        path = os.path.join(out_dir or os.getcwd(), name if n == 1 else '{}_{}{}'.format(stem, n, ext))
+        n += 1
+        placeholder = placeholder_path(path)
+        try:
+            os.close(os.open(placeholder, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        except FileExistsError:
+            continue
+        # the placeholder is made first, and removed only after the output
+        # is in place, so another process never sees the name free
+        if os.path.lexists(path):
+            release(path)
+            continue
+
+        if _pending is not None:
+            _pending['reserved'].append(path)
+        return path
+
+def placeholder_path(path):
+    """
+    @return placeholder_path : str
+        The hidden file which reserves <path> e.g. '.report.pdf.reserved'
+        for 'report.pdf', which the watch command and directory listings
+        pass over.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.{}.reserved'.format(name))
+
+def release(path):
+    """
+    Removes the placeholder reserving <path>, if there is one, e.g. once
+    something has been moved there.
+
+    @return None
+    """
+    discard(placeholder_path(path))
+    return None
+
+def temp_path(path):
+    """
+    Creates an empty temporary file next to <path>, to write its contents
+    to before they are moved into place by commit.
+
+    @return temp_path : str
+    """
+    directory, name = os.path.split(path)
+    while True:
+        temp = os.path.join(directory, '.{}.{}.tmp'.format(name, os.urandom(4).hex()))
+        try:
+            os.close(os.open(temp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+            return temp
+        except FileExistsError:
+            continue
+
+def commit(temp, path):
+    """
+    Moves a finished temporary file into place at <path>, in one atomic
+    step, so that <path> is never seen part written, then releases the
+    reservation of <path>. In an atomic_outputs block, the move is made at
+    the end of the block.
+
+    @return None
+    """
+    if _pending is not None:
+        _pending['written'].append((temp, path))
+    else:
+        os.replace(temp, path)
+        release(path)
+    return None
+
+def discard(temp):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temp)
+
+@contextlib.contextmanager
+def atomic_outputs(fsync=False):
+    """
+    Context manager which holds back the outputs committed in its block
+    until the block has finished, then moves them all into place. If the
+    block raises, the outputs are deleted instead, and the paths it
+    reserved released, so that a command leaves either all of its outputs
+    or none.
+
+    @param  fsync : bool
+        Flush the outputs to disk before they are moved into place, and
+        their directories after, so that they survive a crash or power
+        loss. The flushes are made together at the end. Defaults to False.
+    """
+    global _pending
+    outer = _pending
+    pending = _pending = {'written': [], 'reserved': [], 'fsync': fsync}
+    try:
+        yield pending
+    except BaseException:
+        _pending = outer
+        for temp, _ in pending['written']:
+            discard(temp)
+        for path in pending['reserved']:
+            release(path)
+        raise
+
+    _pending = outer
+    if fsync:
+        for temp, _ in pending['written']:
+            _fsync(temp)
+    for temp, path in pending['written']:
+        os.replace(temp, path)
+        # reserved by an outer block, which releases it again at its end
+        release(path)
+    for path in pending['reserved']:
+        release(path)
+    if fsync:
+        for directory in {os.path.dirname(os.path.abspath(path)) for _, path in pending['written']}:
+            _fsync(directory)
+
+def fsync_requested():
+    """
+    @return bool
+        Whether the atomic_outputs block being run in flushes its outputs
+        to disk, for passing on to worker processes.
+    """
+    return bool(_pending and _pending['fsync'])
+
+def _fsync(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (IsADirectoryError, PermissionError):
+        # directories cannot be opened on Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # some file systems cannot sync directories
+        if e.errno not in (errno.EINVAL, errno.EBADF):
+            raise
+    finally:
+        os.close(fd)
@@ -0,0 +1,406 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import fitz
+from collections import OrderedDict
+try:
+    from . import output
+    from .instrument import phase, count
+except ImportError:
+    import output
+    from instrument import phase, count
+
+# bumped whenever the layout of the index changes, so that older indexes
+# are built again rather than misread
+INDEX_VERSION = 1
+
+# extension of the index sidecar file, added to the name of the pdf
+INDEX_EXTENSION = '.pocidx'
+
+# bytes at each end of the pdf hashed to tell a changed pdf from the one
+# indexed, where the size and modification time are the same
+SAMPLE_BYTES = 64*1024
+
+# attributes a page inherits from its parents in the page tree
+INHERITED_KEYS = ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+
+# number of loaded indexes kept in memory, for long running callers such
+# as a batch
+CACHE_INDEXES = 8
+
+_REF_RE = re.compile(rb'(\d+) \d+ R')
+_PARENT_RE = re.compile(rb'/Parent\s*\d+ \d+ R')
+
+# loaded indexes, by the absolute path of their pdf, least recently used
+# first
+_cache = OrderedDict()
+
+def index_path(pdf_path):
+    """
+    @return index_path : str
+        Path to the index sidecar file of the pdf at <pdf_path>.
+    """
+    return pdf_path + INDEX_EXTENSION
+
+def file_signature(pdf_path):
+    """
+    Identifies the contents of a pdf file by its size, modification time
+    and a hash of its first and last SAMPLE_BYTES (which hold the header,
+    and the trailer and cross reference table that any change to a pdf
+    rewrites), without reading the whole of a large file.
+
+    @param  pdf_path : str
+
+    @return signature : dict
+    """
+    stat = os.stat(pdf_path)
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        digest.update(f.read(SAMPLE_BYTES))
+        if stat.st_size > SAMPLE_BYTES:
+            f.seek(max(SAMPLE_BYTES, stat.st_size - SAMPLE_BYTES))
+            digest.update(f.read())
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sample': digest.hexdigest()}
+
+class PageIndex:
+    """
+    Index of a pdf, saved to a sidecar file next to it, so that commands
+    run again and again on the same large pdf can find its pages without
+    resolving its page tree, which for a pdf of many pages means loading
+    every page object (see restrict).
+
+    The index holds the page count, the object number of each page, the
+    attributes each page inherits from the page tree, the objects each
+    page depends on (its contents, resources, annotations etc., but not
+    other pages) and a digest of each stream among them, so that pages
+    sharing a resource can be found without reading it.
+    """
+
+    def __init__(self, signature, page_xrefs, inherited, dependencies=None, digests=None, path=None):
+        """
+        @param  signature : dict
+            The file_signature of the pdf indexed.
+        @param  page_xrefs : list
+            Object number of each page, in page order.
+        @param  inherited : dict
+            For each page whose parent is not the root of the page tree,
+            the attributes it inherits, by its object number.
+        @param  dependencies : list
+            Object numbers each page depends on, in page order.
+        @param  digests : dict
+            sha1 digest of each stream the pages depend on, by its object
+            number.
+        @param  path : str
+            Path to the index file to read <dependencies> and <digests>
+            from when they are first used, if they are not given.
+        """
+        self.signature = signature
+        self.page_xrefs = page_xrefs
+        self.inherited = inherited
+        self._dependencies = dependencies
+        self._digests = digests
+        self._path = path
+
+    @property
+    def page_count(self):
+        return len(self.page_xrefs)
+
+    @property
+    def dependencies(self):
+        if self._dependencies is None:
+            self._load_objects()
+        return self._dependencies
+
+    @property
+    def digests(self):
+        if self._digests is None:
+            self._load_objects()
+        return self._digests
+
+    def _load_objects(self):
+        # the objects are on the second line of the index file, which is
+        # most of it, and are not needed to find the pages
+        with open(self._path) as f:
+            f.readline()
+            data = json.loads(f.readline())
+        self._dependencies = data['dependencies']
+        self._digests = {int(xref): digest for xref, digest in data['digests'].items()}
+
+    def objects_of(self, pages):
+        """
+        @param  pages : iterable
+            Page numbers, counting from 1.
+
+        @return xrefs : set
+            The pages and the objects they depend on, which are those
+            copying them copies.
+        """
+        xrefs = set()
+        for page in pages:
+            xrefs.add(self.page_xrefs[page-1])
+            xrefs.update(self.dependencies[page-1])
+        return xrefs
+
+    def restrict(self, pdf, pages):
+        """
+        Makes the page tree of the open, indexed pdf list only the given
+        pages, in order, without reading the page tree or any other page,
+        so that copying them (e.g. by insert_pdf) reads only what they
+        need. The pdf is changed, so must be opened by the caller alone 
+        (see commands.open_private_pdf). Links and bookmarks to the pages
+        left out are left in place, pointing nowhere.
+
+        @param  pdf : fitz.Document
+        @param  pages : list
+            Page numbers, counting from 1, which become pages 1, 2, 3 ...
+
+        @return None
+        """
+        page_xrefs = [self.page_xrefs[page-1] for page in pages]
+        set_page_tree(pdf, page_xrefs, {xref: self.inherited[xref] for xref in page_xrefs
+                                        if xref in self.inherited})
+        return None
+
+    def write(self, f):
+        """
+        Writes the index to a text file object, as two lines of json: the 
+        pages, then the objects they depend on.
+        """
+        json.dump({'version': INDEX_VERSION, 'source': self.signature, 'pages': self.page_xrefs,
+                   'inherited': {str(xref): values for xref, values in self.inherited.items()}},
+                  f, separators=(',', ':'))
+        f.write('\n')
+        json.dump({'dependencies': self.dependencies,
+                   'digests': {str(xref): digest for xref, digest in self.digests.items()}},
+                  f, separators=(',', ':'))
+        f.write('\n')
+
+    @classmethod
+    def read(cls, path):
+        """
+        Reads the pages of an index file, leaving the objects they depend
+        on to be read when they are first used.
+
+        @return page_index : PageIndex (or None if it is of another version)
+        """
+        with open(path) as f:
+            data = json.loads(f.readline())
+        if data.get('version') != INDEX_VERSION:
+            return None
+        return cls(data['source'], data['pages'], {int(xref): values for xref, values in data['inherited'].items()},
+                   path=path)
+
+def page_tree_root(pdf):
+    """
+    @return xref : int
+        Object number of the root of the page tree of <pdf>.
+    """
+    return int(pdf.xref_get_key(pdf.pdf_catalog(), 'Pages')[1].split()[0])
+
+def inherited_values(pdf, xref):
+    """
+    @return values : dict
+        The INHERITED_KEYS the page object <xref> does not have itself,
+        mapped to their values in the nearest of its parents which has
+        them.
+    """
+    values = {}
+    for key in INHERITED_KEYS:
+        if pdf.xref_get_key(xref, key)[0] != 'null':
+            continue
+        node = xref
+        while True:
+            kind, parent = pdf.xref_get_key(node, 'Parent')
+            if kind != 'xref':
+                break
+            node = int(parent.split()[0])
+            kind, value = pdf.xref_get_key(node, key)
+            if kind != 'null':
+                values[key] = value
+                break
+    return values
+
+def set_page_tree(pdf, page_xrefs, inherited=None):
+    """
+    Makes the root of the page tree of a pdf list the given page objects
+    as its only kids, as fitz.Document.select does but without reading the
+    pages left out. A page object may be listed more than once.
+
+    @param  pdf : fitz.Document
+    @param  page_xrefs : list
+        Object numbers of the pages, in order.
+    @param  inherited : dict
+        For each page whose parent is not the root, the attributes it
+        inherits (see inherited_values), which are set on the page itself
+        since its parent is left out. Defaults to None (every page is a kid
+        of the root).
+
+    @return None
+    """
+    root_xref = page_tree_root(pdf)
+    for xref, values in (inherited or {}).items():
+        for key, value in values.items():
+            pdf.xref_set_key(xref, key, value)
+        pdf.xref_set_key(xref, 'Parent', '{} 0 R'.format(root_xref))
+
+    kids = ' '.join('{} 0 R'.format(xref) for xref in page_xrefs)
+    pdf.xref_set_key(root_xref, 'Kids', '[{}]'.format(kids))
+    pdf.xref_set_key(root_xref, 'Count', str(len(page_xrefs)))
+    return None
+
+
+def build_index(pdf_path, out_path=None):
+    """
+    Indexes a pdf (see PageIndex), saving the index next to it.
+
+    @param  pdf_path : str
+        Path to the pdf.
+    @param  out_path : str
+        Path to save the index to. Defaults to index_path(pdf_path).
+
+    @return page_index : PageIndex
+        (Or raises ValueError for a pdf which cannot be read, needs a
+        password or has no pages.)
+    """
+    signature = file_signature(pdf_path)
+    try:
+        pdf = fitz.open(pdf_path)
+    except RuntimeError as e:
+        raise ValueError('{} cannot be read as a pdf ({})'.format(pdf_path, e))
+
+    with pdf:
+        if pdf.needs_pass:
+            raise ValueError('{} is encrypted, and needs a password to be read'.format(pdf_path))
+        if not pdf.page_count:
+            raise ValueError('{} has no pages'.format(pdf_path))
+
+        with phase('index_pages'):
+            root_xref = page_tree_root(pdf)
+            page_xrefs = [pdf.page_xref(i) for i in range(pdf.page_count)]
+            inherited = {}
+            for xref in page_xrefs:
+                if pdf.xref_get_key(xref, 'Parent')[1].split()[0] != str(root_xref):
+                    inherited[xref] = inherited_values(pdf, xref)
+
+        with phase('index_objects'):
+            # objects which are not followed: the pages, each found through
+            # the links and annotations of another, and the page tree
+            stop = set(page_xrefs) | {root_xref}
+            references = {}
+            dependencies = [sorted(_dependencies(pdf, xref, stop, references)) for xref in page_xrefs]
+
+        with phase('index_digests'):
+            digests = {}
+            for xrefs in dependencies:
+                for xref in xrefs:
+                    if xref not in digests and pdf.xref_is_stream(xref):
+                        digests[xref] = hashlib.sha1(pdf.xref_stream_raw(xref)).hexdigest()
+
+    page_index = PageIndex(signature, page_xrefs, inherited, dependencies, digests)
+    out_path = out_path or index_path(pdf_path)
+    temp = output.temp_path(out_path)
+    try:
+        with open(temp, 'w') as f:
+            page_index.write(f)
+    except BaseException:
+        output.discard(temp)
+        raise
+    output.commit(temp, out_path)
+    count('pages_indexed', page_index.page_count)
+    return page_index
+
+def _dependencies(pdf, page_xref, stop, references):
+    """
+    @param  references : dict
+        Object numbers each object refers to, filled in as objects are
+        read, so that objects shared by many pages are read once.
+
+    @return xrefs : set
+        The objects the page refers to, directly or not, short of those in
+        <stop>.
+    """
+    xrefs = set()
+    todo = [page_xref]
+    while todo:
+        xref = todo.pop()
+        if xref not in references:
+            source = pdf.xref_object(xref, compressed=True).encode()
+            if xref == page_xref or xref in stop:
+                source = _PARENT_RE.sub(b'', source)
+            references[xref] = [int(ref) for ref in _REF_RE.findall(source)]
+        for ref in references[xref]:
+            if ref not in stop and ref not in xrefs and 0 < ref < pdf.xref_length():
+                xrefs.add(ref)
+                todo.append(ref)
+    return xrefs
+
+def load_index(pdf_path):
+    """
+    Loads the index of a pdf, if it has one which is up to date: one whose
+    pdf has the same size, modification time and sampled hash (see
+    file_signature) as when it was indexed.
+
+    @param  pdf_path : str
+
+    @return page_index : PageIndex (or None)
+    """
+    path = index_path(pdf_path)
+    if not os.path.exists(path):
+        return None
+
+    with phase('index_load'):
+        signature = file_signature(pdf_path)
+        key = os.path.abspath(pdf_path)
+        page_index = _cache.get(key)
+        if page_index is None or page_index.signature != signature:
+            try:
+                page_index = PageIndex.read(path)
+            except (OSError, ValueError, KeyError, AttributeError):
+                page_index = None
+            if page_index is None or page_index.signature != signature:
+                count('index_stale')
+                return None
+            _cache[key] = page_index
+            while len(_cache) > CACHE_INDEXES:
+                _cache.popitem(last=False)
+        _cache.move_to_end(key)
+
+    count('index_hits')
+    return page_index
+
+def clear_cache():
+    """
+    Forgets the indexes loaded so far.
+    """
+    _cache.clear()
+
+
+def index(arguments):
+    """
+    Builds the index sidecar file (see PageIndex) of each of the given pdf
+    files, which split, remove and insert then use for as long as the pdf
+    is unchanged. A summary of each index is printed to stderr.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: pdfs
+
+    @return index_paths : tuple
+        Paths to the index files, in the order of the pdfs.
+    """
+    # args: pdfs
+    index_paths = []
+    for pdf_path in arguments.pdfs:
+        start = time.perf_counter()
+        page_index = build_index(pdf_path)
+        index_paths.append(index_path(pdf_path))
+
+        digests = list(page_index.digests.values())
+        print('index: {}, {} pages, {} objects, {} streams ({} shared copies) in {:.2f} s'.format(
+              index_paths[-1], page_index.page_count, len(page_index.objects_of(range(1, page_index.page_count+1))),
+              len(digests), len(digests) - len(set(digests)), time.perf_counter() - start), file=sys.stderr)
+
+    return tuple(index_paths)
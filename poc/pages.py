@@ -0,0 +1,299 @@
+import re
+import bisect
+
+# a page bound: a page number, or 'last' for the last page of the pdf
+_BOUND = r'(\d+|last)'
+_RANGE_RE = re.compile(r'^{0}?-{0}?$'.format(_BOUND))
+_PAGE_RE = re.compile(r'^{}$'.format(_BOUND))
+# a page order term may start with a rotation e.g. 'r90:4'
+_ROTATION_RE = re.compile(r'^r(-?\d+):(.+)$')
+
+def parse_page_input(page_input):
+    """
+    Parses a single page selection given at the command line, without
+    needing to know the number of pages in the pdf. The selection is one of:
+        X       a single page number, or 'last'
+        X-Y     a page range (inclusive) where X < Y
+        X-      every page from X to the last page
+        -Y      every page from the first page to Y
+        even    every even page
+        odd     every odd page
+    where X and Y are non-zero page numbers or 'last'.
+
+    @param  page_input : str
+        Page selection input by the user at the command line.
+
+    @return term : tuple
+        (start, end, step) where start and end are page numbers, or None for
+        the last page, and step is 1, or 2 for even/odd pages. (Or raises a
+        ValueError for an invalid page selection.)
+    """
+    error_msg = 'Invalid argument. {} is not a valid page/page range'.format(page_input)
+    page_input = page_input.strip().lower()
+
+    if page_input in ('even', 'odd'):
+        return (2 if page_input == 'even' else 1, None, 2)
+
+    match = _PAGE_RE.match(page_input)
+    if match:
+        start = end = _to_bound(match.group(1))
+    else:
+        match = _RANGE_RE.match(page_input)
+        if not match or page_input == '-':
+            raise ValueError(error_msg)
+        start = _to_bound(match.group(1) or '1')
+        end = _to_bound(match.group(2) or 'last')
+
+        # X-Y must go forwards, e.g. 2-5 but not 5-2 or 5-5
+        if start is None or (end is not None and start >= end):
+            raise ValueError(error_msg)
+
+    if start == 0 or end == 0:
+        raise ValueError(error_msg)
+
+    return (start, end, 1)
+
+def _to_bound(bound):
+    return None if bound == 'last' else int(bound)
+
+def parse_order_input(order_input):
+    """
+    Parses a single term of a page order given at the command line, for
+    rearrange, without needing to know the number of pages in the pdf. The
+    term is one of the page selections taken by parse_page_input, or:
+        X-Y     a page range going backwards, where X > Y or X is 'last'
+                e.g. 'last-1' is every page in reverse order
+        rN:S    the pages of selection S rotated clockwise by N degrees,
+                a multiple of 90 e.g. 'r90:4' or 'r-90:2-3'
+
+    @param  order_input : str
+        Page order term input by the user at the command line.
+
+    @return term : tuple
+        (start, end, step, rotation) where start and end are page numbers, 
+        or None for the last page, step is 1, 2 for even/odd pages or -1 
+        for a range going backwards, and rotation is in degrees. (Or raises
+        a ValueError for an invalid term.)
+    """
+    order_input = order_input.strip().lower()
+    rotation = 0
+    match = _ROTATION_RE.match(order_input)
+    if match:
+        rotation = int(match.group(1))
+        if rotation % 90:
+            raise ValueError('Invalid argument. {} is not a valid rotation, which must be a multiple of 90 '
+                             'degrees'.format(order_input))
+        order_input = match.group(2)
+
+    match = _RANGE_RE.match(order_input)
+    if match and match.group(1) and match.group(2):
+        start, end = _to_bound(match.group(1)), _to_bound(match.group(2))
+        if end is not None and (start is None or start > end):
+            if start == 0 or end == 0:
+                raise ValueError('Invalid argument. {} is not a valid page/page range'.format(order_input))
+            return (start, end, -1, rotation)
+
+    return parse_page_input(order_input) + (rotation,)
+
+
+def parse_page_order(order_inputs, page_count):
+    """
+    Parses a page order given at the command line (see parse_order_input)
+    into the pages of a pdf in the order they are to be output. Pages may
+    be given more than once, and pages not given are left out.
+
+    @param  order_inputs : list or str
+        Page order terms e.g. ['1-3', '10', 'r90:4', 'last-1'], or a single
+        one.
+    @param  page_count : int
+        Number of pages in the pdf, which 'last' and even/odd are worked
+        out from.
+
+    @return page_order : list
+        (page, rotation) tuples, one for each page of the output. (Or 
+        raises a ValueError for an invalid term or a page past the last 
+        page of the pdf.)
+    """
+    if isinstance(order_inputs, str):
+        order_inputs = [order_inputs]
+
+    page_order = []
+    for order_input in order_inputs:
+        start, end, step, rotation = parse_order_input(order_input)
+        start = page_count if start is None else start
+        if step == -1:
+            # 'last-Y' of a pdf of fewer than Y pages is checked by its end
+            pages = range(start, end-1, -1)
+            PageSet([(end, end)]).check(page_count)
+        elif step == 2:
+            pages = range(start, page_count+1, step)
+        else:
+            # an open ended range which starts past the last page is kept as
+            # its start page, as in PageSet.parse, so that check() finds it
+            end = max(start, page_count) if end is None else end
+            pages = range(start, end+1, step)
+            PageSet([(start, end)]).check(page_count)
+        page_order.extend((page, rotation) for page in pages)
+
+    return page_order
+
+
+class PageSet:
+    """
+    Set of page numbers (counting from 1), stored as a sorted list of
+    non-overlapping, non-adjacent, inclusive (start, end) intervals. Sets of
+    large ranges therefore take space (and time to check) in proportion to
+    the number of ranges rather than the number of pages.
+
+    Intervals have no step, so even and odd pages take one interval per
+    page, and space and time in proportion to the number of pages. This is
+    no worse than the commands using them, since fitz.Document.insert_pdf
+    copies one interval per call too, so a pdf made of every other page
+    needs a call per page whatever the set holds. (parse_page_order keeps
+    even/odd as a range with a step, since it has no set to make.)
+    """
+
+    def __init__(self, intervals=()):
+        """
+        @param  intervals : iterable
+            (start, end) page intervals, in any order, which may overlap.
+        """
+        merged = []
+        for start, end in sorted(intervals):
+            if start > end:
+                continue
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        self.intervals = merged
+        self._starts = [start for start, _ in merged]
+
+    @classmethod
+    def parse(cls, page_inputs, page_count):
+        """
+        Parses page selections given at the command line (see
+        parse_page_input) into the set of pages they select in a pdf.
+
+        @param  page_inputs : list or str
+            Page selections e.g. ['2-3', '5-', 'odd'], or a single one.
+        @param  page_count : int
+            Number of pages in the pdf, which open ended ranges, 'last',
+            and even/odd are worked out from. Even/odd select an interval
+            for each of their pages (see PageSet).
+
+        @return page_set : PageSet
+        """
+        if isinstance(page_inputs, str):
+            page_inputs = [page_inputs]
+
+        intervals = []
+        for page_input in page_inputs:
+            start, end, step = parse_page_input(page_input)
+            start = page_count if start is None else start
+            if step == 2:
+                # O(pages): intervals have no step
+                intervals.extend((page, page) for page in range(start, page_count+1, step))
+                continue
+
+            # an open ended range which starts past the last page is kept as
+            # its start page, so that check() finds it
+            end = max(start, page_count) if end is None else end
+            intervals.append((start, end))
+
+        return cls(intervals)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.intervals)
+
+    def __bool__(self):
+        return bool(self.intervals)
+
+    def __iter__(self):
+        for start, end in self.intervals:
+            yield from range(start, end+1)
+
+    def __contains__(self, page):
+        i = bisect.bisect_right(self._starts, page) - 1
+        return i >= 0 and page <= self.intervals[i][1]
+
+    def __eq__(self, other):
+        return isinstance(other, PageSet) and self.intervals == other.intervals
+
+    def __repr__(self):
+        return 'PageSet({})'.format(self)
+
+    def __str__(self):
+        return ' '.join(str(start) if start == end else '{}-{}'.format(start, end)
+                        for start, end in self.intervals)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def union(self, other):
+        return PageSet(self.intervals + other.intervals)
+
+    def difference(self, other):
+        """
+        @return page_set : PageSet
+            Pages in this set which are not in <other>.
+        """
+        result = []
+        j = 0
+        for start, end in self.intervals:
+            # skip the intervals of other which end before this one starts
+            while j < len(other.intervals) and other.intervals[j][1] < start:
+                j += 1
+            k = j
+            while k < len(other.intervals) and other.intervals[k][0] <= end:
+                other_start, other_end = other.intervals[k]
+                if other_start > start:
+                    result.append((start, other_start-1))
+                start = max(start, other_end+1)
+                k += 1
+            if start <= end:
+                result.append((start, end))
+        return PageSet(result)
+
+    def intersection(self, other):
+        return self - (self - other)
+
+    def complement(self, page_count):
+        """
+        @return page_set : PageSet
+            Pages of a pdf of <page_count> pages which are not in this set.
+        """
+        return PageSet([(1, page_count)]) - self
+
+    def max(self):
+        """
+        @return page : int
+            The highest page in the set, or 0 if the set is empty.
+        """
+        return self.intervals[-1][1] if self.intervals else 0
+
+    def check(self, page_count):
+        """
+        Checks that every page in the set is in a pdf of <page_count> pages.
+
+        @return True (or raises ValueError)
+        """
+        if self.max() > page_count:
+            raise ValueError('Page numbers must be less than or equal to the total number of '
+                             'pages ({}) in the pdf.'.format(page_count))
+        return True
+
+    def ranges(self):
+        """
+        @return ranges : list
+            The intervals of the set as (from_page, to_page) page indices
+            (counting from 0), as taken by fitz.Document.insert_pdf.
+        """
+        return [(start-1, end-1) for start, end in self.intervals]
@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import itertools
+import fitz
+try:
+    from .pages import PageSet
+    from .instrument import phase
+    from . import output
+    from .helpers import positive_int
+    from .commands import (open_source_pdf, save_pdf, set_outfile_path, check_sources, sharing_sources,
+                           page_ranges_from, optimizing, closing_on_error)
+except ImportError:
+    from pages import PageSet
+    from instrument import phase
+    import output
+    from helpers import positive_int
+    from commands import (open_source_pdf, save_pdf, set_outfile_path, check_sources, sharing_sources,
+                          page_ranges_from, optimizing, closing_on_error)
+
+# separates the steps of a pipeline at the command line
+STEP_SEPARATOR = '+'
+
+class Pipeline:
+    """
+    A sequence of edits (merges, removals, insertions and a final split)
+    made to one document and saved once at the end, rather than saving the
+    document after each edit and opening it again for the next.
+
+    The edits are not made one by one. Each only changes a list of runs of
+    pages of the source pdfs that make up the document, so a removal is
+    folded into the merge or insertion that brought in its pages, and when
+    the pipeline is run each page that is kept is copied from its source
+    pdf exactly once, straight to the output (or the part of a split it
+    belongs to).
+
+        Pipeline(['a.pdf', 'b.pdf']).remove(['3-5']).insert('c.pdf', 10).split(by_bookmark=1).run()
+
+    Sources may be given as paths, bytes, bytearrays, memoryviews or binary
+    file objects, as to the functions of poc.api.
+    """
+
+    def __init__(self, pdfs):
+        """
+        @param  pdfs : list
+            The pdfs to start from, merged in the order given.
+        """
+        self._sources = []
+        self._steps = []
+        self._split = None
+        self.merge(pdfs)
+
+    def merge(self, pdfs):
+        """
+        Adds the pages of <pdfs> to the end of the document.
+
+        @return self : Pipeline
+        """
+        self._check_not_split()
+        self._steps.append(('merge', [self._add_source(pdf) for pdf in pdfs]))
+        return self
+
+    def remove(self, pages):
+        """
+        Removes pages from the document as it is after the steps before.
+
+        @param  pages : list, str or PageSet
+            e.g. ['2-3', '9'].
+
+        @return self : Pipeline
+        """
+        self._check_not_split()
+        self._steps.append(('remove', pages))
+        return self
+
+    def insert(self, ins_pdf, after_page):
+        """
+        Inserts the pages of a pdf after the given page number of the
+        document as it is after the steps before, or 0 for before the first
+        page.
+
+        @return self : Pipeline
+        """
+        self._check_not_split()
+        self._steps.append(('insert', (self._add_source(ins_pdf), after_page)))
+        return self
+
+    def split(self, pages=None, every=None, by_bookmark=None):
+        """
+        Splits the finished document, as split_pdf, instead of saving it
+        whole. Must be the last step. Bookmarks are those of the source
+        pdfs, at the pages they point to which are still in the document.
+
+        @return self : Pipeline
+        """
+        self._check_not_split()
+        if bool(pages) + bool(every) + bool(by_bookmark) != 1:
+            raise ValueError('split expects either <pages>, --every or --by-bookmark')
+        self._split = (pages, every, by_bookmark)
+        return self
+
+    @property
+    def sources(self):
+        """
+        @return sources : list
+            The pdfs the document is made from, in the order they were first
+            given. A path given more than once is listed once.
+        """
+        return list(self._sources)
+
+    @property
+    def splits(self):
+        """
+        @return bool
+            Whether the pipeline ends in a split, so that run saves several
+            pdfs rather than one.
+        """
+        return self._split is not None
+
+    def run(self, output=None, save_profile=None):
+        """
+        Makes the edits and saves the document, or the parts it is split
+        into.
+
+        @param  output : str, file object or function
+            Where to save the document, as for merge_pdfs. For a split, a
+            function called with each page selection as for split_pdf.
+            Defaults to None (return the pdf/s as bytes).
+        @param  save_profile : str
+            One of the SAVE_PROFILES. Defaults to None (a plain save).
+
+        @return pdf_bytes : bytes or list (or the outputs of <output> for a
+            split, or None)
+        """
+        with contextlib.ExitStack() as stack:
+            docs = [stack.enter_context(open_source_pdf(pdf)) for pdf in self._sources]
+            runs = self._runs(docs)
+
+            if self._split is None:
+                with _build(docs, runs) as out_pdf:
+                    out_pdf.set_metadata(docs[0].metadata)
+                    return save_pdf(out_pdf, output, save_profile)
+
+            pages = self._split_pages(docs, runs)
+            outputs = [output(page_input) for page_input in pages] if output else [None]*len(pages)
+            pdf_bytes = []
+            page_count = _length(runs)
+            for page_input, out_pdf_output in zip(pages, outputs):
+                part_runs = _select(runs, PageSet.parse(page_input, page_count))
+                with _build(docs, part_runs) as part_pdf:
+                    pdf_bytes.append(save_pdf(part_pdf, out_pdf_output, save_profile))
+
+        return outputs if output else pdf_bytes
+
+    def _add_source(self, pdf):
+        # a path given more than once is opened once
+        if isinstance(pdf, str) and pdf in self._sources:
+            return self._sources.index(pdf)
+        self._sources.append(pdf)
+        return len(self._sources)-1
+
+    def _check_not_split(self):
+        if self._split is not None:
+            raise ValueError('split must be the last step of a pipeline')
+
+    def _runs(self, docs):
+        """
+        Works out the document made by the steps, as a list of runs of
+        pages (source, start, stop), with stop exclusive, without copying
+        any pages.
+        """
+        runs = []
+        for name, args in self._steps:
+            page_count = _length(runs)
+            if name == 'merge':
+                runs += [(source, 0, docs[source].page_count) for source in args]
+            elif name == 'remove':
+                pages_to_rm = args if isinstance(args, PageSet) else PageSet.parse(args, page_count)
+                pages_to_rm.check(page_count)
+                runs = _select(runs, pages_to_rm.complement(page_count))
+            else:
+                source, after_page = args
+                if after_page > page_count:
+                    raise ValueError('insert after page {} exceeds the length of the document ({} pages)'.format(
+                        after_page, page_count))
+                runs = _slice(runs, 0, after_page) + [(source, 0, docs[source].page_count)] + \
+                    _slice(runs, after_page, page_count)
+
+        return _join(runs)
+
+    def _split_pages(self, docs, runs):
+        pages, every, by_bookmark = self._split
+        page_count = _length(runs)
+        if pages:
+            for page_input in pages:
+                PageSet.parse(page_input, page_count).check(page_count)
+            return list(pages)
+        if every:
+            return page_ranges_from(range(1, page_count+1, every), page_count)
+
+        # the first page of the document that each source page is at
+        positions = {}
+        position = 1
+        for source, start, stop in runs:
+            for page in range(start, stop):
+                positions.setdefault((source, page), position + page-start)
+            position += stop-start
+
+        starts = set()
+        for source, doc in enumerate(docs):
+            for level, _, page in doc.get_toc():
+                if level <= by_bookmark and (source, page-1) in positions:
+                    starts.add(positions[(source, page-1)])
+        return page_ranges_from(starts, page_count)
+
+def _length(runs):
+    return sum(stop-start for _, start, stop in runs)
+
+def _slice(runs, first, last):
+    """
+    @return runs : list
+        The runs of pages <first> (inclusive) to <last> (exclusive) of the
+        document, counting from 0.
+    """
+    sliced = []
+    position = 0
+    for source, start, stop in runs:
+        length = stop-start
+        lo, hi = max(first, position), min(last, position+length)
+        if lo < hi:
+            sliced.append((source, start + lo-position, start + hi-position))
+        position += length
+    return sliced
+
+def _select(runs, page_set):
+    return _join([run for from_page, to_page in page_set.ranges() for run in _slice(runs, from_page, to_page+1)])
+
+def _join(runs):
+    # runs which follow on from each other in the same source are copied as one
+    joined = []
+    for run in runs:
+        if joined and joined[-1][0] == run[0] and joined[-1][2] == run[1]:
+            joined[-1] = (run[0], joined[-1][1], run[2])
+        else:
+            joined.append(run)
+    return joined
+
+def _build(docs, runs):
+    """
+    Copies runs of pages from the source pdfs to a new pdf. The graft map
+    of each source is kept until its last run (final=False), so that the
+    objects shared by its runs, such as fonts, are only copied once.
+
+    @return out_pdf : fitz.Document
+    """
+    last_runs = {source: i for i, (source, _, _) in enumerate(runs)}
+    with closing_on_error(fitz.open()) as out_pdf, phase('insert_pdf'):
+        for i, (source, start, stop) in enumerate(runs):
+            out_pdf.insert_pdf(docs[source], from_page=start, to_page=stop-1, final=(last_runs[source] == i))
+    return out_pdf
+
+
+def parse_steps(tokens):
+    """
+    Parses the steps of a pipeline given at the command line, separated by
+    '+', into a Pipeline e.g.
+
+        merge a.pdf b.pdf + remove 3-5 + insert c.pdf 10 + split -b
+
+    @param  tokens : list
+        The arguments after 'pipeline'.
+
+    @return pipeline : Pipeline
+        (Or raises ValueError for steps which are not valid.)
+    """
+    steps = [list(step) for is_separator, step in itertools.groupby(tokens, lambda token: token == STEP_SEPARATOR)
+             if not is_separator]
+    if not steps or steps[0][0] != 'merge':
+        raise ValueError('a pipeline starts with a merge step e.g. merge a.pdf b.pdf')
+
+    pipeline = None
+    for step in steps:
+        name, args = step[0], _step_parser(step[0]).parse_args(step[1:])
+        if name == 'merge':
+            pipeline = Pipeline(args.pdfs) if pipeline is None else pipeline.merge(args.pdfs)
+        elif name == 'remove':
+            pipeline.remove(args.pages)
+        elif name == 'insert':
+            pipeline.insert(args.ins_pdf, args.page)
+        else:
+            pipeline.split(args.pages, args.every, args.by_bookmark)
+    return pipeline
+
+class _StepParser(argparse.ArgumentParser):
+    # raises rather than exiting, so that a bad step fails like a bad source
+    def error(self, message):
+        raise ValueError('{}: {}'.format(self.prog, message))
+
+def _step_parser(name):
+    parser = _StepParser(prog='pipeline step {}'.format(name), add_help=False)
+    if name == 'merge':
+        parser.add_argument('pdfs', nargs='+')
+    elif name == 'remove':
+        parser.add_argument('pages', nargs='+')
+    elif name == 'insert':
+        parser.add_argument('ins_pdf')
+        parser.add_argument('page', type=int)
+    elif name == 'split':
+        parser.add_argument('pages', nargs='*')
+        parser.add_argument('-e', '--every', type=positive_int)
+        parser.add_argument('-b', '--by-bookmark', type=positive_int, nargs='?', const=1)
+    else:
+        raise ValueError('unknown pipeline step {}, expected merge, remove, insert or split'.format(name))
+    return parser
+
+
+def pipeline(arguments):
+    """
+    Runs a pipeline of steps given at the command line (see parse_steps),
+    saving one pdf file, or the pdf files it is split into, to the output
+    directory.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: steps, save_profile, optimize,
+        image_quality
+
+    @return out_pdf_paths : str (or tuple, for a pipeline ending in a split)
+        Path/s to the output pdf file/s.
+    """
+    # args: steps, save_profile, optimize, image_quality
+    edits = parse_steps(arguments.steps)
+    src_pdf = edits.sources[0]
+    seq = itertools.count(1)
+    with sharing_sources(edits.sources):
+        check_sources(edits.sources)
+
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)), optimizing(arguments):
+            if edits.splits:
+                out_pdf_paths = tuple(edits.run(
+                    lambda page_input: set_outfile_path(arguments, src_pdf, page_input, next(seq)),
+                    getattr(arguments, 'save_profile', None)))
+            else:
+                out_pdf_paths = set_outfile_path(arguments, src_pdf)
+                edits.run(out_pdf_paths, getattr(arguments, 'save_profile', None))
+
+    return out_pdf_paths
@@ -1,21 +1,54 @@
-
-from helpers import *
-from commands import *
-
-def main():
-
-    # set up and parse command line arguments
-    parser = set_args()
-    cl_args = parser.parse_args()
-
-    # retrieve the controls for the command
-    command = cl_args.invoked_command
-    CC = get_command_controls(command)
-
-    # check that arguments for the invoked command are valid
-    check_arguments(command, CC, cl_args)
-
-    # execute the command
-    CC['execute'](cl_args)
-
-    return
+import os
+import sys
+
+from helpers import *
+from client import send_request
+from instrument import add_hook, json_lines_hook, print_profile, command_trace
+
+def main():
+
+    # newer versions of PyMuPDF print their messages (e.g. that the name fitz
+    # is deprecated) to stdout, where they would be mixed in with the output
+    # of commands writing to it (e.g. extract's json lines). PyMuPDF reads
+    # this when it is imported, which commands do only once they are run.
+    os.environ.setdefault('PYMUPDF_MESSAGE', 'fd:2')
+
+    # set up and parse command line arguments
+    parser = set_args()
+    cl_args = parser.parse_args()
+
+    # retrieve the controls for the command
+    command = cl_args.invoked_command
+    CC = get_command_controls(command)
+
+    # check that arguments for the invoked command are valid
+    check_arguments(command, CC, cl_args)
+
+    # trace the command, if asked to
+    if cl_args.trace:
+        add_hook(json_lines_hook(cl_args.trace))
+    if cl_args.profile:
+        add_hook(print_profile)
+
+    # keep the outputs of commands in a result cache, if asked to
+    if cl_args.cache:
+        # imported only when asked for, to keep start up quick
+        from resultcache import ResultCache
+        set_result_cache(ResultCache(cl_args.cache, cl_args.cache_mb*1024*1024, cl_args.cache_key))
+
+    # send the command to a poc serve daemon, if one is running. Commands 
+    # reading from stdin ('-'), and traced or cached commands, are always 
+    # run here.
+    run_here = cl_args.local or cl_args.trace or cl_args.profile or cl_args.cache or '-' in sys.argv
+    if command in JOB_COMMANDS and not run_here:
+        result = send_request(sys.argv[1:])
+        if result is not None:
+            if result['status'] != 'ok':
+                raise RuntimeError(result['error'])
+            return
+
+    # execute the command
+    with command_trace(command, sys.argv[1:]):
+        CC['execute'](cl_args)
+
+    return
@@ -0,0 +1,133 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .instrument import phase, count
+except ImportError:
+    from instrument import phase, count
+
+# number of source pdfs read ahead of the one being copied
+DEFAULT_DEPTH = 4
+
+# total size of the source pdfs read ahead but not yet opened, in bytes
+DEFAULT_MAX_BYTES = 256*1024*1024
+
+def read_file(path):
+    """
+    Reads the whole of a file.
+
+    @param  path : str
+
+    @return data : bytes
+    """
+    with open(path, 'rb') as f:
+        return f.read()
+
+class ReadAhead:
+    """
+    Reads source pdfs into memory ahead of the command that opens them, in
+    the order it will open them, on a pool of threads. The pdfs are opened
+    from these buffers (see commands.reading_ahead), so that on slow or
+    network storage reading the next pdfs overlaps with opening (or 
+    copying the pages of) the one before, rather than waiting on each read
+    in turn.
+
+    At most <depth> pdfs are read ahead at a time, and only as many as fit
+    in <max_bytes> together. A pdf larger than <max_bytes> by itself is not
+    read ahead, and is left to be opened by its path.
+    Only file reads run on the threads: the pdfs are parsed by the thread
+    that opens them, since PyMuPDF is not thread safe.
+    """
+
+    def __init__(self, paths, depth=DEFAULT_DEPTH, max_bytes=DEFAULT_MAX_BYTES, read=read_file):
+        """
+        @param  paths : list
+            Paths to the source pdfs, in the order they will be opened.
+        @param  depth : int
+            Number of pdfs to read ahead at a time. Defaults to
+            DEFAULT_DEPTH.
+        @param  max_bytes : int
+            Total size in bytes of the pdfs read ahead but not yet taken.
+            Defaults to DEFAULT_MAX_BYTES.
+        @param  read : function
+            Called with a path to read the whole of it, on a thread.
+            Defaults to read_file.
+        """
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self.buffered_bytes = 0
+        self._read = read
+        self._paths = deque(paths)
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.depth, thread_name_prefix='read_ahead')
+        self._fill()
+
+    def take(self, path):
+        """
+        Returns the contents of <path>, as read ahead, waiting for the read
+        to finish if need be. The pdfs read ahead of <path> but not taken
+        (e.g. opened from a document cache instead) are dropped.
+
+        @param  path : str
+
+        @return data : bytes
+            (Or None if <path> was not read ahead, or could not be read, in
+            which case it is to be opened by its path.)
+        """
+        key = os.path.abspath(path)
+        if not any(pending_key == key for pending_key, _, _ in self._pending):
+            return None
+
+        while True:
+            pending_key, size, future = self._pending.popleft()
+            self.buffered_bytes -= size
+            if pending_key == key:
+                break
+            future.cancel()
+
+        try:
+            with phase('read_wait'):
+                data = future.result()
+        except OSError:
+            data = None
+        self._fill()
+        if data is not None:
+            count('read_ahead_bytes', len(data))
+        return data
+
+    def _fill(self):
+        # read ahead up to <depth> pdfs, while they fit in the budget
+        while self._paths and len(self._pending) < self.depth:
+            path = self._paths[0]
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                # left for the open to report
+                self._paths.popleft()
+                continue
+            if size > self.max_bytes:
+                self._paths.popleft()
+                continue
+            if self.buffered_bytes + size > self.max_bytes:
+                break
+            self._paths.popleft()
+            self._pending.append((os.path.abspath(path), size, self._executor.submit(self._read, path)))
+            self.buffered_bytes += size
+
+    def close(self):
+        """
+        Drops the pdfs read ahead but not taken, after waiting for the reads
+        already started to finish.
+        """
+        self._paths.clear()
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self.buffered_bytes = 0
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
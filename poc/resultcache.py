@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+try:
+    from . import output
+    from .pages import PageSet, parse_page_input
+    from .instrument import count
+except ImportError:
+    import output
+    from pages import PageSet, parse_page_input
+    from instrument import count
+
+# bumped whenever the layout of the cache, or what the outputs of a command
+# depend on, changes, so that older entries are never served
+CACHE_VERSION = 1
+
+# the arguments of each command which are paths to input pdfs
+INPUT_ARGS = {
+    'merge': ('pdfs', 'from_file'),
+    'remove': ('src_pdf',),
+    'insert': ('src_pdf', 'ins_pdf'),
+    'split': ('src_pdf',),
+}
+
+# arguments which change where outputs go, what they are called, or how
+# they are made, but not what they hold
+UNKEYED_ARGS = ('invoked_command', 'command_argv', 'output_dir', 'name', 'fsync', 'local', 'trace', 'profile',
+                'jobs', 'cache', 'cache_mb', 'cache_key', 'read_ahead', 'read_ahead_mb')
+
+class ResultCache:
+    """
+    On disk cache of the outputs of commands, so that running the same
+    command on the same inputs again (e.g. splitting the same statement in
+    every nightly run) hard links, or copies, the outputs of the first run
+    into place rather than running it again.
+
+    Results are keyed by a hash of the command, its options, its page
+    selection, and a digest of each input pdf: a hash of its contents, or
+    with key='stat' its path, size and modification time, which is much
+    cheaper for large files, but misses a file changed without its size or
+    modification time changing. The cache is limited by the total size of
+    the outputs it holds, the least recently used results being removed
+    first. Results are written and removed atomically, so one cache can be
+    shared by processes running at the same time.
+
+    Outputs served by the cache are hard links to its copy where possible,
+    so should be replaced rather than changed in place. A result whose copy
+    has changed is thrown away rather than served.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024*1024*1024, key='content'):
+        """
+        @param  cache_dir : str
+            Directory to keep the results in, which is created if it does
+            not exist.
+        @param  max_bytes : int
+            Total size of the outputs, in bytes, to keep the cache under.
+            Defaults to 1 GB.
+        @param  key : str
+            How input pdfs are told apart: 'content' or 'stat'. Defaults to
+            'content'.
+        """
+        if key not in ('content', 'stat'):
+            raise ValueError('key must be content or stat, not {}'.format(key))
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.key = key
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def run(self, command, arguments, execute):
+        """
+        Returns the outputs of a command from the cache, or runs the
+        command with <execute> and stores its outputs for next time.
+
+        @param  command : str
+            e.g. 'split'.
+        @param  arguments : argparse.Namespace
+            The arguments of the command.
+        @param  execute : function
+            Runs the command, given <arguments>.
+
+        @return outputs : str or tuple
+            As returned by <execute>.
+        """
+        inputs = self._inputs(command, arguments)
+        if inputs is None:
+            # e.g. read from stdin
+            return execute(arguments)
+
+        key = self.result_key(command, arguments, inputs)
+        entry = self._load(key)
+        if entry is not None:
+            try:
+                outputs = self._restore(entry, arguments, inputs)
+            except (OSError, ValueError):
+                # evicted by another process, or changed on disk
+                self._remove(key)
+            else:
+                self.hits += 1
+                count('cache_hits')
+                return outputs
+
+        self.misses += 1
+        count('cache_misses')
+        with output.record_outputs() as recorded:
+            outputs = execute(arguments)
+        self._store(key, command, inputs, recorded, outputs)
+        return outputs
+
+    def result_key(self, command, arguments, inputs):
+        """
+        @return key : str
+            Hex digest identifying the outputs of the command.
+        """
+        options = {name: value for name, value in sorted(vars(arguments).items())
+                   if name not in UNKEYED_ARGS and name not in INPUT_ARGS[command]}
+        if 'pages' in options and options['pages']:
+            pages = [str(page).strip() for page in options['pages']]
+            # the pages to remove are a set, where the pages to split are a
+            # list of outputs
+            options['pages'] = _page_set_key(pages) if command == 'remove' else pages
+
+        key = {'version': CACHE_VERSION, 'pymupdf': _pymupdf_version(), 'command': command,
+               'options': options, 'inputs': [self._digest(path) for path in inputs]}
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def stats(self):
+        """
+        @return stats : dict
+            The number of results in the cache, their total size in bytes,
+            and the number of hits, misses and evictions so far.
+        """
+        entries = self._entries()
+        return {'results': len(entries), 'bytes': sum(entry['bytes'] for entry in entries),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _inputs(self, command, arguments):
+        inputs = []
+        for name in INPUT_ARGS[command]:
+            value = getattr(arguments, name, None) or []
+            inputs += value if isinstance(value, list) else [value]
+        if '-' in inputs:
+            return None
+        return inputs
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        if self.key == 'stat':
+            return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024*1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), 'entry.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _restore(self, entry, arguments, inputs):
+        """
+        Links (or copies) the outputs of a result into place, named as the
+        command would name them.
+        """
+        entry_dir = self._entry_dir(entry['key'])
+        out_dir = getattr(arguments, 'output_dir', None)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        paths = []
+        with output.atomic_outputs(getattr(arguments, 'fsync', False)):
+            for i, item in enumerate(entry['outputs']):
+                cached_path = os.path.join(entry_dir, '{}.pdf'.format(i))
+                stat = os.stat(cached_path)
+                if [stat.st_size, stat.st_mtime_ns] != item['stat']:
+                    raise ValueError('cached output {} has changed'.format(cached_path))
+
+                source = inputs[item['source']] if item['source'] is not None else None
+                path = output.output_path(out_dir, getattr(arguments, 'name', None), source, item['range'],
+                                          item['seq'], entry['command'])
+                temp = output.temp_path(path)
+                _link_or_copy(cached_path, temp)
+                output.commit(temp, path)
+                paths.append(path)
+
+        # mark the result as recently used, with the time given explicitly,
+        # since some file systems stamp files with a coarse clock, which
+        # would leave it tied with results stored just before it
+        now = time.time_ns()
+        os.utime(os.path.join(entry_dir, 'entry.json'), ns=(now, now))
+        return tuple(paths) if entry['many'] else paths[0]
+
+    def _store(self, key, command, inputs, recorded, outputs):
+        """
+        Adds the outputs of a command to the cache, as a directory which is
+        moved into place once it is complete.
+        """
+        paths = list(outputs) if isinstance(outputs, tuple) else [outputs]
+        fields = {item['path']: item for item in recorded}
+        if not all(path in fields for path in paths):
+            # named in a way the cache cannot repeat
+            return
+
+        entry_dir = self._entry_dir(key)
+        temp_dir = '{}.{}.tmp'.format(entry_dir, os.urandom(4).hex())
+        os.makedirs(temp_dir)
+        try:
+            items = []
+            for i, path in enumerate(paths):
+                cached_path = os.path.join(temp_dir, '{}.pdf'.format(i))
+                _link_or_copy(path, cached_path)
+                stat = os.stat(cached_path)
+                source = fields[path]['source']
+                items.append({'source': inputs.index(source) if source in inputs else None,
+                              'range': fields[path]['range'], 'seq': fields[path]['seq'],
+                              'stat': [stat.st_size, stat.st_mtime_ns]})
+
+            entry = {'key': key, 'command': command, 'many': isinstance(outputs, tuple), 'outputs': items,
+                     'bytes': sum(item['stat'][0] for item in items), 'created': time.time()}
+            with open(os.path.join(temp_dir, 'entry.json'), 'w') as f:
+                json.dump(entry, f)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # e.g. stored by another process in the meantime
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        self._evict(keep=key)
+
+    def _entries(self):
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.endswith('.tmp'):
+                    continue
+                try:
+                    entry_path = os.path.join(prefix_dir, key, 'entry.json')
+                    with open(entry_path) as f:
+                        entry = json.load(f)
+                    entry['used'] = os.stat(entry_path).st_mtime
+                except (OSError, ValueError):
+                    continue
+                entries.append(entry)
+        return entries
+
+    def _evict(self, keep=None):
+        """
+        Removes the least recently used results until the cache is within
+        its size, always keeping the result <keep>.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry['used'])
+        total_bytes = sum(entry['bytes'] for entry in entries)
+        for entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if entry['key'] == keep:
+                continue
+            self._remove(entry['key'])
+            total_bytes -= entry['bytes']
+            self.evictions += 1
+
+    def _remove(self, key):
+        # moved aside first, so that no other process sees it part removed
+        entry_dir = self._entry_dir(key)
+        removed_dir = '{}.{}.tmp'.format(entry_dir, os.urandom(4).hex())
+        try:
+            os.rename(entry_dir, removed_dir)
+        except OSError:
+            return
+        shutil.rmtree(removed_dir, ignore_errors=True)
+
+def _link_or_copy(src_path, dst_path):
+    """
+    Hard links <dst_path> to <src_path>, writing over it, or copies the
+    file where hard links are not supported (e.g. across file systems).
+    """
+    link_path = '{}.{}.link'.format(dst_path, os.urandom(4).hex())
+    try:
+        os.link(src_path, link_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+        return
+    os.replace(link_path, dst_path)
+
+def _pymupdf_version():
+    # imported here, since importing importlib.metadata takes about 30 ms, 
+    # which every command would pay at start up
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return ''
+    try:
+        return version('PyMuPDF')
+    except PackageNotFoundError:
+        return ''
+
+def _page_set_key(pages):
+    """
+    Keys a set of page selections by the pages they select, so that the
+    same pages given differently (e.g. 1-3 and 1 2 3) share their outputs.
+    Selections worked out from the page count (e.g. 5-, last, even) are
+    keyed as they are parsed, as the page count is not known without 
+    opening the pdf.
+
+    @return key : list
+        [ranges, terms]: the ranges of the pages selected by page numbers
+        alone (see PageSet.ranges), and the parsed terms of the rest.
+    """
+    terms = {parse_page_input(page) for page in pages}
+    fixed = {term for term in terms if term[1] is not None and term[2] == 1}
+    return [PageSet((start, end) for start, end, _ in fixed).ranges(), sorted(terms - fixed, key=str)]
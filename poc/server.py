@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import signal
+import socket
+import asyncio
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from . import batch
+    from . import commands
+    from .doccache import DocumentCache
+    from .client import default_address, send_request, _is_tcp
+except ImportError:
+    import batch
+    import commands
+    from doccache import DocumentCache
+    from client import default_address, send_request, _is_tcp
+
+def _init_server_worker(max_bytes):
+    commands.set_document_cache(DocumentCache(max_bytes=max_bytes))
+
+def _run_request(argv, cwd):
+    # workers run one job at a time, so can move to the client's directory
+    # to resolve its relative paths
+    os.chdir(cwd)
+    return batch.run_job({'id': 'serve', 'argv': argv}, cwd)
+
+async def _handle_client(reader, writer, executor):
+    """
+    Reads requests, one json object per line, from a client connection and
+    writes back the result of each. Jobs from different connections are run
+    at the same time, on the worker pool.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                request = json.loads(line)
+                result = await loop.run_in_executor(executor, _run_request,
+                    [str(arg) for arg in request['argv']], request.get('cwd') or os.getcwd())
+            except Exception as e:
+                result = {'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+
+            writer.write((json.dumps(result)+'\n').encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+def _is_loopback(host):
+    # whether every address <host> resolves to is a loopback one, so that 
+    # only clients on this machine can connect to it
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+async def _serve(address, executor):
+    handler = lambda reader, writer: _handle_client(reader, writer, executor)
+
+    if _is_tcp(address):
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(handler, host, int(port))
+    else:
+        server = await asyncio.start_unix_server(handler, address)
+
+    # stop cleanly on SIGTERM as well as ctrl-c
+    stop = asyncio.get_running_loop().create_future()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set_result, None)
+    except (NotImplementedError, AttributeError):
+        pass
+
+    print('poc serve listening on {}'.format(address), file=sys.stderr)
+    async with server:
+        await stop
+
+def serve(arguments):
+    """
+    Runs a local daemon that runs merge, remove, insert and split jobs sent
+    to it by the command line (see send_request), so that each call does not
+    pay for starting Python, importing PyMuPDF, and opening its sources.
+    Jobs are run on a pool of worker processes, each of which keeps the
+    source pdfs it has opened in a document cache.
+
+    Clients are not authenticated, and each job is run in, and writes to, 
+    the directory its client gives. So a tcp address must be a loopback 
+    one, unless allow_remote is given.
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: address, allow_remote, jobs, 
+        cache_mb
+
+    @return address : str
+        Address the daemon listened on.
+    """
+    # args: address, allow_remote, jobs, cache_mb
+    address = arguments.address or default_address()
+
+    if _is_tcp(address) and not getattr(arguments, 'allow_remote', False) \
+            and not _is_loopback(address.rpartition(':')[0].strip('[]')):
+        raise ValueError('{} is not a loopback address: any client that can reach it could run commands, '
+                         'give --allow-remote to listen on it anyway'.format(address))
+
+    if not _is_tcp(address) and os.path.exists(address):
+        # any reply, even an error for an unknown command, means the socket
+        # is in use
+        if send_request(['ping'], address) is not None:
+            raise RuntimeError('a poc serve daemon is already running on {}'.format(address))
+        os.remove(address) # left by a daemon that did not shut down
+
+    executor = ProcessPoolExecutor(max_workers=arguments.jobs, initializer=_init_server_worker,
+                                   initargs=(arguments.cache_mb*1024*1024,))
+    try:
+        asyncio.run(_serve(address, executor))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if not _is_tcp(address) and os.path.exists(address):
+            os.remove(address)
+
+    return address
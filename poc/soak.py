@@ -0,0 +1,283 @@
+import gc
+import os
+import math
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+try:
+    from . import helpers
+    from .memory import current_rss
+    from .bench import make_pdf, _command_argv
+except ImportError:
+    import helpers
+    from memory import current_rss
+    from bench import make_pdf, _command_argv
+
+# the operations a soak runs: the job commands, and the same commands failing
+# on a page past the end of the pdf, and on a source which is not a pdf, so
+# that their error paths are run as often as the rest
+OPERATIONS = ('merge', 'remove', 'insert', 'split', 'remove_error', 'insert_error', 'open_error')
+
+# resources which must be back where they started by the end of a soak,
+# once garbage has been collected
+COUNTED_RESOURCES = ('documents', 'fds', 'threads')
+
+def open_documents():
+    """
+    @return documents : int
+        Number of fitz.Documents in this process which have not been closed,
+        after collecting garbage, so that only those still referred to are
+        counted.
+    """
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, fitz.Document) and not obj.is_closed)
+
+def open_fds():
+    """
+    @return fds : int
+        Number of file descriptors open in this process, or None where they
+        cannot be listed (e.g. on Windows).
+    """
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+def sample_resources(iteration, start):
+    """
+    @return sample : dict
+        The resident set size, open file descriptors, open documents and
+        running threads of this process, at <iteration> of a soak which
+        started at <start> (from time.perf_counter).
+    """
+    documents = open_documents()
+    return {'iteration': iteration, 'seconds': time.perf_counter() - start, 'rss': current_rss(),
+            'fds': open_fds(), 'documents': documents, 'threads': threading.active_count()}
+
+def percentile(values, p):
+    """
+    @param  values : list
+    @param  p : float
+        Percentile, from 0 to 100.
+
+    @return value
+        The value at the <p>th percentile of <values>, by the nearest rank,
+        or None if there are none.
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(len(values)*p/100))
+    return sorted(values)[rank-1]
+
+def _operation_argv(operation, src_pdf_path, ins_pdf_path, bad_pdf_path, page_count):
+    # the arguments each operation is run with, for a source pdf of
+    # <page_count> pages
+    if operation == 'remove_error':
+        return ['remove', src_pdf_path, str(page_count+1)]
+    if operation == 'insert_error':
+        return ['insert', src_pdf_path, ins_pdf_path, str(page_count+1)]
+    if operation == 'open_error':
+        return ['split', bad_pdf_path, '1']
+    return _command_argv(operation, src_pdf_path, ins_pdf_path, page_count)
+
+def run_soak(argvs, out_dir, iterations, warmup=10, sample_every=100):
+    """
+    Runs each operation <warmup> + <iterations> times in this process, in
+    turn, removing its outputs after each run. The latency of each run
+    after the warmup is recorded, and the resources of the process are
+    sampled at the end of the warmup, every <sample_every> iterations after
+    it, and at the end. Operations whose name ends in '_error' must raise
+    ValueError (and nothing else), the rest must not raise.
+
+    @param  argvs : dict
+        The command line arguments of each operation, by its name.
+    @param  out_dir : str
+        Directory to save outputs to.
+    @param  iterations : int
+    @param  warmup : int
+        Iterations run before the first sample, so that caches which fill
+        up once (in PyMuPDF, MuPDF and the python allocator) are full.
+        Defaults to 10.
+    @param  sample_every : int
+        Defaults to 100.
+
+    @return result : dict
+        The latencies of each operation, in seconds, the resource samples
+        (see sample_resources), the number of runs and the wall time.
+    """
+    parser = helpers.set_args()
+    runs = {}
+    for name, argv in argvs.items():
+        arguments = parser.parse_args(argv)
+        arguments.output_dir = out_dir
+        runs[name] = (arguments, helpers.get_command_controls(argv[0])['execute'], name.endswith('_error'))
+
+    latencies = {name: [] for name in argvs}
+    samples = []
+    start = time.perf_counter()
+    for iteration in range(warmup + iterations):
+        if iteration == warmup or (iteration > warmup and (iteration - warmup) % sample_every == 0):
+            samples.append(sample_resources(iteration - warmup, start))
+
+        for name, (arguments, execute, fails) in runs.items():
+            run_start = time.perf_counter()
+            try:
+                outputs = execute(arguments)
+            except ValueError:
+                if not fails:
+                    raise
+                outputs = None
+            else:
+                if fails:
+                    raise RuntimeError('{} did not fail'.format(name))
+            seconds = time.perf_counter() - run_start
+            if iteration >= warmup:
+                latencies[name].append(seconds)
+
+            outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+            for path in outputs:
+                if path is not None:
+                    os.remove(path)
+
+    seconds = time.perf_counter() - start
+    samples.append(sample_resources(iterations, start))
+    return {'latencies': latencies, 'samples': samples, 'runs': iterations*len(argvs), 'seconds': seconds}
+
+def _soak_worker(argvs, out_dir, iterations, warmup, sample_every):
+    os.makedirs(out_dir, exist_ok=True)
+    return run_soak(argvs, out_dir, iterations, warmup, sample_every)
+
+def resource_growth(samples, max_rss_growth):
+    """
+    Compares the resources at the end of a soak with those at the end of
+    its warmup.
+
+    @param  samples : list
+        Resource samples of one process (see run_soak).
+    @param  max_rss_growth : int
+        Growth of the resident set size, in bytes, allowed for (the python
+        and MuPDF allocators keep some of the memory freed).
+
+    @return growth : list
+        (resource, start, end) for each resource which grew: the documents,
+        file descriptors and threads left open, and the resident set size if
+        it grew by more than <max_rss_growth>.
+    """
+    first, last = samples[0], samples[-1]
+    growth = [(resource, first[resource], last[resource]) for resource in COUNTED_RESOURCES
+              if first[resource] is not None and last[resource] > first[resource]]
+    if last['rss'] - first['rss'] > max_rss_growth:
+        growth.append(('rss', first['rss'], last['rss']))
+    return growth
+
+def soak(arguments):
+    """
+    Runs merge, remove, insert and split, and their error paths, thousands
+    of times on synthetic pdfs, in one process or in each of a pool of
+    worker processes at once, to find resources they leave behind, which a
+    single run from the command line hides but a long running service
+    (e.g. serve, or a caller of the Python API) does not. The resident set
+    size, open file descriptors, open documents and threads of each process
+    are sampled over the soak, and the latency of every run recorded.
+
+    Prints markdown tables of the throughput and p50/p99 latency of each
+    operation, and of the resources of each process at the start and end,
+    and writes the results and samples to a json file. Raises RuntimeError
+    if any resource grew (see resource_growth).
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: iterations, warmup,
+        sample_every, jobs, pages, operations, max_rss_growth, output
+
+    @return json_path : str
+        Path to the json file of results.
+    """
+    # args: iterations, warmup, sample_every, jobs, pages, operations, max_rss_growth, output
+    json_path = arguments.output or os.path.join(os.getcwd(),
+        'soak_'+datetime.datetime.now().strftime('%H%M%S_%d%m%Y')+'.json')
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        src_pdf_path = make_pdf(os.path.join(work_dir, 'source.pdf'), arguments.pages, images=2, fonts=3)
+        ins_pdf_path = make_pdf(os.path.join(work_dir, 'insert.pdf'), 3)
+        bad_pdf_path = os.path.join(work_dir, 'not_a.pdf')
+        with open(bad_pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.7\nnot a pdf\n')
+        argvs = {name: _operation_argv(name, src_pdf_path, ins_pdf_path, bad_pdf_path, arguments.pages)
+                 for name in arguments.operations}
+        soak_args = (arguments.iterations, arguments.warmup, arguments.sample_every)
+
+        start = time.perf_counter()
+        if arguments.jobs == 1:
+            results = [_soak_worker(argvs, os.path.join(work_dir, 'out'), *soak_args)]
+        else:
+            # spawned (rather than forked) workers do not start out with
+            # this process's memory
+            with ProcessPoolExecutor(max_workers=arguments.jobs,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(_soak_worker, argvs, os.path.join(work_dir, 'out_{}'.format(n)),
+                                           *soak_args) for n in range(arguments.jobs)]
+                results = [future.result() for future in futures]
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir)
+
+    # runs/s is that of one process running the operation by itself
+    runs = sum(result['runs'] for result in results)
+    print('{} runs in {:.1f} s, {:.1f} runs/s over {} processes\n'.format(runs, seconds, runs/seconds, len(results)))
+    print('| operation | runs | runs/s | p50 (ms) | p99 (ms) |')
+    print('|---|---:|---:|---:|---:|')
+    operations = []
+    for name in argvs:
+        latencies = [latency for result in results for latency in result['latencies'][name]]
+        operation = {'operation': name, 'argv': argvs[name], 'runs': len(latencies),
+                     'runs_per_second': len(latencies)/sum(latencies),
+                     'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99)}
+        operations.append(operation)
+        print('| {} | {} | {:.1f} | {:.2f} | {:.2f} |'.format(name, operation['runs'], operation['runs_per_second'],
+              operation['p50']*1000, operation['p99']*1000))
+
+    print('\n| process | rss (MB) | fds | documents | threads |')
+    print('|---:|---|---|---|---|')
+    leaks = []
+    for n, result in enumerate(results):
+        first, last = result['samples'][0], result['samples'][-1]
+        print('| {} | {:.1f} -> {:.1f} | {} -> {} | {} -> {} | {} -> {} |'.format(n, first['rss']/2**20,
+              last['rss']/2**20, first['fds'], last['fds'], first['documents'], last['documents'],
+              first['threads'], last['threads']))
+        leaks.extend((n,) + growth for growth in resource_growth(result['samples'], arguments.max_rss_growth*2**20))
+
+    with open(json_path, 'w') as f:
+        json.dump({
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'iterations': arguments.iterations,
+            'jobs': arguments.jobs,
+            'pages': arguments.pages,
+            'seconds': seconds,
+            'runs_per_second': runs/seconds,
+            'operations': operations,
+            'samples': [result['samples'] for result in results],
+            'leaks': leaks,
+        }, f, indent=1)
+
+    for n, resource, start_value, end_value in leaks:
+        print('process {}: {} grew from {} to {}'.format(n, resource, start_value, end_value), file=sys.stderr)
+    if leaks:
+        raise RuntimeError('{} resources grew over the soak, results in {}'.format(len(leaks), json_path))
+
+    return json_path
@@ -0,0 +1,488 @@
+import os
+import re
+import sys
+import json
+import time
+import select
+import signal
+import struct
+import datetime
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from . import batch
+    from . import output
+except ImportError:
+    import batch
+    import output
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# inotify events watched for: a file created, written and closed, or moved
+# into the directory (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+# longest the watch loop waits before looking at the directory again
+MAX_WAIT = 1.0
+
+# number of the latest jobs the latencies in the metrics file are taken over
+LATENCY_WINDOW = 1000
+
+class InotifyWatcher:
+    """
+    Waits for files to be created, closed after writing, or moved into a
+    directory, using Linux's inotify, so that they are seen as they arrive
+    rather than at the next poll. Raises OSError where inotify is not
+    available.
+    """
+
+    def __init__(self, directory):
+        libc = _libc()
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, os.strerror(error), directory)
+        self._wake_r, self._wake_w = os.pipe()
+
+    def wait(self, timeout):
+        """
+        Waits up to <timeout> seconds for an event, or a call to wake.
+
+        @return closed : set
+            Names of the files closed after writing, or moved in, since the
+            last call.
+        """
+        readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+        if self._wake_r in readable:
+            os.read(self._wake_r, 4096)
+        closed = set()
+        if self._fd in readable:
+            try:
+                data = os.read(self._fd, 64*1024)
+            except BlockingIOError:
+                data = b''
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+                offset += length
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    closed.add(name)
+        return closed
+
+    def wake(self):
+        os.write(self._wake_w, b'x')
+
+    def close(self):
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            os.close(fd)
+
+class PollingWatcher:
+    """
+    Looks at the directory every <interval> seconds, where inotify is not
+    available (e.g. on Windows or macOS, or for network file systems, whose
+    changes inotify does not see).
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._woken = threading.Event()
+
+    def wait(self, timeout):
+        self._woken.wait(min(timeout, self.interval))
+        self._woken.clear()
+        return set()
+
+    def wake(self):
+        self._woken.set()
+
+    def close(self):
+        pass
+
+def _libc():
+    if ctypes is None or not sys.platform.startswith('linux'):
+        raise OSError('inotify is only available on Linux')
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError('inotify is not available')
+    return libc
+
+def open_watcher(directory, poll=None):
+    """
+    @param  poll : float
+        Poll every this many seconds, rather than use inotify. Defaults to
+        None (use inotify where available, else poll every second).
+
+    @return watcher : InotifyWatcher or PollingWatcher
+    """
+    if poll is None:
+        try:
+            return InotifyWatcher(directory)
+        except OSError as e:
+            print('watch: inotify is not available ({}), polling instead'.format(e), file=sys.stderr)
+    return PollingWatcher(poll or 1.0)
+
+
+class HotFolder:
+    """
+    Watches a directory for pdf files and runs an operation on each as it
+    arrives (or on each group of files, for merge), on a pool of worker
+    processes, moving the files to a done or failed directory afterwards.
+
+    A file is taken to be fully written once inotify reports it closed
+    after writing (or moved in), or otherwise once its size and
+    modification time have not changed for <settle> seconds. At most
+    <queue_size> jobs are handed to the workers at a time; files arriving
+    while the queue is full wait in the directory, and are taken, oldest
+    first, as jobs finish.
+    """
+
+    def __init__(self, directory, operation, out_dir, jobs=1, queue_size=None, settle=2.0, group=None,
+                 group_wait=10.0, poll=None, done_dir=None, failed_dir=None, log_path=None, metrics_path=None):
+        """
+        @param  directory : str
+            The directory to watch.
+        @param  operation : list
+            The command to run, and its arguments, without the source pdf/s
+            e.g. ['split', '--every', '1'], to which each file (or group of
+            files for merge) is given as the source.
+        @param  out_dir : str
+            Directory to save the outputs to.
+        @param  jobs : int
+            Number of worker processes. Defaults to 1.
+        @param  queue_size : int
+            Most jobs handed to the workers at a time. Defaults to twice
+            the number of workers.
+        @param  settle : float
+            Seconds a file must be unchanged for to be taken as written,
+            where it has not been seen closed. Defaults to 2.
+        @param  group : str
+            Regular expression whose first group (or whole match) gives the
+            group each file name belongs to, for merge.
+        @param  group_wait : float
+            Seconds after the last file of a group arrives that the group
+            is taken as complete. Defaults to 10.
+        @param  poll : float
+            Poll every this many seconds rather than use inotify.
+        @param  done_dir, failed_dir : str
+            Where files are moved to once their job succeeds or fails.
+            Default to the directories done and failed in <directory>.
+        @param  log_path : str
+            Json-lines log of job results. Defaults to watch_log.jsonl in
+            <out_dir>.
+        @param  metrics_path : str
+            File kept up to date with the queue depth and job latencies, as
+            json. Defaults to watch_metrics.json in <out_dir>.
+        """
+        if not operation or operation[0] not in ('merge', 'remove', 'insert', 'split'):
+            raise ValueError('watch runs one of merge, remove, insert or split, not {}'.format(operation[:1]))
+        if (operation[0] == 'merge') != bool(group):
+            raise ValueError('merge, and only merge, takes files in groups given by --group')
+        if settle < 0 or group_wait < 0 or (poll is not None and poll <= 0):
+            raise ValueError('watch times must not be negative')
+
+        self.directory = os.path.abspath(directory)
+        self.operation = list(operation)
+        self.out_dir = os.path.abspath(out_dir)
+        self.jobs = jobs
+        self.queue_size = queue_size or 2*jobs
+        self.settle = settle
+        self.group = re.compile(group) if group else None
+        self.group_wait = group_wait
+        self.done_dir = done_dir or os.path.join(self.directory, 'done')
+        self.failed_dir = failed_dir or os.path.join(self.directory, 'failed')
+        self.log_path = log_path or os.path.join(self.out_dir, 'watch_log.jsonl')
+        self.metrics_path = metrics_path or os.path.join(self.out_dir, 'watch_metrics.json')
+        for path in (self.out_dir, self.done_dir, self.failed_dir):
+            os.makedirs(path, exist_ok=True)
+
+        self.watcher = open_watcher(self.directory, poll)
+        # name: {'stat', 'changed', 'closed', 'arrived'} for each file seen
+        # but not yet finished
+        self._files = {}
+        # future: (names, arrived) for each job handed to the workers
+        self._in_flight = {}
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.processed = 0
+        self.failed = 0
+        self._stopping = False
+
+    def run(self, idle_exit=None):
+        """
+        Runs jobs as files arrive until stopped (by SIGTERM, ctrl-c or
+        stop), then waits for the jobs handed to the workers to finish.
+
+        @param  idle_exit : float
+            Stop once no files have been waiting, and no jobs running, for
+            this many seconds. Defaults to None (run until stopped).
+
+        @return None
+        """
+        idle_since = time.monotonic()
+        executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_watch_worker)
+        try:
+            with open(self.log_path, 'a') as log:
+                try:
+                    # files already in the directory are seen straight away
+                    closed = set()
+                    while not self._stopping:
+                        now = time.monotonic()
+                        self._scan(closed, now)
+                        self._finish(log)
+                        self._submit(executor, now)
+                        self._write_metrics()
+
+                        if self._files or self._in_flight:
+                            idle_since = now
+                        elif idle_exit is not None and now - idle_since >= idle_exit:
+                            break
+                        closed = self.watcher.wait(self._timeout())
+                except KeyboardInterrupt:
+                    pass
+
+                # jobs already handed out are finished, not abandoned
+                executor.shutdown(wait=True)
+                self._finish(log)
+                self._write_metrics()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.watcher.close()
+        return None
+
+    def stop(self):
+        # safe to call from a signal handler: the loop notices within MAX_WAIT
+        self._stopping = True
+
+    def _timeout(self):
+        # wake in time for the next file to settle, or group to complete.
+        # Files waiting for a place in the queue are woken for by the jobs
+        # finishing.
+        now = time.monotonic()
+        deadlines = [MAX_WAIT]
+        for info in self._files.values():
+            if 'submitted' in info:
+                continue
+            if not info['closed']:
+                deadlines.append(info['changed'] + self.settle - now)
+            if self.group is not None:
+                deadlines.append(info['changed'] + self.group_wait - now)
+        return max(min(deadline for deadline in deadlines if deadline > 0), 0.01)
+
+    def _scan(self, closed, now):
+        """
+        Notes the pdf files in the directory which are new or have changed
+        since the last scan.
+        """
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        present = set()
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or not name.lower().endswith('.pdf'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            present.add(name)
+
+            info = self._files.get(name)
+            if info is None:
+                info = self._files[name] = {'stat': key, 'changed': now, 'closed': False, 'arrived': time.time()}
+            elif 'submitted' in info:
+                continue
+            elif info['stat'] != key:
+                info.update(stat=key, changed=now, closed=False)
+            if name in closed:
+                info['closed'] = True
+
+        # e.g. deleted, or moved away, before it was taken
+        for name in [name for name, info in self._files.items() if name not in present and 'submitted' not in info]:
+            del self._files[name]
+
+    def _ready(self, info, now):
+        return 'submitted' not in info and (info['closed'] or now - info['changed'] >= self.settle)
+
+    def _units(self, now):
+        """
+        @return units : list
+            (job_id, names) for each file ready to be given to a job, or
+            each group of files for merge, oldest first.
+        """
+        if self.group is None:
+            names = [name for name, info in self._files.items() if self._ready(info, now)]
+            return [(os.path.splitext(name)[0], [name])
+                    for name in sorted(names, key=lambda name: self._files[name]['arrived'])]
+
+        groups = collections.defaultdict(list)
+        for name in self._files:
+            match = self.group.search(name)
+            groups[(match.group(1) if match.groups() else match.group(0)) if match else name].append(name)
+
+        units = []
+        for key, names in groups.items():
+            infos = [self._files[name] for name in names]
+            if all(self._ready(info, now) for info in infos) and \
+                    now - max(info['changed'] for info in infos) >= self.group_wait:
+                units.append((key, sorted(names)))
+        return sorted(units, key=lambda unit: min(self._files[name]['arrived'] for name in unit[1]))
+
+    def _submit(self, executor, now):
+        for job_id, names in self._units(now):
+            if len(self._in_flight) >= self.queue_size:
+                # the rest wait in the directory until a job finishes
+                break
+            paths = [os.path.join(self.directory, name) for name in names]
+            command, args = self.operation[0], self.operation[1:]
+            argv = [command] + paths + args if command == 'merge' else [command, paths[0]] + args
+            job_id = re.sub(r'[^\w.-]', '_', job_id)
+
+            future = executor.submit(batch.run_job, {'id': job_id, 'argv': argv}, self.out_dir)
+            future.add_done_callback(lambda _: self.watcher.wake())
+            for name in names:
+                self._files[name]['submitted'] = True
+            self._in_flight[future] = (names, min(self._files[name]['arrived'] for name in names))
+
+    def _finish(self, log):
+        """
+        Logs the jobs which have finished, and moves their files out of the
+        directory.
+        """
+        for future in [future for future in self._in_flight if future.done()]:
+            names, arrived = self._in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. a worker killed by the system
+                result = {'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+
+            ok = result.get('status') == 'ok'
+            self.processed += ok
+            self.failed += not ok
+            result['inputs'] = names
+            result['latency'] = round(time.time() - arrived, 6)
+            self._latencies.append(result['latency'])
+
+            for name in names:
+                self._files.pop(name, None)
+                try:
+                    moved_path = output.reserve_path(self.done_dir if ok else self.failed_dir, name)
+                    try:
+                        os.replace(os.path.join(self.directory, name), moved_path)
+                    finally:
+                        output.release(moved_path)
+                except OSError as e:
+                    result.setdefault('warnings', []).append('could not move {} ({})'.format(name, e.strerror))
+
+            log.write(json.dumps(result)+'\n')
+            log.flush()
+
+    def metrics(self):
+        """
+        @return metrics : dict
+            The files waiting in the directory, the jobs handed to the
+            workers (queue_depth), the jobs finished, and the latency from
+            a file arriving to its job finishing, over the latest jobs.
+        """
+        latencies = sorted(self._latencies)
+        def percentile(p):
+            return latencies[min(len(latencies)-1, int(p*len(latencies)))] if latencies else None
+        return {'updated': datetime.datetime.now().isoformat(timespec='seconds'),
+                'waiting': sum('submitted' not in info for info in self._files.values()),
+                'queue_depth': len(self._in_flight), 'queue_size': self.queue_size,
+                'processed': self.processed, 'failed': self.failed,
+                'latency': {'jobs': len(latencies), 'mean': sum(latencies)/len(latencies) if latencies else None,
+                            'p50': percentile(0.5), 'p95': percentile(0.95),
+                            'max': latencies[-1] if latencies else None}}
+
+    def _write_metrics(self):
+        # replaced whole, so that readers never see it part written
+        temp = output.temp_path(self.metrics_path)
+        with open(temp, 'w') as f:
+            json.dump(self.metrics(), f)
+        os.replace(temp, self.metrics_path)
+
+
+def _init_watch_worker():
+    # ctrl-c stops the watch, which lets the jobs running finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch(arguments):
+    """
+    Watches a directory (a scanner's hot folder, say) and runs an operation
+    on each pdf file that arrives in it, seconds after it arrives, without
+    starting poc again for each file (see HotFolder).
+
+    @param  arguments : arparse.Namespace
+        Command line arguments parsed by ArgumentParser.parse_args().
+        Will have the following attributes: directory, operation,
+        output_dir, jobs, queue, settle, poll, group, group_wait, done,
+        failed, log, metrics, idle_exit
+
+    @return log_path : str
+        Path to the log file.
+    """
+    # imported here so that helpers can import this module
+    try:
+        from . import helpers
+    except ImportError:
+        import helpers
+
+    # args: directory, operation, output_dir, jobs, queue, settle, poll, group,
+    # group_wait, done, failed, log, metrics, idle_exit
+    if not os.path.isdir(arguments.directory):
+        raise NotADirectoryError('{} is not a directory'.format(arguments.directory))
+
+    # check the operation's own arguments up front, with a stand-in source
+    operation = arguments.operation
+    if not operation or operation[0] not in helpers.JOB_COMMANDS:
+        raise ValueError('watch runs one of {} e.g. split --every 1 (options for watch go before the '
+                         'directory)'.format(', '.join(helpers.JOB_COMMANDS)))
+    sample_argv = operation[:1] + ['in.pdf']*(2 if operation[:1] == ['merge'] else 1) + operation[1:]
+    try:
+        helpers.set_args().parse_args(sample_argv)
+    except SystemExit:
+        raise ValueError('invalid operation for watch: {}'.format(' '.join(operation)))
+
+    hot_folder = HotFolder(arguments.directory, operation, arguments.output_dir or os.getcwd(),
+                           arguments.jobs, arguments.queue, arguments.settle, arguments.group,
+                           arguments.group_wait, arguments.poll, arguments.done, arguments.failed,
+                           arguments.log, arguments.metrics)
+
+    previous_handler = None
+    try:
+        previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: hot_folder.stop())
+    except ValueError:
+        # not the main thread
+        pass
+
+    print('poc watch: watching {}'.format(hot_folder.directory), file=sys.stderr)
+    try:
+        hot_folder.run(arguments.idle_exit)
+    finally:
+        if previous_handler is not None:
+            signal.signal(signal.SIGTERM, previous_handler)
+
+    print('poc watch: {} jobs done, {} failed, see {}'.format(hot_folder.processed, hot_folder.failed,
+          hot_folder.log_path), file=sys.stderr)
+    return hot_folder.log_path
@@ -0,0 +1,100 @@
+import io
+import os
+import sys
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.api import PageSet, merge_pdfs, remove_pages, insert_pages, split_pdf
+
+test_files_dir = 'tests/test_files/'
+
+def read_bytes(name):
+    with open(test_files_dir+name, 'rb') as f:
+        return f.read()
+
+def page_texts(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as f:
+        return [page.get_text() for page in f]
+
+#-----------------------------------
+# merge_pdfs
+#-----------------------------------
+
+def test_merge_pdfs_01_bytes():
+    # bytes, bytearray, memoryview and file object inputs, bytes output
+    pdf_1 = read_bytes('pdf_1.pdf')
+    pdfs = [pdf_1, bytearray(read_bytes('pdf_2.pdf')), memoryview(read_bytes('pdf_3.pdf')),
+            io.BytesIO(read_bytes('pdf_4.pdf'))]
+    merged = merge_pdfs(pdfs)
+    assert isinstance(merged, bytes)
+
+    texts = page_texts(merged)
+    assert len(texts) == 12
+    assert 'PDF file 1' in texts[0] and 'PDF file 4' in texts[-1]
+    return
+
+def test_merge_pdfs_02_outputs(tmp_path):
+    # paths in, stream or path out
+    pdfs = [test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf']
+    out = io.BytesIO()
+    assert merge_pdfs(pdfs, out, 'compact') is None
+    assert len(page_texts(out.getvalue())) == 6
+
+    out_path = str(tmp_path/'merged.pdf')
+    assert merge_pdfs(pdfs, out_path) is None
+    with fitz.open(out_path) as f:
+        assert len(f) == 6
+    return
+
+#-----------------------------------
+# remove_pages
+#-----------------------------------
+
+@pytest.mark.parametrize('save_profile', [None, 'fast'])
+def test_remove_pages_01(save_profile):
+    # the fast profile needs paths, so saves in full for bytes
+    src_bytes = read_bytes('pdf_5_bigboy.pdf')
+    out = remove_pages(src_bytes, ['2', '4-7', '13', '18-20'], save_profile=save_profile)
+    texts = page_texts(out)
+    assert len(texts) == 11
+    assert 'page 3' in texts[1] and 'page 17' in texts[-1]
+    assert not out.startswith(src_bytes)
+    return
+
+def test_remove_pages_02_page_set(tmp_path):
+    out_path = str(tmp_path/'removed.pdf')
+    remove_pages(test_files_dir+'pdf_5_bigboy.pdf', PageSet([(2, 20)]), out_path, 'fast')
+    with fitz.open(out_path) as f:
+        assert len(f) == 1
+    with pytest.raises(ValueError):
+        remove_pages(test_files_dir+'pdf_5_bigboy.pdf', PageSet([(20, 21)]))
+    return
+
+#-----------------------------------
+# insert_pages
+#-----------------------------------
+
+def test_insert_pages_01():
+    out = insert_pages(read_bytes('pdf_1.pdf'), io.BytesIO(read_bytes('pdf_2.pdf')), 2)
+    texts = page_texts(out)
+    assert len(texts) == 6
+    assert 'PDF file 2' in texts[2] and 'PDF file 1' in texts[-1]
+    return
+
+#-----------------------------------
+# split_pdf
+#-----------------------------------
+
+def test_split_pdf_01_bytes():
+    outs = split_pdf(read_bytes('pdf_5_bigboy.pdf'), every=6)
+    assert [len(page_texts(out)) for out in outs] == [6, 6, 6, 2]
+    return
+
+def test_split_pdf_02_streams():
+    streams = {}
+    outputs = split_pdf(read_bytes('pdf_5_bigboy.pdf'), ['1-2', 'last'],
+                        output=lambda page_input: streams.setdefault(page_input, io.BytesIO()))
+    assert outputs == [streams['1-2'], streams['last']]
+    assert len(page_texts(streams['1-2'].getvalue())) == 2
+    assert 'page 20' in page_texts(streams['last'].getvalue())[0]
+    return
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.batch as batch
+
+test_files_dir = 'tests/test_files/'
+
+def write_manifest(path, lines):
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    return str(path)
+
+def read_log(log_path):
+    with open(log_path) as f:
+        return [json.loads(line) for line in f]
+
+#-----------------------------------
+# read_manifest
+#-----------------------------------
+
+def test_read_manifest_01_jsonl(tmp_path):
+    manifest = write_manifest(tmp_path/'jobs.jsonl', [
+        '# comment',
+        '["split", "in.pdf", "1-3", 7]',
+        '',
+        '{"id": "a/1", "command": "merge", "args": ["one.pdf", "two.pdf"]}',
+    ])
+    jobs = batch.read_manifest(manifest)
+    assert jobs == [
+        {'id': '1', 'argv': ['split', 'in.pdf', '1-3', '7']},
+        {'id': 'a_1', 'argv': ['merge', 'one.pdf', 'two.pdf']},
+    ]
+    return
+
+def test_read_manifest_02_csv(tmp_path):
+    manifest = write_manifest(tmp_path/'jobs.csv', [
+        'remove,in.pdf,2,4-5',
+        'insert,in.pdf,other.pdf,3,',
+    ])
+    jobs = batch.read_manifest(manifest)
+    assert jobs == [
+        {'id': '1', 'argv': ['remove', 'in.pdf', '2', '4-5']},
+        {'id': '2', 'argv': ['insert', 'in.pdf', 'other.pdf', '3']},
+    ]
+    return
+
+#-----------------------------------
+# run_batch
+#-----------------------------------
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_run_batch_01(tmp_path, jobs):
+    manifest = write_manifest(tmp_path/'jobs.jsonl', [
+        json.dumps(['merge', test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf']),
+        json.dumps(['remove', test_files_dir+'pdf_5_bigboy.pdf', '2', '4-7']),
+        json.dumps(['remove', test_files_dir+'pdf_5_bigboy.pdf', '21-23']),
+        json.dumps(['insert', test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf', '2']),
+        json.dumps({'id': 'parts', 'command': 'split', 'args': [test_files_dir+'pdf_5_bigboy.pdf', '1-2', '20']}),
+        json.dumps(['split', test_files_dir+'does_not_exist.pdf', '1']),
+        json.dumps(['batch', 'jobs.jsonl']),
+    ])
+    args = set_args().parse_args(['batch', manifest, '-j', jobs, '-o', str(tmp_path/'out')])
+    log_path = batch.run_batch(args)
+    results = read_log(log_path)
+
+    assert [r['id'] for r in results] == ['1', '2', '3', '4', 'parts', '6', '7']
+    assert [r['status'] for r in results] == ['ok', 'ok', 'error', 'ok', 'ok', 'error', 'error']
+    assert 'ValueError' in results[2]['error']
+    assert 'FileNotFoundError' in results[5]['error']
+
+    with fitz.open(results[0]['outputs'][0]) as f:
+        assert len(f) == 6
+    with fitz.open(results[1]['outputs'][0]) as f:
+        assert len(f) == 15
+    with fitz.open(results[3]['outputs'][0]) as f:
+        assert len(f) == 6
+        assert 'PDF file 2' in f.get_page_text(2)
+
+    assert len(results[4]['outputs']) == 2
+    for outfile in results[4]['outputs']:
+        assert os.path.dirname(outfile) == str(tmp_path/'out'/'parts')
+    return
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.bench as bench
+
+#-----------------------------------
+# make_pdf
+#-----------------------------------
+
+def test_make_pdf_01(tmp_path):
+    path = bench.make_pdf(str(tmp_path/'synthetic.pdf'), 30, images=2, fonts=3)
+    with fitz.open(path) as f:
+        assert len(f) == 30
+        assert 'synthetic page 30' in f.get_page_text(-1)
+        assert len(f[0].get_images()) == 2
+        assert len({font[3] for page in f for font in page.get_fonts()}) == 3
+        # each image of the pool is stored once
+        assert len({image[0] for page in f for image in page.get_images()}) == bench.IMAGE_POOL
+    assert not os.path.exists(path+'.tmp')
+    return
+
+def test_make_pdf_02_raise(tmp_path):
+    for page_count, images, fonts in [(0, 0, 1), (10, -1, 1), (10, 21, 1), (10, 0, 0), (10, 0, 15)]:
+        with pytest.raises(ValueError):
+            bench.make_pdf(str(tmp_path/'synthetic.pdf'), page_count, images, fonts)
+    return
+
+#-----------------------------------
+# bench
+#-----------------------------------
+
+def test_bench_01(tmp_path):
+    json_path = str(tmp_path/'results.json')
+    args = set_args().parse_args(['bench', '-p', '5', '20', '-c', 'remove', '-r', '1',
+                                  '--data-dir', str(tmp_path/'data'), '-o', json_path])
+    assert bench.bench(args) == json_path
+
+    with open(json_path) as f:
+        results = json.load(f)['results']
+    assert [(r['command'], r['pages']) for r in results] == [('remove', 5), ('remove', 20)]
+    for result in results:
+        assert result['seconds'] > 0 and result['output_bytes'] > 0
+        assert result['peak_rss'] >= result['start_rss'] > 0
+
+    # comparing against itself finds no regressions (allowing for noise in
+    # such short times), so does not raise
+    args.compare = json_path
+    args.threshold = 100
+    args.output = str(tmp_path/'results_2.json')
+    bench.bench(args)
+    return
+
+def test_compare_results_01():
+    result = {'command': 'split', 'pages': 10, 'images': 0, 'fonts': 1,
+              'seconds': 1.0, 'peak_rss': 100, 'output_bytes': 1000}
+    slower = dict(result, seconds=1.5, output_bytes=1100)
+    assert bench.compare_results([result], [result], 1.25) == []
+    assert bench.compare_results([slower], [result], 1.25) == [('split 10p 0i 1f', 'seconds', 1.5)]
+    assert bench.compare_results([dict(slower, pages=20)], [result], 1.25) == []
+    return
@@ -1,155 +1,628 @@
-import os
-import sys 
-sys.path.insert(0, os.path.dirname(sys.path[0]))
-import fitz
-import pytest
-import argparse
-from poc.helpers import set_args
-import poc.commands as commands
-
-# note that the commands are being tested with valid inputs since before 
-# the arguments are passed to the command functions, they will have been
-# checked by the appropiate checking functions
-
-#-----------------------------------
-# merge
-#-----------------------------------
-
-def test_merge_01_two_pdfs():
-    parser = set_args()
-    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf'])
-    outfile = commands.merge(args)
-    with fitz.open(outfile) as f:
-        assert len(f) == 6
-        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
-        assert 'PDF file 2' and 'page 2' in f.get_page_text(4) #load_page(4).get_text()
-    os.remove(outfile)
-    return
-
-def test_merge_02_four_pdfs():
-    parser = set_args()
-    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', 
-                            'tests/test_files/pdf_3.pdf', 'tests/test_files/pdf_4.pdf'])
-    outfile = commands.merge(args)
-    with fitz.open(outfile) as f:
-        assert len(f) == 12
-        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
-        assert 'PDF file 2' and 'page 2' in f.get_page_text(4) #load_page(4).get_text()
-        assert 'PDF file 4' and 'page 3' in f.get_page_text(11) #load_page(11).get_text() 
-    os.remove(outfile)
-    return
-
-#-----------------------------------
-# remove
-#-----------------------------------
-
-def test_remove_01():
-    parser = set_args()
-    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '13', '18-20', '2', '4-7'])
-    outfile = commands.remove(args)
-    with fitz.open(outfile) as f:
-        assert len(f) == 11
-        assert 'PDF file 5' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
-        assert 'PDF file 5' and 'page 2' not in f.get_page_text(1) #load_page(1).get_text()
-        assert 'PDF file 5' and 'page 3' in f.get_page_text(1) #load_page(1).get_text()
-        assert 'PDF file 5' and 'page 17' in f.get_page_text(-1) #load_page(-1).get_text()
-    os.remove(outfile)
-    return
-
-def test_remove_02():
-    # 21-23 exceeds the number of pages in the pdf, so should raise a ValueError
-    parser = set_args()
-    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '2', '4-7', '13', '21-23'])
-    with pytest.raises(ValueError):
-        commands.remove(args)
-    return
-
-#-----------------------------------
-# insert 
-#-----------------------------------
-
-def test_insert_01():
-    # 
-    parser = set_args()
-    args = parser.parse_args(['insert', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', '2'])
-    outfile = commands.insert(args)
-    with fitz.open(outfile) as f:
-        assert len(f) == 6
-        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text()
-        assert 'PDF file 2' and 'page 2' in f.get_page_text(3) #load_page(3).get_text()
-        assert 'PDF file 1' and 'page 3' in f.get_page_text(-1) #load_page(-1).get_text()
-    os.remove(outfile)
-    return
-
-def test_insert_02():
-    # 
-    parser = set_args()
-    args = parser.parse_args(['insert', 'tests/test_files/pdf_5_bigboy.pdf', 'tests/test_files/pdf_4.pdf', '14'])
-    outfile = commands.insert(args)
-    with fitz.open(outfile) as f:
-        assert len(f) == 23
-        assert 'PDF file 5' and 'page 1' in f.get_page_text(0) #load_page(0).get_text()
-        assert 'PDF file 4' and 'page 3' in f.get_page_text(16) #load_page(16).get_text()
-        assert 'PDF file 5' and 'page 20' in f.get_page_text(-1) #load_page(-1).get_text()
-    os.remove(outfile)
-    return
-
-def test_insert_03():
-    # given page exceeds the number of pages in the source pdf
-    parser = set_args()
-    args = parser.parse_args(['insert', 'tests/test_files/pdf_3.pdf', 'tests/test_files/pdf_2.pdf', '7'])
-    with pytest.raises(ValueError):
-        commands.insert(args)
-    return
-
-#-----------------------------------
-# split 
-#-----------------------------------
-
-def test_split_01():
-    # expect one output file
-    parser = set_args()
-    args = parser.parse_args(['split', 'tests/test_files/pdf_3.pdf', '3'])
-    output_paths = commands.split(args)
-
-    assert len(output_paths) == 1
-
-    with fitz.open(output_paths[0]) as f:
-        assert len(f) == 1
-        assert 'PDF file 3' and 'page 3' in f.get_page_text(0)
-    for outfile in output_paths:
-        os.remove(outfile)
-    return
-
-def test_split_02():
-    # expect 4 output pdf files
-    parser = set_args()
-    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '5-8', '13-17', '20'])
-    output_paths = commands.split(args)
-
-    assert len(output_paths) == 4
-    
-    with fitz.open(output_paths[0]) as f:
-        assert len(f) == 1
-        assert 'PDF file 5' and 'page 2' in f.get_page_text(0)
-    
-    with fitz.open(output_paths[1]) as f:
-        assert len(f) == 4
-        assert 'PDF file 5' and 'page 6' in f.get_page_text(1)
-        assert 'PDF file 5' and 'page 8' in f.get_page_text(-1)
-    
-    with fitz.open(output_paths[2]) as f:
-        assert len(f) == 5
-        assert 'PDF file 5' and 'page 13' in f.get_page_text(0)
-        assert 'PDF file 5' and 'page 15' in f.get_page_text(2)
-        assert 'PDF file 5' and 'page 17' in f.get_page_text(-1)
-
-    with fitz.open(output_paths[3]) as f:
-        assert len(f) == 1
-        assert 'PDF file 5' and 'page 20' in f.get_page_text(0)
-
-    for outfile in output_paths:
-        os.remove(outfile)
-    return
-
-
+import os
+import sys 
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+import argparse
+from poc.helpers import set_args
+import poc.commands as commands
+import poc.instrument as instrument
+
+# note that the commands are being tested with valid inputs since before 
+# the arguments are passed to the command functions, they will have been
+# checked by the appropiate checking functions
+
+BOOKMARKS = [[1, 'one', 3], [2, 'one.a', 5], [1, 'two', 9], [1, 'three', 15]]
+
+def bookmarked_pdf(path, src_pdf_path='tests/test_files/pdf_5_bigboy.pdf', toc=BOOKMARKS, title='Bookmarked'):
+    with fitz.open(src_pdf_path) as f:
+        f.set_toc(toc)
+        f.set_metadata({'title': title, 'author': 'poc'})
+        f.save(path)
+    return path
+
+def bookmarks_and_title(pdf_path):
+    with fitz.open(pdf_path) as f:
+        return f.get_toc(), f.metadata['title']
+
+#-----------------------------------
+# merge
+#-----------------------------------
+
+def test_merge_01_two_pdfs():
+    parser = set_args()
+    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf'])
+    outfile = commands.merge(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 6
+        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
+        assert 'PDF file 2' and 'page 2' in f.get_page_text(4) #load_page(4).get_text()
+    os.remove(outfile)
+    return
+
+def test_merge_02_four_pdfs():
+    parser = set_args()
+    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', 
+                            'tests/test_files/pdf_3.pdf', 'tests/test_files/pdf_4.pdf'])
+    outfile = commands.merge(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 12
+        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
+        assert 'PDF file 2' and 'page 2' in f.get_page_text(4) #load_page(4).get_text()
+        assert 'PDF file 4' and 'page 3' in f.get_page_text(11) #load_page(11).get_text() 
+    os.remove(outfile)
+    return
+
+def test_merge_03_chunked(tmp_path):
+    # inputs given by a file, merged two at a time
+    list_path = tmp_path/'pdfs.txt'
+    list_path.write_text('tests/test_files/pdf_2.pdf\n\ntests/test_files/pdf_3.pdf\ntests/test_files/pdf_4.pdf\n')
+    parser = set_args()
+    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', '--from-file', str(list_path), 
+                            '--chunk-size', '2', '--max-rss', '1'])
+    outfile = commands.merge(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 12
+        assert 'PDF file 1' in f.get_page_text(0) and 'page 1' in f.get_page_text(0)
+        assert 'PDF file 2' in f.get_page_text(4) and 'page 2' in f.get_page_text(4)
+        assert 'PDF file 3' in f.get_page_text(7)
+        assert 'PDF file 4' in f.get_page_text(11) and 'page 3' in f.get_page_text(11)
+    os.remove(outfile)
+    return
+
+def test_merge_04_compact():
+    parser = set_args()
+    pdfs = ['tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', 'tests/test_files/pdf_5_bigboy.pdf']
+    plain_outfile = commands.merge(parser.parse_args(['merge'] + pdfs))
+    plain_size = os.path.getsize(plain_outfile)
+    os.remove(plain_outfile)
+
+    outfile = commands.merge(parser.parse_args(['merge'] + pdfs + ['--save-profile', 'compact']))
+    with fitz.open(outfile) as f:
+        assert len(f) == 26
+    assert os.path.getsize(outfile) < plain_size
+    os.remove(outfile)
+    return
+
+@pytest.mark.parametrize('chunk_size', [None, '2'])
+def test_merge_05_bad_source(tmp_path, chunk_size):
+    # a bad pdf at the end fails the merge before anything is merged
+    bad_pdf_path = str(tmp_path/'bad.pdf')
+    with open(bad_pdf_path, 'wb') as f:
+        f.write(b'%PDF-1.7 truncated')
+    records = []
+    hook = instrument.add_hook(records.append)
+    parser = set_args()
+    argv = ['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', bad_pdf_path,
+            '-o', str(tmp_path/'out')] + (['-c', chunk_size] if chunk_size else [])
+    try:
+        with pytest.raises(ValueError):
+            with instrument.command_trace('merge'):
+                commands.merge(parser.parse_args(argv))
+    finally:
+        instrument.remove_hook(hook)
+    assert not os.path.exists(str(tmp_path/'out'))
+    # the check may wait on the pdfs being read ahead, but nothing is opened
+    # to merge
+    assert set(records[0]['phases']) <= {'check', 'read_wait'}
+    return
+
+def test_merge_06_dedupe(tmp_path, capsys):
+    # many copies of the same letterhead images and fonts
+    from poc.bench import make_pdf
+    pdfs = [make_pdf(str(tmp_path/'invoice_{}.pdf'.format(i)), 2, images=2, fonts=3) for i in range(6)]
+    parser = set_args()
+    plain_outfile = commands.merge(parser.parse_args(['merge'] + pdfs + ['-o', str(tmp_path/'plain')]))
+    outfile = commands.merge(parser.parse_args(['merge'] + pdfs + ['--dedupe', '-o', str(tmp_path/'dedupe')]))
+    with fitz.open(plain_outfile) as plain, fitz.open(outfile) as f:
+        assert [page.get_text() for page in f] == [page.get_text() for page in plain]
+        assert [len(page.get_images()) for page in f] == [2]*12
+        # every page draws the images and fonts of the first invoice
+        for get_xrefs in (fitz.Page.get_images, fitz.Page.get_fonts):
+            xrefs = [{xref for xref, *_ in get_xrefs(page)} for page in f]
+            assert set().union(*xrefs) == xrefs[0] | xrefs[1]
+    assert os.path.getsize(outfile) < os.path.getsize(plain_outfile)/2
+
+    # the command line reports what was shared, the Python API does not
+    assert 'dedupe: shared' in capsys.readouterr().err
+    commands.merge_pdfs(pdfs, dedupe=True)
+    assert capsys.readouterr().err == ''
+
+    with pytest.raises(ValueError):
+        commands.merge(parser.parse_args(['merge'] + pdfs + ['--dedupe', '-c', '2']))
+    return
+
+def test_merge_07_many_sources(tmp_path, monkeypatch):
+    # more sources than are kept open from the check, each opened once, the
+    # rest when the merge reaches them, and closed once it is copied
+    from poc.bench import make_pdf
+    monkeypatch.setattr(commands, 'MAX_SHARED_SOURCES', 4)
+    pdfs = [make_pdf(str(tmp_path/'src_{}.pdf'.format(i)), 1) for i in range(10)]
+    opened = []
+    fitz_open = fitz.open
+    def counting_open(*args, **kwargs):
+        doc = fitz_open(*args, **kwargs)
+        if args:
+            opened.append(doc)
+        return doc
+    monkeypatch.setattr(fitz, 'open', counting_open)
+    still_open = []
+    insert_pdf = fitz.Document.insert_pdf
+    def counting_insert_pdf(self, *args, **kwargs):
+        still_open.append(sum(not doc.is_closed for doc in opened))
+        return insert_pdf(self, *args, **kwargs)
+    monkeypatch.setattr(fitz.Document, 'insert_pdf', counting_insert_pdf)
+
+    parser = set_args()
+    outfile = commands.merge(parser.parse_args(['merge'] + pdfs + ['--read-ahead', '0', '-o', str(tmp_path/'out')]))
+    assert len(opened) == 10 and all(doc.is_closed for doc in opened)
+    assert still_open == [4, 3, 2, 1, 1, 1, 1, 1, 1, 1]
+    with fitz_open(outfile) as f:
+        assert len(f) == 10
+    return
+
+@pytest.mark.parametrize('chunk_size', [None, '1'])
+def test_merge_08_bookmarks(tmp_path, chunk_size):
+    # the bookmarks of each pdf, at the pages they were copied to, and the
+    # metadata of the first
+    pdfs = [bookmarked_pdf(str(tmp_path/'a.pdf'), 'tests/test_files/pdf_1.pdf', [[1, 'a', 2]], 'A'),
+            'tests/test_files/pdf_2.pdf', bookmarked_pdf(str(tmp_path/'b.pdf'))]
+    argv = ['merge'] + pdfs + ['-o', str(tmp_path/'out')] + (['-c', chunk_size] if chunk_size else [])
+    outfile = commands.merge(set_args().parse_args(argv))
+    assert bookmarks_and_title(outfile) == ([[1, 'a', 2], [1, 'one', 9], [2, 'one.a', 11], [1, 'two', 15],
+                                            [1, 'three', 21]], 'A')
+    return
+
+#-----------------------------------
+# check_sources
+#-----------------------------------
+
+def test_check_sources_01():
+    assert commands.check_sources(['tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_5_bigboy.pdf']) == [3, 20]
+    return
+
+def test_check_sources_02_raise(tmp_path):
+    encrypted_pdf_path = str(tmp_path/'encrypted.pdf')
+    with fitz.open('tests/test_files/pdf_1.pdf') as f:
+        f.save(encrypted_pdf_path, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw='owner', user_pw='user')
+    not_pdf_path = str(tmp_path/'not.pdf')
+    with open(not_pdf_path, 'wb') as f:
+        f.write(b'not a pdf')
+    for path in (encrypted_pdf_path, not_pdf_path):
+        with pytest.raises(ValueError):
+            commands.check_sources([path])
+        with commands.sharing_sources([path]):
+            with pytest.raises(ValueError):
+                commands.check_sources([path])
+    return
+
+def test_check_sources_03_looked_over(tmp_path, monkeypatch):
+    # the sources after those kept open are only looked over, and checked
+    # once they are opened
+    monkeypatch.setattr(commands, 'MAX_SHARED_SOURCES', 1)
+    pdfs = ['tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_5_bigboy.pdf']
+    with commands.sharing_sources(pdfs):
+        assert commands.check_sources(pdfs) == [3, None]
+        with commands.open_source_pdf(pdfs[1]) as f:
+            assert f.page_count == 20
+    # an encrypted or damaged pdf is opened to check it
+    encrypted_pdf_path = str(tmp_path/'encrypted.pdf')
+    with fitz.open('tests/test_files/pdf_1.pdf') as f:
+        f.save(encrypted_pdf_path, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw='owner', user_pw='user')
+    truncated_pdf_path = str(tmp_path/'truncated.pdf')
+    with open(truncated_pdf_path, 'wb') as f:
+        f.write(b'%PDF-1.7 truncated')
+    for path in (encrypted_pdf_path, truncated_pdf_path):
+        assert not commands._look_over_source(path)
+        with commands.sharing_sources(pdfs + [path]):
+            with pytest.raises(ValueError):
+                commands.check_sources(pdfs + [path])
+    return
+
+def test_check_sources_04_os_error(monkeypatch):
+    # an error reading the file, e.g. too many open files, is not reported
+    # as the file not being a pdf
+    import errno
+    def failing_open(*args, **kwargs):
+        raise OSError(errno.EMFILE, 'Too many open files')
+    monkeypatch.setattr(commands, 'open', failing_open, raising=False)
+    with pytest.raises(OSError) as e:
+        commands.check_sources(['tests/test_files/pdf_1.pdf'])
+    assert e.value.errno == errno.EMFILE
+    return
+
+#-----------------------------------
+# remove
+#-----------------------------------
+
+def test_remove_01():
+    parser = set_args()
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '13', '18-20', '2', '4-7'])
+    outfile = commands.remove(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 11
+        assert 'PDF file 5' and 'page 1' in f.get_page_text(0) #load_page(0).get_text() 
+        assert 'PDF file 5' and 'page 2' not in f.get_page_text(1) #load_page(1).get_text()
+        assert 'PDF file 5' and 'page 3' in f.get_page_text(1) #load_page(1).get_text()
+        assert 'PDF file 5' and 'page 17' in f.get_page_text(-1) #load_page(-1).get_text()
+    os.remove(outfile)
+    return
+
+def test_remove_02():
+    # 21-23 exceeds the number of pages in the pdf, so should raise a ValueError
+    parser = set_args()
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '2', '4-7', '13', '21-23'])
+    with pytest.raises(ValueError):
+        commands.remove(args)
+    return
+
+@pytest.mark.parametrize('save_profile', ['fast', 'compact', 'linearized'])
+def test_remove_03_save_profiles(save_profile):
+    parser = set_args()
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '13', '18-20', '2', '4-7',
+                            '--save-profile', save_profile])
+    outfile = commands.remove(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 11
+        assert 'page 3' in f.get_page_text(1)
+        assert 'page 17' in f.get_page_text(-1)
+    os.remove(outfile)
+    return
+
+def test_remove_04_fast_is_incremental():
+    # the fast profile appends the removal to a copy of the source pdf
+    src_pdf_path = 'tests/test_files/pdf_5_bigboy.pdf'
+    parser = set_args()
+    args = parser.parse_args(['remove', src_pdf_path, '3', '--save-profile', 'fast'])
+    outfile = commands.remove(args)
+    with open(src_pdf_path, 'rb') as src, open(outfile, 'rb') as out:
+        src_bytes = src.read()
+        assert out.read(len(src_bytes)) == src_bytes
+    os.remove(outfile)
+    return
+
+@pytest.mark.parametrize('save_profile', ['fast', 'compact'])
+def test_remove_05_page_selections(save_profile):
+    # even pages and everything from page 18 leave pages 1, 3, 5, ..., 17
+    parser = set_args()
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', 'even', '18-',
+                            '--save-profile', save_profile])
+    outfile = commands.remove(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 9
+        assert 'page 3' in f.get_page_text(1)
+        assert 'page 17' in f.get_page_text(-1)
+    os.remove(outfile)
+    return
+
+def open_files():
+    return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+
+def test_remove_06_large():
+    # large-file mode appends the removal to a copy of the source pdf, and
+    # closes every file it opens
+    src_pdf_path = 'tests/test_files/pdf_5_bigboy.pdf'
+    parser = set_args()
+    args = parser.parse_args(['remove', src_pdf_path, '2-3', '20', '--large'])
+    files = open_files()
+    outfile = commands.remove(args)
+    assert open_files() == files
+    with fitz.open(outfile) as f:
+        assert len(f) == 17
+        assert 'page 4' in f.get_page_text(1)
+        assert 'page 19' in f.get_page_text(-1)
+    with open(src_pdf_path, 'rb') as src, open(outfile, 'rb') as out:
+        src_bytes = src.read()
+        assert out.read(len(src_bytes)) == src_bytes
+    os.remove(outfile)
+    return
+
+def test_remove_07_large_raise():
+    parser = set_args()
+    for argv in (['21'], ['2', '--save-profile', 'compact']):
+        args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '--large'] + argv)
+        files = open_files()
+        with pytest.raises(ValueError):
+            commands.remove(args)
+        assert open_files() == files
+    with pytest.raises(ValueError):
+        commands.remove_pages(b'', ['2'], 'out.pdf', large=True)
+    return
+
+@pytest.mark.parametrize('save_profile', [None, 'fast'])
+def test_remove_08_bookmarks(tmp_path, save_profile):
+    # bookmarks to the pages removed are dropped, and those under them
+    # moved up, or with 'fast', where the pages are deleted from a copy of
+    # the pdf, left pointing nowhere as fitz.Document.delete_pages leaves them
+    src_pdf = bookmarked_pdf(str(tmp_path/'src.pdf'))
+    argv = ['remove', src_pdf, '3', '9-10', '-o', str(tmp_path/'out')] + \
+        (['--save-profile', save_profile] if save_profile else [])
+    outfile = commands.remove(set_args().parse_args(argv))
+    if save_profile == 'fast':
+        toc = [[1, 'one', -1], [2, 'one.a', 4], [1, 'two', -1], [1, 'three', 12]]
+    else:
+        toc = [[1, 'one.a', 4], [1, 'three', 12]]
+    assert bookmarks_and_title(outfile) == (toc, 'Bookmarked')
+    return
+
+#-----------------------------------
+# insert 
+#-----------------------------------
+
+def test_insert_01():
+    # 
+    parser = set_args()
+    args = parser.parse_args(['insert', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf', '2'])
+    outfile = commands.insert(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 6
+        assert 'PDF file 1' and 'page 1' in f.get_page_text(0) #load_page(0).get_text()
+        assert 'PDF file 2' and 'page 2' in f.get_page_text(3) #load_page(3).get_text()
+        assert 'PDF file 1' and 'page 3' in f.get_page_text(-1) #load_page(-1).get_text()
+    os.remove(outfile)
+    return
+
+def test_insert_02():
+    # 
+    parser = set_args()
+    args = parser.parse_args(['insert', 'tests/test_files/pdf_5_bigboy.pdf', 'tests/test_files/pdf_4.pdf', '14'])
+    outfile = commands.insert(args)
+    with fitz.open(outfile) as f:
+        assert len(f) == 23
+        assert 'PDF file 5' and 'page 1' in f.get_page_text(0) #load_page(0).get_text()
+        assert 'PDF file 4' and 'page 3' in f.get_page_text(16) #load_page(16).get_text()
+        assert 'PDF file 5' and 'page 20' in f.get_page_text(-1) #load_page(-1).get_text()
+    os.remove(outfile)
+    return
+
+def test_insert_03():
+    # given page exceeds the number of pages in the source pdf
+    parser = set_args()
+    args = parser.parse_args(['insert', 'tests/test_files/pdf_3.pdf', 'tests/test_files/pdf_2.pdf', '7'])
+    with pytest.raises(ValueError):
+        commands.insert(args)
+    return
+
+@pytest.mark.parametrize('page', [0, 14, 20])
+def test_insert_04_large(page):
+    parser = set_args()
+    args = parser.parse_args(['insert', 'tests/test_files/pdf_5_bigboy.pdf', 'tests/test_files/pdf_4.pdf',
+                              str(page), '--large'])
+    files = open_files()
+    outfile = commands.insert(args)
+    assert open_files() == files
+    with fitz.open(outfile) as f:
+        assert len(f) == 23
+        assert 'PDF file 4' in f.get_page_text(page)
+        assert 'PDF file 4' in f.get_page_text(page+2)
+        assert 'PDF file 5' in f.get_page_text(page+3 if page < 20 else page-1)
+    os.remove(outfile)
+    return
+
+def test_insert_05_bookmarks(tmp_path):
+    src_pdf = bookmarked_pdf(str(tmp_path/'src.pdf'))
+    argv = ['insert', src_pdf, 'tests/test_files/pdf_1.pdf', '4', '-o', str(tmp_path/'out')]
+    outfile = commands.insert(set_args().parse_args(argv))
+    assert bookmarks_and_title(outfile) == ([[1, 'one', 3], [2, 'one.a', 8], [1, 'two', 12], [1, 'three', 18]],
+                                            'Bookmarked')
+    return
+
+#-----------------------------------
+# rearrange
+#-----------------------------------
+
+def test_rearrange_01():
+    parser = set_args()
+    src_pdf = 'tests/test_files/pdf_5_bigboy.pdf'
+    args = parser.parse_args(['rearrange', src_pdf, '1-3', '10', '5-9', 'r90:4', 'last-1'])
+    outfile = commands.rearrange(args)
+    with fitz.open(src_pdf) as src, fitz.open(outfile) as f:
+        pages = [1, 2, 3, 10, 5, 6, 7, 8, 9, 4] + list(range(20, 0, -1))
+        assert [page.get_text() for page in f] == [src[page-1].get_text() for page in pages]
+        # page 4 is given twice, and only rotated the first time
+        assert [page.rotation for page in f] == [0]*9 + [90] + [0]*20
+        # each page given more than once has its own page object
+        assert len({f.page_xref(i) for i in range(len(f))}) == len(f)
+    os.remove(outfile)
+    return
+
+def test_rearrange_02_drops_pages(tmp_path):
+    parser = set_args()
+    src_pdf = 'tests/test_files/pdf_5_bigboy.pdf'
+    out = ['-o', str(tmp_path)]
+    outfile = commands.rearrange(parser.parse_args(['rearrange', src_pdf, 'r-90:2', '1'] + out))
+    with fitz.open(outfile) as f:
+        assert [page.rotation for page in f] == [270, 0]
+        assert 'page 2' in f.get_page_text(0)
+    # the objects only used by the pages left out are not saved
+    every_page = commands.rearrange(parser.parse_args(['rearrange', src_pdf, 'r-90:2', '1', '3-'] + out))
+    assert os.path.getsize(outfile) < os.path.getsize(every_page)
+    os.remove(every_page)
+
+    # nothing is written for a page past the last page, or no pages
+    for order in (['3', '21'], ['last-21']):
+        with pytest.raises(ValueError):
+            commands.rearrange(parser.parse_args(['rearrange', src_pdf] + order + out))
+    with fitz.open() as one_page:
+        one_page.new_page()
+        with pytest.raises(ValueError):
+            commands.rearrange_pages(one_page.tobytes(), 'even', str(tmp_path/'none.pdf'))
+    assert os.listdir(tmp_path) == [os.path.basename(outfile)]
+    return
+
+def test_rearrange_03_nested_page_tree(tmp_path):
+    # pages 3 and 4 under a node of their own, which they inherit their 
+    # size and rotation from
+    with fitz.open() as pdf:
+        for n in range(4):
+            pdf.new_page(width=200, height=300).insert_text((20, 50), 'page {}'.format(n+1))
+        root_xref = int(pdf.xref_get_key(pdf.pdf_catalog(), 'Pages')[1].split()[0])
+        page_xrefs = [pdf.page_xref(i) for i in range(4)]
+        node_xref = pdf.get_new_xref()
+        pdf.update_object(node_xref, '<</Type/Pages/Parent {} 0 R/Kids[{} 0 R {} 0 R]/Count 2/Rotate 90'
+                          '/MediaBox[0 0 300 400]>>'.format(root_xref, *page_xrefs[2:]))
+        for xref in page_xrefs[2:]:
+            pdf.xref_set_key(xref, 'Parent', '{} 0 R'.format(node_xref))
+            pdf.xref_set_key(xref, 'MediaBox', 'null')
+            pdf.xref_set_key(xref, 'Rotate', 'null')
+        pdf.xref_set_key(root_xref, 'Kids', '[{} 0 R {} 0 R {} 0 R]'.format(*page_xrefs[:2], node_xref))
+        src_pdf = str(tmp_path/'nested.pdf')
+        pdf.save(src_pdf)
+
+    outfile = commands.rearrange(set_args().parse_args(['rearrange', src_pdf, '4-3', 'r90:1', '2',
+                                                        '-o', str(tmp_path)]))
+    with fitz.open(outfile) as f:
+        assert ['page 4', 'page 3', 'page 1', 'page 2'] == [page.get_text().strip() for page in f]
+        assert [page.rotation for page in f] == [90, 90, 90, 0]
+        assert [page.mediabox.width for page in f] == [300, 300, 200, 200]
+    return
+
+#-----------------------------------
+# split 
+#-----------------------------------
+
+def test_split_01():
+    # expect one output file
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_3.pdf', '3'])
+    output_paths = commands.split(args)
+
+    assert len(output_paths) == 1
+
+    with fitz.open(output_paths[0]) as f:
+        assert len(f) == 1
+        assert 'PDF file 3' and 'page 3' in f.get_page_text(0)
+    for outfile in output_paths:
+        os.remove(outfile)
+    return
+
+def test_split_02():
+    # expect 4 output pdf files
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '5-8', '13-17', '20'])
+    output_paths = commands.split(args)
+
+    assert len(output_paths) == 4
+    
+    with fitz.open(output_paths[0]) as f:
+        assert len(f) == 1
+        assert 'PDF file 5' and 'page 2' in f.get_page_text(0)
+    
+    with fitz.open(output_paths[1]) as f:
+        assert len(f) == 4
+        assert 'PDF file 5' and 'page 6' in f.get_page_text(1)
+        assert 'PDF file 5' and 'page 8' in f.get_page_text(-1)
+    
+    with fitz.open(output_paths[2]) as f:
+        assert len(f) == 5
+        assert 'PDF file 5' and 'page 13' in f.get_page_text(0)
+        assert 'PDF file 5' and 'page 15' in f.get_page_text(2)
+        assert 'PDF file 5' and 'page 17' in f.get_page_text(-1)
+
+    with fitz.open(output_paths[3]) as f:
+        assert len(f) == 1
+        assert 'PDF file 5' and 'page 20' in f.get_page_text(0)
+
+    for outfile in output_paths:
+        os.remove(outfile)
+    return
+
+def test_split_03_jobs():
+    # parallel split should give the same outputs, in the same order, as
+    # the serial split
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '5-8', '13-17', '20', '-j', '2'])
+    output_paths = commands.split(args)
+
+    assert len(output_paths) == 4
+    for outfile, page_input in zip(output_paths, ['2', '5-8', '13-17', '20']):
+        assert outfile.endswith('_page_'+page_input+'.pdf')
+
+    with fitz.open(output_paths[1]) as f:
+        assert len(f) == 4
+        assert 'page 5' in f.get_page_text(0)
+        assert 'page 8' in f.get_page_text(-1)
+
+    with fitz.open(output_paths[3]) as f:
+        assert len(f) == 1
+        assert 'page 20' in f.get_page_text(0)
+
+    for outfile in output_paths:
+        os.remove(outfile)
+    return
+
+
+def test_split_04_every():
+    # 20 pages in chunks of 6
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '--every', '6'])
+    output_paths = commands.split(args)
+
+    assert len(output_paths) == 4
+    for outfile, page_input in zip(output_paths, ['1-6', '7-12', '13-18', '19-20']):
+        assert outfile.endswith('_page_'+page_input+'.pdf')
+
+    with fitz.open(output_paths[2]) as f:
+        assert len(f) == 6
+        assert 'page 13' in f.get_page_text(0)
+    with fitz.open(output_paths[3]) as f:
+        assert len(f) == 2
+
+    for outfile in output_paths:
+        os.remove(outfile)
+    return
+
+def test_split_05_by_bookmark(tmp_path):
+    src_pdf_path = str(tmp_path/'bookmarks.pdf')
+    with fitz.open('tests/test_files/pdf_5_bigboy.pdf') as f:
+        f.set_toc([[1, 'one', 3], [2, 'one.a', 5], [1, 'two', 9], [1, 'three', 15]])
+        f.save(src_pdf_path)
+
+    parser = set_args()
+    args = parser.parse_args(['split', src_pdf_path, '--by-bookmark'])
+    output_paths = commands.split(args)
+    for outfile, page_input in zip(output_paths, ['1-2', '3-8', '9-14', '15-20']):
+        assert outfile.endswith('_page_'+page_input+'.pdf')
+    for outfile in output_paths:
+        os.remove(outfile)
+
+    args = parser.parse_args(['split', src_pdf_path, '--by-bookmark', '2'])
+    output_paths = commands.split(args)
+    assert len(output_paths) == 5
+    with fitz.open(output_paths[1]) as f:
+        assert len(f) == 2
+        assert 'page 3' in f.get_page_text(0)
+    for outfile in output_paths:
+        os.remove(outfile)
+    return
+
+def test_split_06_pages_and_every():
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '--every', '6'])
+    with pytest.raises(ValueError):
+        commands.split(args)
+    return
+
+def test_split_07_page_selections():
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '-3', '17-', 'odd'])
+    output_paths = commands.split(args)
+
+    assert len(output_paths) == 3
+    page_counts = []
+    for outfile in output_paths:
+        with fitz.open(outfile) as f:
+            page_counts.append(len(f))
+            last_text = f.get_page_text(-1)
+        os.remove(outfile)
+    assert page_counts == [3, 4, 10]
+    assert 'page 19' in last_text
+    return
+
+def test_split_08_out_of_range():
+    # nothing is written if any page selection is not in the pdf
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '21-'])
+    with pytest.raises(ValueError):
+        commands.split(args)
+    return
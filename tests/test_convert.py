@@ -0,0 +1,76 @@
+import os
+import sys
+import struct
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.convert as convert
+
+test_files_dir = 'tests/test_files/'
+
+def image_sizes(pngs):
+    # the width and height of a png are the first fields of its header
+    return [struct.unpack('>II', png[16:24]) for png in pngs]
+
+#-----------------------------------
+# convert_pdf
+#-----------------------------------
+
+def test_convert_pdf_01():
+    images = convert.convert_pdf(test_files_dir+'pdf_5_bigboy.pdf', ['2', 'last'], size=100)
+    assert [image[:8] for image in images] == [b'\x89PNG\r\n\x1a\n']*2
+    assert image_sizes(images) == [(71, 100)]*2
+
+    # every page, at 72 dpi the size of the page in points
+    with open(test_files_dir+'pdf_1.pdf', 'rb') as f:
+        images = convert.convert_pdf(f.read(), dpi=72)
+    assert image_sizes(images) == [(596, 842)]*3
+    return
+
+@pytest.mark.skipif(not convert.JPEG_SUPPORTED, reason='jpeg needs a newer PyMuPDF')
+def test_convert_pdf_02_jpg():
+    small, large = [convert.convert_pdf(test_files_dir+'pdf_1.pdf', ['1'], image_format='jpg', quality=quality)[0]
+                    for quality in (10, 95)]
+    assert small[:2] == large[:2] == b'\xff\xd8'
+    assert len(small) < len(large)
+    return
+
+def test_convert_pdf_03_raise():
+    for kwargs in ({'pages': ['4']}, {'dpi': 72, 'size': 100}, {'image_format': 'gif'}):
+        with pytest.raises(ValueError):
+            convert.convert_pdf(test_files_dir+'pdf_1.pdf', **kwargs)
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+@pytest.mark.parametrize('pages, jobs', [(['1-3', '20'], 2), (['7'], 3)])
+def test_convert_01_jobs(tmp_path, pages, jobs):
+    # the same images whether rendered by workers (one page is cut into
+    # bands) or here
+    parser = set_args()
+    argv = ['convert', test_files_dir+'pdf_5_bigboy.pdf'] + pages + ['-n', '{stem}_{range}', '--dpi', '50']
+    paths = convert.convert(parser.parse_args(argv + ['-o', str(tmp_path/'one')]))
+    job_paths = convert.convert(parser.parse_args(argv + ['-o', str(tmp_path/'jobs'), '-j', str(jobs)]))
+    assert [os.path.basename(path) for path in job_paths] == \
+        ['pdf_5_bigboy_{}.png'.format(page) for page in (pages if jobs == 3 else [1, 2, 3, 20])]
+    for path, job_path in zip(paths, job_paths):
+        assert fitz.Pixmap(path).samples == fitz.Pixmap(job_path).samples
+    return
+
+def test_convert_02_written_as_rendered(tmp_path, monkeypatch):
+    # each image is in place as soon as it is written, not once every page
+    # has been rendered
+    seen = []
+    render_page = convert.render_page
+    def listing_render_page(*args, **kwargs):
+        seen.append(sorted(name for name in os.listdir(tmp_path) if not name.startswith('.')))
+        return render_page(*args, **kwargs)
+    monkeypatch.setattr(convert, 'render_page', listing_render_page)
+    argv = ['convert', test_files_dir+'pdf_1.pdf', '-n', '{range}', '--dpi', '20', '-o', str(tmp_path)]
+    convert.convert(set_args().parse_args(argv))
+    assert seen == [[], ['1.png'], ['1.png', '2.png']]
+    assert sorted(os.listdir(tmp_path)) == ['1.png', '2.png', '3.png']
+    return
@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import pytest
+from poc.doccache import DocumentCache
+
+test_files_dir = 'tests/test_files/'
+
+#-----------------------------------
+# DocumentCache
+#-----------------------------------
+
+def test_document_cache_01_hits():
+    cache = DocumentCache()
+    doc = cache.get(test_files_dir+'pdf_1.pdf')
+    assert cache.get(test_files_dir+'pdf_1.pdf') is doc
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    assert doc.is_closed
+
+    doc = cache.get(test_files_dir+'pdf_1.pdf')
+    cache.discard(test_files_dir+'pdf_2.pdf')
+    cache.discard(os.path.abspath(test_files_dir+'pdf_1.pdf'))
+    assert doc.is_closed and len(cache) == 0 and cache.total_bytes == 0
+    return
+
+def test_document_cache_02_evicts_least_recently_used():
+    cache = DocumentCache(max_docs=2)
+    doc_1 = cache.get(test_files_dir+'pdf_1.pdf')
+    doc_2 = cache.get(test_files_dir+'pdf_2.pdf')
+    cache.get(test_files_dir+'pdf_1.pdf')
+    cache.get(test_files_dir+'pdf_3.pdf')
+    assert len(cache) == 2
+    assert doc_2.is_closed and not doc_1.is_closed
+    cache.close()
+    return
+
+def test_document_cache_03_changed_file(tmp_path):
+    path = str(tmp_path/'src.pdf')
+    shutil.copy(test_files_dir+'pdf_1.pdf', path)
+    cache = DocumentCache()
+    doc = cache.get(path)
+    assert len(doc) == 3
+
+    shutil.copy(test_files_dir+'pdf_5_bigboy.pdf', path)
+    assert len(cache.get(path)) == 20
+    assert cache.misses == 2
+    cache.close()
+    return
+
+def test_document_cache_04_byte_budget():
+    sizes = [os.path.getsize(test_files_dir+name) for name in ['pdf_1.pdf', 'pdf_2.pdf', 'pdf_5_bigboy.pdf']]
+    cache = DocumentCache(max_bytes=sizes[0]+sizes[1])
+    cache.get(test_files_dir+'pdf_1.pdf')
+    cache.get(test_files_dir+'pdf_2.pdf')
+    assert len(cache) == 2
+
+    # the big pdf is over budget by itself, so it is kept on its own
+    cache.get(test_files_dir+'pdf_5_bigboy.pdf')
+    assert cache.stats() == {'docs': 1, 'bytes': sizes[2], 'hits': 0, 'misses': 3, 'evictions': 2}
+    cache.close()
+    assert cache.stats()['bytes'] == 0
+    return
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import types
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import pytest
+from poc.helpers import set_args
+import poc.extract as extract
+
+test_files_dir = 'tests/test_files/'
+
+#-----------------------------------
+# extract_pages
+#-----------------------------------
+
+def test_extract_pages_01():
+    records = extract.extract_pages(test_files_dir+'pdf_5_bigboy.pdf', ['2', 'last'])
+    assert isinstance(records, types.GeneratorType)
+    records = list(records)
+    assert [record['page'] for record in records] == [2, 20]
+    assert 'page 2' in records[0]['text'] and 'page 20' in records[1]['text']
+
+    with open(test_files_dir+'pdf_1.pdf', 'rb') as f:
+        words = list(extract.extract_pages(f.read(), ['1'], mode='words'))[0]['words']
+    assert [word[4] for word in words[:4]] == ['PDF', 'file', '1', 'page']
+    return
+
+def test_extract_pages_02_jobs(monkeypatch):
+    # workers are given two pages at a time, and only two batches ahead,
+    # yet the records come back in page order
+    monkeypatch.setattr(extract, 'BATCH_PAGES', 2)
+    monkeypatch.setattr(extract, 'BATCHES_AHEAD', 1)
+    pages = ['odd', '2-6']
+    expected = list(extract.extract_pages(test_files_dir+'pdf_5_bigboy.pdf', pages, mode='blocks'))
+    records = list(extract.extract_pages(test_files_dir+'pdf_5_bigboy.pdf', pages, mode='blocks', jobs=2))
+    assert [record['page'] for record in records] == [1, 2, 3, 4, 5, 6, 7, 9, 11, 13, 15, 17, 19]
+    assert records == expected
+    return
+
+def test_extract_pages_03_raise():
+    for kwargs in ({'pages': ['4']}, {'mode': 'html'}):
+        with pytest.raises(ValueError):
+            list(extract.extract_pages(test_files_dir+'pdf_1.pdf', **kwargs))
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_extract_01(tmp_path, capsys):
+    parser = set_args()
+    out_path = str(tmp_path/'pages.jsonl')
+    assert extract.extract(parser.parse_args(['extract', test_files_dir+'pdf_2.pdf', '--output', out_path])) == out_path
+    with open(out_path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['page'], 'PDF file 2' in record['text']) for record in records] == [(1, True), (2, True), (3, True)]
+
+    # to stdout
+    extract.extract(parser.parse_args(['extract', test_files_dir+'pdf_2.pdf', 'last', '-m', 'words']))
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1 and json.loads(lines[0])['page'] == 3
+
+    # a bad page selection fails before the output is opened
+    with pytest.raises(ValueError):
+        extract.extract(parser.parse_args(['extract', test_files_dir+'pdf_2.pdf', '9', '--output',
+                                           str(tmp_path/'bad.jsonl')]))
+    assert not os.path.exists(str(tmp_path/'bad.jsonl'))
+    return
@@ -1,70 +1,124 @@
-
-# run from POC directory
-
-import os
-import sys 
-import pytest
-sys.path.insert(0, os.path.dirname(sys.path[0]))
-# from poc.helpers import check_filepath
-import poc.helpers as poc_helpers
-
-#-----------------------------------
-# check_filepath
-#-----------------------------------
-
-test_files_dir = 'tests/test_files/'
-
-def test_check_filepath_01_true():
-    true_filepaths = [test_files_dir+fpath for fpath in os.listdir(test_files_dir)]
-    for true_path in true_filepaths:
-        assert poc_helpers.check_filepath(true_path) == True
-    return
-
-def test_check_filepath_02_false():
-    false_filepaths = [test_files_dir+fpath for fpath in ['pdf_5.pdf', 'pdf_6.pdf', 'does_not_exist.txt']]
-    for false_path in false_filepaths:
-        with pytest.raises(FileNotFoundError):
-            poc_helpers.check_filepath(false_path)
-    return
-
-def test_check_filepath_03_pdf():
-    fpaths = [test_files_dir+fpath for fpath in ['pdf_1.pdf', 'pdf_2.pdf', 'pdf_3.pdf', 'pdf_4.pdf']]
-    for true_path in fpaths:
-         assert poc_helpers.check_filepath(true_path, 'pdf') == True
-    return
-
-def test_check_filepath_04_not_pdf():
-    fpaths = [test_files_dir+fpath for fpath in ['pdf_1.docx', 'random.txt']] 
-    for path in fpaths:
-        with pytest.raises(Exception):
-            poc_helpers.check_filepath(path, 'pdf')
-    return
-
-#-----------------------------------
-# check_page_format
-#-----------------------------------
-
-def test_check_page_format_01_true():
-    page_inputs = ['2', '3', '4', '12', '3-5', '2-12', '23-45', '02', '03-13']
-    for p in page_inputs:
-        assert poc_helpers.check_page_format(p) 
-    return
-
-def test_check_page_format_02_raise():
-    page_inputs = ['0', '12-12', '10-2', '4-4']
-    for p in page_inputs:
-        with pytest.raises(ValueError):
-            poc_helpers.check_page_format(p)
-    return
-
-def test_check_page_format_03_raise():
-    page_inputs = ['asd', '20ds', 'ad--2', '', '12-14-16']
-    for p in page_inputs:
-        with pytest.raises(ValueError):
-            poc_helpers.check_page_format(p)
-    return
-
-#-----------------------------------
-# 
-#-----------------------------------
-
+
+# run from POC directory
+
+import io
+import os
+import sys 
+import pytest
+import argparse
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+# from poc.helpers import check_filepath
+import poc.helpers as poc_helpers
+
+#-----------------------------------
+# check_filepath
+#-----------------------------------
+
+test_files_dir = 'tests/test_files/'
+
+def test_check_filepath_01_true():
+    true_filepaths = [test_files_dir+fpath for fpath in os.listdir(test_files_dir)]
+    for true_path in true_filepaths:
+        assert poc_helpers.check_filepath(true_path) == True
+    return
+
+def test_check_filepath_02_false():
+    false_filepaths = [test_files_dir+fpath for fpath in ['pdf_5.pdf', 'pdf_6.pdf', 'does_not_exist.txt']]
+    for false_path in false_filepaths:
+        with pytest.raises(FileNotFoundError):
+            poc_helpers.check_filepath(false_path)
+    return
+
+def test_check_filepath_03_pdf():
+    fpaths = [test_files_dir+fpath for fpath in ['pdf_1.pdf', 'pdf_2.pdf', 'pdf_3.pdf', 'pdf_4.pdf']]
+    for true_path in fpaths:
+         assert poc_helpers.check_filepath(true_path, 'pdf') == True
+    return
+
+def test_check_filepath_04_not_pdf():
+    fpaths = [test_files_dir+fpath for fpath in ['pdf_1.docx', 'random.txt']] 
+    for path in fpaths:
+        with pytest.raises(Exception):
+            poc_helpers.check_filepath(path, 'pdf')
+    return
+
+#-----------------------------------
+# check_page_format
+#-----------------------------------
+
+def test_check_page_format_01_true():
+    page_inputs = ['2', '3', '4', '12', '3-5', '2-12', '23-45', '02', '03-13']
+    for p in page_inputs:
+        assert poc_helpers.check_page_format(p) 
+    return
+
+def test_check_page_format_02_raise():
+    page_inputs = ['0', '12-12', '10-2', '4-4']
+    for p in page_inputs:
+        with pytest.raises(ValueError):
+            poc_helpers.check_page_format(p)
+    return
+
+def test_check_page_format_03_raise():
+    page_inputs = ['asd', '20ds', 'ad--2', '', '12-14-16']
+    for p in page_inputs:
+        with pytest.raises(ValueError):
+            poc_helpers.check_page_format(p)
+    return
+
+#-----------------------------------
+# positive_int
+#-----------------------------------
+
+def test_positive_int_01_true():
+    for value, expected in [('1', 1), ('4', 4), ('016', 16)]:
+        assert poc_helpers.positive_int(value) == expected
+    return
+
+def test_positive_int_02_raise():
+    for value in ['0', '-2', '1.5', 'two', '']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            poc_helpers.positive_int(value)
+    return
+
+#-----------------------------------
+# read_path_list
+#-----------------------------------
+
+def test_read_path_list_01(tmp_path):
+    list_path = tmp_path/'paths.txt'
+    list_path.write_text('one.pdf\n  two.pdf \n\nthree.pdf')
+    assert poc_helpers.read_path_list(str(list_path)) == ['one.pdf', 'two.pdf', 'three.pdf']
+    return
+
+def test_read_path_list_02_stdin(monkeypatch):
+    monkeypatch.setattr('sys.stdin', io.StringIO('one.pdf\ntwo.pdf\n'))
+    assert poc_helpers.read_path_list('-') == ['one.pdf', 'two.pdf']
+    return
+
+def test_read_path_list_03_raise():
+    with pytest.raises(argparse.ArgumentTypeError):
+        poc_helpers.read_path_list(test_files_dir+'does_not_exist.txt')
+    return
+
+#-----------------------------------
+# check_arguments
+#-----------------------------------
+
+@pytest.mark.parametrize('argv', [['merge', 'tests/test_files/pdf_1.pdf'],
+                                  ['--profile', 'merge', 'tests/test_files/pdf_1.pdf'],
+                                  ['--cache-key', 'stat', 'merge', 'tests/test_files/pdf_1.pdf']])
+def test_check_arguments_01_min_args(argv):
+    # the options given before the command are not counted as its arguments
+    cl_args = poc_helpers.set_args().parse_args(argv)
+    with pytest.raises(Exception, match='at least 2 arguments'):
+        poc_helpers.check_arguments('merge', poc_helpers.get_command_controls('merge'), cl_args)
+    cl_args = poc_helpers.set_args().parse_args(argv + ['tests/test_files/pdf_2.pdf'])
+    assert cl_args.command_argv == ['tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf']
+    poc_helpers.check_arguments('merge', poc_helpers.get_command_controls('merge'), cl_args)
+    return
+
+#-----------------------------------
+# 
+#-----------------------------------
+
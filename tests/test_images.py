@@ -0,0 +1,171 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.images as images
+import poc.commands as commands
+
+def image_pdf(path=None):
+    """
+    A pdf with an RGB image drawn at 480 dpi on page 1 and at 240 dpi on
+    page 2, a CMYK image drawn at 480 dpi and, where jpeg is supported, a
+    jpeg drawn at 180 dpi, both on page 1.
+    """
+    width, height = 480, 360
+    samples = bytes(value for y in range(height) for x in range(width)
+                    for value in (x*255//width, y*255//height, (x ^ y) & 255))
+    rgb = fitz.Pixmap(fitz.csRGB, width, height, samples, False)
+    cmyk = fitz.Pixmap(fitz.csCMYK, width, height, bytes(4*width*height), False)
+
+    pdf = fitz.open()
+    page = pdf.new_page()
+    page.insert_image(fitz.Rect(72, 72, 144, 126), pixmap=rgb)
+    page.insert_image(fitz.Rect(72, 200, 144, 254), pixmap=cmyk)
+    if images.JPEG_SUPPORTED:
+        jpeg = fitz.Pixmap(rgb, 300, 225, None).tobytes('jpg', jpg_quality=95)
+        page.insert_image(fitz.Rect(72, 400, 192, 490), stream=jpeg)
+    page.insert_text((72, 600), 'kept as it is')
+    page = pdf.new_page()
+    page.insert_image(fitz.Rect(72, 72, 216, 180), pixmap=rgb)
+    if path:
+        pdf.save(path)
+        pdf.close()
+        return path
+    return pdf
+
+def image_streams(pdf):
+    return {xref: (pdf.xref_get_key(xref, 'Width')[1], pdf.xref_stream_raw(xref))
+            for page in pdf for xref, *_ in page.get_images()}
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    images.clear_cache()
+    yield
+    images.clear_cache()
+
+#-----------------------------------
+# optimize_images
+#-----------------------------------
+
+def test_optimize_images_01():
+    with image_pdf() as pdf:
+        before = image_streams(pdf)
+        stats = images.optimize_images(pdf, dpi=150)
+        after = image_streams(pdf)
+        assert stats['images'] == len(before) == (3 if images.JPEG_SUPPORTED else 2)
+        assert (stats['downsampled'], stats['cached']) == (1, 0)
+        assert set(stats['seconds']) == {'scan', 'encode', 'update'}
+
+        # the RGB image is downsampled for its larger drawing, on page 2
+        rgb_xref = pdf[1].get_images()[0][0]
+        assert after[rgb_xref][0] == '300'
+        assert pdf.xref_get_key(rgb_xref, 'Height') == ('int', '225')
+        assert stats['bytes_before'] == len(before[rgb_xref][1]) > stats['bytes_after'] == len(after[rgb_xref][1])
+        pixmap = fitz.Pixmap(pdf, rgb_xref)
+        assert (pixmap.width, pixmap.height, pixmap.n) == (300, 225, 3)
+
+        # the CMYK image, and the jpeg at less than 1.5 times 150 dpi, are
+        # left as they are
+        assert {xref: stream for xref, stream in after.items() if xref != rgb_xref} == \
+            {xref: stream for xref, stream in before.items() if xref != rgb_xref}
+        assert pdf[0].get_text().strip() == 'kept as it is'
+    return
+
+@pytest.mark.skipif(not images.JPEG_SUPPORTED, reason='jpeg needs a newer PyMuPDF')
+def test_optimize_images_02_jpeg():
+    with image_pdf() as pdf:
+        jpeg_xref = pdf[0].get_images()[2][0]
+        stats = images.optimize_images(pdf, dpi=100, quality=50)
+        assert stats['downsampled'] == 2
+        assert pdf.xref_get_key(jpeg_xref, 'Filter') == ('name', '/DCTDecode')
+        assert pdf.xref_get_key(jpeg_xref, 'Width') == ('int', '167')
+        assert pdf.xref_stream_raw(jpeg_xref)[:2] == b'\xff\xd8'
+    return
+
+def test_optimize_images_03_cache():
+    with image_pdf() as pdf, image_pdf() as again:
+        images.optimize_images(pdf)
+        stats = images.optimize_images(again)
+        assert (stats['downsampled'], stats['cached']) == (1, 1)
+        assert image_streams(again) == image_streams(pdf)
+
+        # not the same result for another resolution
+        with image_pdf() as other:
+            assert images.optimize_images(other, dpi=100)['cached'] == 0
+    return
+
+def test_optimize_images_04_jobs():
+    # at 100 dpi the jpeg is downsampled too, so there is more than one
+    # image to share out, each of which has two copies
+    with image_pdf() as pdf, image_pdf() as jobs_pdf:
+        for f in (pdf, jobs_pdf):
+            f.insert_pdf(image_pdf())
+        images.optimize_images(pdf, dpi=100)
+        images.clear_cache()
+        stats = images.optimize_images(jobs_pdf, dpi=100, jobs=2)
+        assert stats['downsampled'] == (4 if images.JPEG_SUPPORTED else 2)
+        assert stats['cached'] == stats['downsampled']/2
+        assert image_streams(jobs_pdf) == image_streams(pdf)
+    return
+
+def test_optimized_images_01():
+    assert images.optimization_requested() is None
+    with images.optimized_images(100, 60, 2):
+        assert images.optimization_requested() == {'dpi': 100, 'quality': 60, 'jobs': 2}
+        with images.optimized_images():
+            assert images.optimization_requested() is None
+        assert images.optimization_requested()['dpi'] == 100
+    assert images.optimization_requested() is None
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_optimize_01(tmp_path, capsys):
+    src_pdf = image_pdf(str(tmp_path/'images.pdf'))
+    with fitz.open(src_pdf) as f:
+        f.set_toc([[1, 'first', 1], [1, 'second', 2]])
+        f.saveIncr()
+    out_pdf = commands.optimize(set_args().parse_args(['optimize', src_pdf, '-o', str(tmp_path/'out'), '-j', '2']))
+    # the RGB image of 480 x 360 pixels is the one downsampled
+    assert os.path.getsize(out_pdf) < os.path.getsize(src_pdf) - 300*1024
+    with fitz.open(src_pdf) as src, fitz.open(out_pdf) as f:
+        assert f.page_count == 2
+        assert f.get_toc() == src.get_toc()
+        assert f[0].get_text() == src[0].get_text()
+        assert [fitz.Pixmap(f, xref).width for xref, *_ in f[1].get_images()] == [300]
+
+    # the command line reports the images optimized, the Python API does 
+    # not
+    assert 'images: downsampled 1 of 3 images' in capsys.readouterr().err
+    commands.optimize_pdf(src_pdf)
+    commands.merge(set_args().parse_args(['merge', src_pdf, src_pdf, '-o', str(tmp_path/'out'), '--optimize']))
+    assert capsys.readouterr().err == ''
+    return
+
+def test_optimize_02_flag(tmp_path):
+    src_pdf = image_pdf(str(tmp_path/'images.pdf'))
+    parser = set_args()
+    out = ['-o', str(tmp_path/'out'), '--optimize', '100']
+    outputs = [commands.merge(parser.parse_args(['merge', src_pdf, src_pdf] + out)),
+               *commands.split(parser.parse_args(['split', src_pdf, '1-2', '2', '-j', '2'] + out)),
+               # not saved as an incremental update, which would keep the
+               # old images
+               commands.remove(parser.parse_args(['remove', src_pdf, '1', '--save-profile', 'fast'] + out))]
+    # each ends with page 2, drawing the RGB image at 240 dpi
+    for out_pdf in outputs:
+        with fitz.open(out_pdf) as f:
+            assert {fitz.Pixmap(f, xref).width for xref, *_ in f[-1].get_images()} == {200}
+
+    plain_pdf = commands.insert(parser.parse_args(['insert', src_pdf, src_pdf, '1', '-o', str(tmp_path/'plain')]))
+    out_pdf = commands.insert(parser.parse_args(['insert', src_pdf, src_pdf, '1', '--image-quality', '50'] + out))
+    # two copies of the RGB image of 480 x 360 pixels
+    assert os.path.getsize(out_pdf) < os.path.getsize(plain_pdf) - 600*1024
+
+    for argv in (['merge', src_pdf, src_pdf, '-c', '1'], ['remove', src_pdf, '1', '--large']):
+        with pytest.raises(ValueError):
+            getattr(commands, argv[0])(parser.parse_args(argv + out))
+    return
@@ -0,0 +1,123 @@
+import io
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.commands as commands
+import poc.instrument as instrument
+
+@pytest.fixture
+def records():
+    records = []
+    hook = instrument.add_hook(records.append)
+    yield records
+    instrument.remove_hook(hook)
+
+#-----------------------------------
+# command_trace
+#-----------------------------------
+
+def test_command_trace_01_merge(records, monkeypatch):
+    sources_opened = []
+    fitz_open = fitz.open
+    def counting_open(*args, **kwargs):
+        if args or 'stream' in kwargs:
+            sources_opened.append(args or kwargs)
+        return fitz_open(*args, **kwargs)
+    monkeypatch.setattr(fitz, 'open', counting_open)
+
+    argv = ['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf']
+    with instrument.command_trace('merge', argv):
+        outfile = commands.merge(set_args().parse_args(argv))
+    os.remove(outfile)
+
+    assert len(records) == 1
+    record = records[0]
+    assert record['command'] == 'merge' and record['argv'] == argv
+    assert record['status'] == 'ok'
+    # the pdfs are read ahead of the merge, which waits on the reads
+    assert set(record['phases']) == {'check', 'read_wait', 'open', 'insert_pdf', 'save'}
+    assert record['counters']['read_ahead_bytes'] == sum(os.path.getsize(path) for path in argv[1:])
+    # the pdfs opened to check them are used to run the command, from the
+    # memory they were read into, so each is opened once
+    assert record['phases']['check']['calls'] == record['phases']['open']['calls'] == 2
+    assert len(sources_opened) == 2 and all('stream' in kwargs for kwargs in sources_opened)
+    assert sum(phase['seconds'] for phase in record['phases'].values()) <= record['seconds']
+    assert record['counters']['pages_read'] == record['counters']['pages_written'] == 6
+    assert record['counters']['bytes_read'] == sum(os.path.getsize(path) for path in argv[1:])
+    assert record['counters']['bytes_written'] > 0
+    assert record['peak_rss'] > 0
+    json.dumps(record)
+    return
+
+def test_command_trace_02_error(records):
+    argv = ['remove', 'tests/test_files/pdf_5_bigboy.pdf', '21-23']
+    with pytest.raises(ValueError):
+        with instrument.command_trace('remove', argv):
+            commands.remove(set_args().parse_args(argv))
+    assert records[0]['status'] == 'error'
+    assert records[0]['error'].startswith('ValueError')
+    return
+
+def test_command_trace_03_nested(records):
+    with instrument.command_trace('batch'):
+        with instrument.phase('read'):
+            pass
+        with instrument.command_trace('split'):
+            with instrument.phase('save'):
+                pass
+            instrument.count('pages_written', 3)
+        instrument.count('jobs')
+
+    split_record, batch_record = records
+    assert split_record['command'] == 'split' and batch_record['command'] == 'batch'
+    assert list(split_record['phases']) == ['save'] and split_record['counters'] == {'pages_written': 3}
+    assert list(batch_record['phases']) == ['read'] and batch_record['counters'] == {'jobs': 1}
+    return
+
+def test_command_trace_04_no_hooks():
+    # nothing is recorded while there are no hooks
+    assert not instrument.tracing()
+    with instrument.command_trace('merge') as record:
+        assert record is None
+        assert instrument.phase('save') is instrument.phase('open')
+        instrument.count('pages_read', 5)
+    return
+
+#-----------------------------------
+# hooks
+#-----------------------------------
+
+def test_json_lines_hook_01(tmp_path):
+    path = str(tmp_path/'trace.jsonl')
+    hook = instrument.add_hook(instrument.json_lines_hook(path))
+    try:
+        for command in ('merge', 'split'):
+            with instrument.command_trace(command):
+                with instrument.phase('save'):
+                    pass
+    finally:
+        instrument.remove_hook(hook)
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['command'] for line in lines] == ['merge', 'split']
+    assert lines[0]['phases']['save']['calls'] == 1
+    return
+
+def test_print_profile_01():
+    record = {'command': 'split', 'status': 'ok', 'seconds': 2.0, 'peak_rss': 50*1024*1024,
+              'phases': {'open': {'seconds': 0.5, 'calls': 1}, 'save': {'seconds': 1.0, 'calls': 4}},
+              'counters': {'pages_written': 20}}
+    out = io.StringIO()
+    instrument.print_profile(record, out)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == 'split: ok in 2.000 s, peak rss 50.0 MB'
+    assert lines[1].split() == ['save', '4', 'calls', '1.000', 's', '50.0%']
+    assert lines[2].split() == ['open', '1', 'calls', '0.500', 's', '25.0%']
+    assert lines[3].split() == ['(other)', '0.500', 's', '25.0%']
+    assert lines[4].split() == ['pages_written', '20']
+    return
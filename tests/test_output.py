@@ -0,0 +1,131 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from poc.helpers import set_args
+import poc.output as output
+import poc.commands as commands
+
+#-----------------------------------
+# format_name
+#-----------------------------------
+
+def test_format_name_01():
+    assert output.format_name('{stem}_{range}_{seq}', 'in/report.pdf', '1-3', 2) == 'report_1-3_2.pdf'
+    assert output.format_name('{command}-{stem}.PDF', 'report.pdf', command='merge') == 'merge-report.PDF'
+    # the names poc has always used
+    assert len(output.format_name()) == len('142501_05032021.pdf')
+    assert output.format_name(page_range='5-7').endswith('_page_5-7.pdf')
+    assert output.format_name('{stem}_{range}', 'report.pdf', '4', extension='.png') == 'report_4.png'
+    return
+
+def test_format_name_02_raise():
+    for template in ('{stem}_{pages}', '{0}', '{stem}/{range}'):
+        with pytest.raises(ValueError):
+            output.format_name(template, 'report.pdf', '1-3')
+    return
+
+#-----------------------------------
+# reserve_path
+#-----------------------------------
+
+def test_reserve_path_01(tmp_path):
+    paths = [output.reserve_path(str(tmp_path), 'out.pdf') for _ in range(3)]
+    assert [os.path.basename(path) for path in paths] == ['out.pdf', 'out_2.pdf', 'out_3.pdf']
+    return
+
+def test_reserve_path_02_concurrent(tmp_path):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(lambda _: output.reserve_path(str(tmp_path), 'out.pdf'), range(50)))
+    assert len(set(paths)) == 50
+    return
+
+def test_reserve_path_03_placeholder(tmp_path):
+    # nothing is made under the output's name until it is committed, and
+    # names taken by finished outputs or left over placeholders are passed
+    (tmp_path/'out.pdf').write_bytes(b'done')
+    (tmp_path/'.out_2.pdf.reserved').write_bytes(b'')
+    path = output.reserve_path(str(tmp_path), 'out.pdf')
+    assert os.path.basename(path) == 'out_3.pdf' and not os.path.exists(path)
+
+    temp = output.temp_path(path)
+    output.commit(temp, path)
+    assert sorted(os.listdir(str(tmp_path))) == ['.out_2.pdf.reserved', 'out.pdf', 'out_3.pdf']
+    return
+
+#-----------------------------------
+# atomic_outputs
+#-----------------------------------
+
+def write_output(tmp_path, name, contents):
+    path = output.reserve_path(str(tmp_path), name)
+    temp = output.temp_path(path)
+    with open(temp, 'w') as f:
+        f.write(contents)
+    output.commit(temp, path)
+    return path
+
+def test_atomic_outputs_01(tmp_path):
+    with output.atomic_outputs(fsync=True):
+        path = write_output(tmp_path, 'a.pdf', 'done')
+        # reserved, but not yet written
+        assert not os.path.exists(path) and os.path.exists(output.placeholder_path(path))
+    with open(path) as f:
+        assert f.read() == 'done'
+    assert os.listdir(str(tmp_path)) == ['a.pdf']
+    return
+
+def test_atomic_outputs_02_error(tmp_path):
+    with pytest.raises(RuntimeError):
+        with output.atomic_outputs():
+            write_output(tmp_path, 'a.pdf', 'done')
+            output.reserve_path(str(tmp_path), 'b.pdf')
+            raise RuntimeError('crash')
+    assert os.listdir(str(tmp_path)) == []
+    return
+
+#-----------------------------------
+# commands
+#-----------------------------------
+
+def test_commands_01_same_second(tmp_path):
+    # outputs in the same second no longer write over each other
+    parser = set_args()
+    args = parser.parse_args(['merge', 'tests/test_files/pdf_1.pdf', 'tests/test_files/pdf_2.pdf',
+                              '-o', str(tmp_path)])
+    outfiles = {commands.merge(args) for _ in range(3)}
+    assert len(outfiles) == 3
+    for outfile in outfiles:
+        with fitz.open(outfile) as f:
+            assert len(f) == 6
+    return
+
+def test_commands_02_template(tmp_path):
+    parser = set_args()
+    args = parser.parse_args(['split', 'tests/test_files/pdf_5_bigboy.pdf', '2', '5-8', '-j', '2',
+                              '-o', str(tmp_path/'parts'), '-n', '{stem}_{range}_{seq}', '--fsync'])
+    output_paths = commands.split(args)
+    assert [os.path.basename(path) for path in output_paths] == ['pdf_5_bigboy_2_1.pdf', 'pdf_5_bigboy_5-8_2.pdf']
+    assert sorted(os.listdir(str(tmp_path/'parts'))) == sorted(os.path.basename(path) for path in output_paths)
+
+    output_paths = commands.split(args)
+    assert [os.path.basename(path) for path in output_paths] == ['pdf_5_bigboy_2_1_2.pdf', 'pdf_5_bigboy_5-8_2_2.pdf']
+    return
+
+@pytest.mark.parametrize('save_profile', ['fast', 'compact'])
+def test_commands_03_error(tmp_path, save_profile):
+    # a failed command leaves nothing behind
+    parser = set_args()
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '21-23', '-o', str(tmp_path),
+                              '--save-profile', save_profile])
+    with pytest.raises(ValueError):
+        commands.remove(args)
+    assert os.listdir(str(tmp_path)) == []
+
+    args = parser.parse_args(['remove', 'tests/test_files/pdf_5_bigboy.pdf', '1-3', '-o', str(tmp_path),
+                              '--save-profile', save_profile])
+    outfile = commands.remove(args)
+    assert os.listdir(str(tmp_path)) == [os.path.basename(outfile)]
+    return
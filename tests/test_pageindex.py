@@ -0,0 +1,153 @@
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.pageindex as pageindex
+import poc.commands as commands
+import poc.instrument as instrument
+
+test_files_dir = 'tests/test_files/'
+
+@pytest.fixture
+def src_pdf(tmp_path):
+    # a copy, so that the index is written next to it rather than among the
+    # test files
+    path = str(tmp_path/'bigboy.pdf')
+    shutil.copyfile(test_files_dir+'pdf_5_bigboy.pdf', path)
+    pageindex.clear_cache()
+    yield path
+    pageindex.clear_cache()
+
+@pytest.fixture
+def records():
+    records = []
+    hook = instrument.add_hook(records.append)
+    yield records
+    instrument.remove_hook(hook)
+
+def nested_pdf(path):
+    """
+    A pdf of 4 pages, with pages 3 and 4 under a node of their own, which
+    they inherit their size and rotation from.
+    """
+    with fitz.open() as pdf:
+        for n in range(4):
+            pdf.new_page(width=200, height=300).insert_text((20, 50), 'page {}'.format(n+1))
+        root_xref = pageindex.page_tree_root(pdf)
+        page_xrefs = [pdf.page_xref(i) for i in range(4)]
+        node_xref = pdf.get_new_xref()
+        pdf.update_object(node_xref, '<</Type/Pages/Parent {} 0 R/Kids[{} 0 R {} 0 R]/Count 2/Rotate 90'
+                          '/MediaBox[0 0 300 400]>>'.format(root_xref, *page_xrefs[2:]))
+        for xref in page_xrefs[2:]:
+            pdf.xref_set_key(xref, 'Parent', '{} 0 R'.format(node_xref))
+            pdf.xref_set_key(xref, 'MediaBox', 'null')
+            pdf.xref_set_key(xref, 'Rotate', 'null')
+        pdf.xref_set_key(root_xref, 'Kids', '[{} 0 R {} 0 R {} 0 R]'.format(*page_xrefs[:2], node_xref))
+        pdf.save(path)
+    return path
+
+def page_texts(pdf_path):
+    with fitz.open(pdf_path) as f:
+        return [page.get_text() for page in f]
+
+#-----------------------------------
+# build_index, load_index
+#-----------------------------------
+
+def test_build_index_01(src_pdf):
+    page_index = pageindex.build_index(src_pdf)
+    assert os.path.exists(src_pdf + '.pocidx')
+    with fitz.open(src_pdf) as f:
+        assert page_index.page_xrefs == [f.page_xref(i) for i in range(f.page_count)]
+        for page, xrefs in zip(f, page_index.dependencies):
+            # its contents, and no other page
+            assert set(page.get_contents()) <= set(xrefs)
+            assert not set(xrefs) & set(page_index.page_xrefs)
+            assert all(xref in page_index.digests for xref in page.get_contents())
+
+    loaded = pageindex.load_index(src_pdf)
+    assert loaded.page_count == 20 and loaded.page_xrefs == page_index.page_xrefs
+    # the objects are read when first used
+    assert loaded.dependencies == page_index.dependencies and loaded.digests == page_index.digests
+    assert loaded.objects_of([1]) == {page_index.page_xrefs[0]} | set(page_index.dependencies[0])
+    return
+
+def test_build_index_02_nested(tmp_path):
+    src_pdf = nested_pdf(str(tmp_path/'nested.pdf'))
+    page_index = pageindex.build_index(src_pdf)
+    assert list(page_index.inherited.values()) == [{'MediaBox': '[0 0 300 400]', 'Rotate': '90'}]*2
+
+    with fitz.open() as pdf:
+        pdf.new_page()
+        pdf.save(str(tmp_path/'encrypted.pdf'), encryption=fitz.PDF_ENCRYPT_AES_256, user_pw='pw', owner_pw='pw')
+    # fitz cannot save a pdf of no pages
+    with open(str(tmp_path/'empty.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.4\n1 0 obj <</Type/Catalog/Pages 2 0 R>> endobj\n'
+                b'2 0 obj <</Type/Pages/Kids[]/Count 0>> endobj\ntrailer <</Root 1 0 R>>\n%%EOF\n')
+    for name in ('encrypted.pdf', 'empty.pdf', 'missing.pdf'):
+        with pytest.raises((ValueError, OSError)):
+            pageindex.build_index(str(tmp_path/name))
+        assert not os.path.exists(str(tmp_path/name) + '.pocidx')
+    return
+
+def test_load_index_01_stale(src_pdf, records):
+    assert pageindex.load_index(src_pdf) is None
+    pageindex.build_index(src_pdf)
+    with instrument.command_trace('split'):
+        assert pageindex.load_index(src_pdf) is not None
+
+        # the same size and modification time, but changed at the end
+        stat = os.stat(src_pdf)
+        with open(src_pdf, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'%%')
+        os.utime(src_pdf, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert pageindex.load_index(src_pdf) is None
+    assert records[0]['counters']['index_hits'] == records[0]['counters']['index_stale'] == 1
+
+    # nor is an index of another version read
+    with open(src_pdf + '.pocidx', 'w') as f:
+        f.write('{"version": 0}\n')
+    assert pageindex.load_index(src_pdf) is None
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_index_01(src_pdf, tmp_path, records):
+    parser = set_args()
+    nested = nested_pdf(str(tmp_path/'nested.pdf'))
+    out = ['-o', str(tmp_path/'out')]
+    argvs = [['split', src_pdf, '2-4', '7', '10-'], ['split', src_pdf, '--every', '6'], ['split', nested, '3', '1-2'],
+             ['remove', src_pdf, '3-5', '12', '--large'], ['remove', nested, '2', '--large'],
+             ['insert', src_pdf, test_files_dir+'pdf_1.pdf', '5', '--large'],
+             ['insert', nested, test_files_dir+'pdf_1.pdf', '1', '--large']]
+    outputs = {}
+    for indexed in (False, True):
+        if indexed:
+            index_paths = pageindex.index(parser.parse_args(['index', src_pdf, nested]))
+            assert index_paths == (src_pdf + '.pocidx', nested + '.pocidx')
+        outputs[indexed] = []
+        for argv in argvs:
+            with instrument.command_trace(argv[0], argv):
+                result = getattr(commands, argv[0])(parser.parse_args(argv + out))
+            outputs[indexed].extend(result if isinstance(result, tuple) else [result])
+
+    # the same pages, with or without the index
+    assert len(outputs[True]) == len(outputs[False]) == 13
+    for with_index, without in zip(outputs[True], outputs[False]):
+        assert page_texts(with_index) == page_texts(without)
+        with fitz.open(with_index) as f, fitz.open(without) as g:
+            assert [(page.rotation, page.mediabox) for page in f] == [(page.rotation, page.mediabox) for page in g]
+
+    # with the index, split checks the pdf without opening it, and cuts its
+    # page tree down to the pages selected
+    split = records[len(argvs)]
+    assert split['counters']['index_hits'] == 2
+    assert split['phases']['open']['calls'] == 1 and 'select' in split['phases']
+    assert 'index_hits' not in records[0]['counters']
+    return
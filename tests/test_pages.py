@@ -0,0 +1,154 @@
+# run from POC directory
+
+import os
+import sys
+import random
+import pytest
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+from poc.pages import PageSet, parse_page_input, parse_order_input, parse_page_order
+
+def old_page_set(page_inputs):
+    # the page numbers that the old remove command expanded its page inputs to
+    pages = set()
+    for p in page_inputs:
+        if '-' in p:
+            s, e = (int(i) for i in p.split('-'))
+            pages.update(range(s, e+1))
+        else:
+            pages.add(int(p))
+    return pages
+
+def random_page_inputs(rng, page_count):
+    page_inputs = []
+    for _ in range(rng.randint(1, 6)):
+        start = rng.randint(1, page_count)
+        if rng.random() < 0.5 or start == page_count:
+            page_inputs.append(str(start))
+        else:
+            page_inputs.append('{}-{}'.format(start, rng.randint(start+1, page_count)))
+    return page_inputs
+
+#-----------------------------------
+# parse_page_input
+#-----------------------------------
+
+def test_parse_page_input_01():
+    assert parse_page_input('3') == (3, 3, 1)
+    assert parse_page_input('03-13') == (3, 13, 1)
+    assert parse_page_input('5-') == (5, None, 1)
+    assert parse_page_input('-4') == (1, 4, 1)
+    assert parse_page_input('last') == (None, None, 1)
+    assert parse_page_input('2-last') == (2, None, 1)
+    assert parse_page_input('even') == (2, None, 2)
+    assert parse_page_input('odd') == (1, None, 2)
+    return
+
+def test_parse_page_input_02_raise():
+    page_inputs = ['0', '12-12', '10-2', '4-4', 'asd', '20ds', 'ad--2', '', '-',
+                   '12-14-16', '0-3', 'last-2', '-0']
+    for p in page_inputs:
+        with pytest.raises(ValueError):
+            parse_page_input(p)
+    return
+
+def test_parse_page_input_03_random():
+    # every input the old check_page_format accepted is still accepted, and
+    # every input it rejected is still rejected
+    rng = random.Random(8)
+    for _ in range(2000):
+        p = ''.join(rng.choice('0123456789-') for _ in range(rng.randint(1, 5)))
+        try:
+            start, end = (int(i) for i in p.split('-')) if '-' in p else (int(p), int(p)+1)
+            old_ok = p.count('-') <= 1 and 0 < start < end and '-' not in (p[0], p[-1])
+        except ValueError:
+            old_ok = False
+        if old_ok:
+            assert parse_page_input(p)
+        elif p[0] != '-' and p[-1] != '-':
+            # open ended ranges are new, so only closed ranges are compared
+            with pytest.raises(ValueError):
+                parse_page_input(p)
+    return
+
+#-----------------------------------
+# parse_order_input / parse_page_order
+#-----------------------------------
+
+def test_parse_order_input_01():
+    assert parse_order_input('3') == (3, 3, 1, 0)
+    assert parse_order_input('9-5') == (9, 5, -1, 0)
+    assert parse_order_input('last-1') == (None, 1, -1, 0)
+    assert parse_order_input('r90:4') == (4, 4, 1, 90)
+    assert parse_order_input('R-90:2-last') == (2, None, 1, -90)
+    assert parse_order_input('r180:even') == (2, None, 2, 180)
+    for p in ['r45:3', 'r90', 'r90:', 'r90:r90:1', '5-0', 'last-last', '4-4', '90:1']:
+        with pytest.raises(ValueError):
+            parse_order_input(p)
+    return
+
+def test_parse_page_order_01():
+    page_order = parse_page_order('1-3 10 5-9 r90:4 last-1'.split(), 10)
+    assert [page for page, _ in page_order] == [1, 2, 3, 10, 5, 6, 7, 8, 9, 4] + list(range(10, 0, -1))
+    assert [rotation for _, rotation in page_order] == [0]*9 + [90] + [0]*10
+    assert parse_page_order(['r270:odd', '4-'], 5) == [(1, 270), (3, 270), (5, 270), (4, 0), (5, 0)]
+    assert parse_page_order('even', 1) == []
+    for order in (['11'], ['9-11'], ['11-'], ['last-11']):
+        with pytest.raises(ValueError):
+            parse_page_order(order, 10)
+    return
+
+#-----------------------------------
+# PageSet
+#-----------------------------------
+
+def test_page_set_01_parse():
+    page_set = PageSet.parse(['2-3', '5-7', '9', '6-8'], 12)
+    assert page_set.intervals == [(2, 3), (5, 9)]
+    assert list(page_set) == [2, 3, 5, 6, 7, 8, 9]
+    assert len(page_set) == 7
+    assert str(page_set) == '2-3 5-9'
+    assert page_set.ranges() == [(1, 2), (4, 8)]
+    assert PageSet.parse(['10-', '-2', 'last'], 12).intervals == [(1, 2), (10, 12)]
+    assert list(PageSet.parse('even', 7)) == [2, 4, 6]
+    assert list(PageSet.parse('odd', 7)) == [1, 3, 5, 7]
+    assert list(PageSet.parse('even', 1)) == []
+    return
+
+def test_page_set_02_check():
+    assert PageSet.parse(['1-12'], 12).check(12)
+    for page_inputs in (['12-13'], ['13'], ['13-']):
+        with pytest.raises(ValueError):
+            PageSet.parse(page_inputs, 12).check(12)
+    return
+
+def test_page_set_03_operations():
+    a = PageSet([(1, 5), (10, 20)])
+    b = PageSet([(4, 11), (15, 15), (30, 40)])
+    assert (a | b).intervals == [(1, 20), (30, 40)]
+    assert (a - b).intervals == [(1, 3), (12, 14), (16, 20)]
+    assert (a & b).intervals == [(4, 5), (10, 11), (15, 15)]
+    assert a.complement(25).intervals == [(6, 9), (21, 25)]
+    assert 10 in a and 20 in a and 1 in a
+    assert 0 not in a and 6 not in a and 21 not in a
+    return
+
+def test_page_set_04_random():
+    # against the set of page numbers expanded one by one
+    rng = random.Random(8)
+    for _ in range(500):
+        page_count = rng.randint(1, 60)
+        inputs_a = random_page_inputs(rng, page_count)
+        inputs_b = random_page_inputs(rng, page_count)
+        a, b = PageSet.parse(inputs_a, page_count), PageSet.parse(inputs_b, page_count)
+        pages_a, pages_b = old_page_set(inputs_a), old_page_set(inputs_b)
+
+        assert set(a) == pages_a and len(a) == len(pages_a)
+        assert list(a) == sorted(pages_a)
+        assert set(a | b) == pages_a | pages_b
+        assert set(a - b) == pages_a - pages_b
+        assert set(a & b) == pages_a & pages_b
+        assert set(a.complement(page_count)) == set(range(1, page_count+1)) - pages_a
+        assert all((page in a) == (page in pages_a) for page in range(page_count+2))
+        assert [page_index for start, end in a.ranges() for page_index in range(start, end+1)] \
+            == [page-1 for page in sorted(pages_a)]
+    return
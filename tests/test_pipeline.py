@@ -0,0 +1,96 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+from poc.api import Pipeline, merge_pdfs, remove_pages, insert_pages, split_pdf
+import poc.pipeline as pipeline
+
+test_files_dir = 'tests/test_files/'
+
+def page_texts(pdf):
+    with (fitz.open(pdf) if isinstance(pdf, str) else fitz.open(stream=pdf, filetype='pdf')) as f:
+        return [page.get_text() for page in f]
+
+#-----------------------------------
+# Pipeline
+#-----------------------------------
+
+def test_pipeline_01_same_as_commands():
+    pdfs = [test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_5_bigboy.pdf']
+    ins_pdf = test_files_dir+'pdf_4.pdf'
+    expected = insert_pages(remove_pages(merge_pdfs(pdfs), ['2-5', 'last']), ins_pdf, 10)
+    expected_parts = split_pdf(expected, every=8)
+
+    pdf_bytes = Pipeline(pdfs).remove(['2-5', 'last']).insert(ins_pdf, 10).run()
+    assert page_texts(pdf_bytes) == page_texts(expected)
+
+    parts = Pipeline(pdfs).remove(['2-5', 'last']).insert(ins_pdf, 10).split(every=8).run()
+    assert [page_texts(part) for part in parts] == [page_texts(part) for part in expected_parts]
+    return
+
+def test_pipeline_02_runs():
+    # pages are copied in as few runs as possible
+    edits = Pipeline([test_files_dir+'pdf_5_bigboy.pdf']).remove(['3-5']).insert(test_files_dir+'pdf_1.pdf', 2)
+    edits.merge([test_files_dir+'pdf_5_bigboy.pdf']).remove(['1'])
+    docs = [fitz.open(pdf) for pdf in edits._sources]
+    assert edits._runs(docs) == [(0, 1, 2), (1, 0, 3), (0, 5, 20), (0, 0, 20)]
+    for doc in docs:
+        doc.close()
+    return
+
+def test_pipeline_03_split_by_bookmark(tmp_path):
+    src_pdf_path = str(tmp_path/'bookmarks.pdf')
+    with fitz.open(test_files_dir+'pdf_5_bigboy.pdf') as f:
+        f.set_toc([[1, 'one', 3], [1, 'two', 9], [1, 'three', 15]])
+        f.save(src_pdf_path)
+
+    # the page of the bookmark at page 9 (page 12 after merging) is removed,
+    # and the other bookmarks move with their pages
+    parts = Pipeline([test_files_dir+'pdf_1.pdf', src_pdf_path]).remove(['12']).split(by_bookmark=1).run()
+    assert [len(page_texts(part)) for part in parts] == [5, 11, 6]
+    assert 'page 3' in page_texts(parts[1])[0]
+    return
+
+def test_pipeline_04_raise():
+    with pytest.raises(ValueError):
+        Pipeline([test_files_dir+'pdf_1.pdf']).remove(['4']).run()
+    with pytest.raises(ValueError):
+        Pipeline([test_files_dir+'pdf_1.pdf']).insert(test_files_dir+'pdf_2.pdf', 4).run()
+    with pytest.raises(ValueError):
+        Pipeline([test_files_dir+'pdf_1.pdf']).split(['1']).remove(['1'])
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_parse_steps_01():
+    edits = pipeline.parse_steps(['merge', 'a.pdf', 'b.pdf', '+', 'remove', '3-5', '9', '+', 'insert', 'c.pdf', '10',
+                                  '+', 'split', '-b'])
+    assert edits.sources == ['a.pdf', 'b.pdf', 'c.pdf'] and edits.splits
+    assert edits._steps == [('merge', [0, 1]), ('remove', ['3-5', '9']), ('insert', (2, 10))]
+    assert edits._split == ([], None, 1)
+    assert not pipeline.parse_steps(['merge', 'a.pdf', '+', 'insert', 'a.pdf', '1']).splits
+
+    for tokens in (['remove', '3'], ['merge', 'a.pdf', '+', 'rotate', '90'], ['merge', 'a.pdf', '+', 'insert', 'c.pdf'],
+                   ['merge', 'a.pdf', '+', 'split', '-e', '0']):
+        with pytest.raises(ValueError):
+            pipeline.parse_steps(tokens)
+    return
+
+def test_pipeline_command_01(tmp_path):
+    parser = set_args()
+    args = parser.parse_args(['pipeline', '-o', str(tmp_path), '-n', '{stem}_{range}',
+                              'merge', test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf',
+                              '+', 'remove', 'even', '+', 'split', '1-2', '3'])
+    output_paths = pipeline.pipeline(args)
+    assert [os.path.basename(path) for path in output_paths] == ['pdf_1_1-2.pdf', 'pdf_1_3.pdf']
+    # pages 1, 3 and 5 are left, the last from pdf_2
+    assert ['PDF file 2' in text for text in page_texts(output_paths[1])] == [True]
+
+    args = parser.parse_args(['pipeline', '-o', str(tmp_path), 'merge', test_files_dir+'pdf_1.pdf',
+                              '+', 'remove', '1'])
+    assert len(page_texts(pipeline.pipeline(args))) == 2
+    return
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import threading
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+from poc.helpers import set_args
+from poc.prefetch import ReadAhead, read_file
+import poc.commands as commands
+
+test_files_dir = 'tests/test_files/'
+
+class RecordingReader:
+    """
+    Reads files slowly, recording the order they are read in and the most
+    read at the same time.
+    """
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.paths = []
+        self.reading = 0
+        self.most_reading = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        with self._lock:
+            self.paths.append(path)
+            self.reading += 1
+            self.most_reading = max(self.most_reading, self.reading)
+        time.sleep(self.delay)
+        with self._lock:
+            self.reading -= 1
+        return read_file(path)
+
+#-----------------------------------
+# ReadAhead
+#-----------------------------------
+
+def test_read_ahead_01_depth():
+    paths = [test_files_dir+'pdf_{}.pdf'.format(n) for n in (1, 2, 3, 4)] * 2
+    reader = RecordingReader()
+    with ReadAhead(paths, depth=2, read=reader) as read_ahead:
+        # no more than two are read ahead before the first is taken
+        time.sleep(0.1)
+        assert reader.paths == paths[:2]
+        for path in paths:
+            assert read_ahead.take(path) == read_file(path)
+    assert reader.paths == paths
+    assert reader.most_reading == 2
+    return
+
+def test_read_ahead_02_budget():
+    paths = [test_files_dir+name for name in ('pdf_1.pdf', 'pdf_5_bigboy.pdf', 'pdf_2.pdf', 'pdf_1.pdf')]
+    sizes = [os.path.getsize(path) for path in paths]
+    max_bytes = sizes[0] + sizes[2]
+    reader = RecordingReader()
+    with ReadAhead(paths, depth=4, max_bytes=max_bytes, read=reader) as read_ahead:
+        # the big pdf is over budget by itself, so is not read ahead, and
+        # the second pdf_1 waits for the first to be taken
+        assert read_ahead.buffered_bytes == max_bytes
+        assert read_ahead.take(paths[0]) is not None
+        assert read_ahead.take(paths[1]) is None
+        assert read_ahead.buffered_bytes == sizes[2] + sizes[3]
+        assert read_ahead.take(paths[2]) is not None
+        assert read_ahead.take(paths[3]) is not None
+    assert reader.paths == [paths[0], paths[2], paths[3]]
+    return
+
+def test_read_ahead_03_skipped():
+    paths = [test_files_dir+'pdf_{}.pdf'.format(n) for n in (1, 2, 3)]
+    with ReadAhead(paths + ['missing.pdf']) as read_ahead:
+        # a pdf not taken (e.g. opened from a document cache) is dropped
+        # once one after it is taken
+        assert read_ahead.take(paths[1]) == read_file(paths[1])
+        assert read_ahead.take(paths[0]) is None
+        assert read_ahead.take(paths[2]) is not None
+        # left to be opened by its path, which reports the error
+        assert read_ahead.take('missing.pdf') is None
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_read_ahead_04_commands(tmp_path):
+    parser = set_args()
+    pdfs = [test_files_dir+'pdf_{}.pdf'.format(n) for n in (1, 2, 3, 1)]
+    out_pdfs = {}
+    for depth in ('0', '1', '4'):
+        out = ['-o', str(tmp_path/depth), '--read-ahead', depth]
+        out_pdfs[depth] = [commands.merge(parser.parse_args(['merge'] + pdfs + out)),
+                           commands.merge(parser.parse_args(['merge'] + pdfs + ['-c', '2'] + out)),
+                           commands.insert(parser.parse_args(['insert', pdfs[0], pdfs[1], '2'] + out))]
+
+    # the same pages, whether the pdfs are read ahead or not
+    for with_read_ahead, without in zip(out_pdfs['1'] + out_pdfs['4'], out_pdfs['0'] * 2):
+        with fitz.open(with_read_ahead) as f, fitz.open(without) as g:
+            assert [page.get_text() for page in f] == [page.get_text() for page in g]
+    assert commands._read_ahead is None
+    return
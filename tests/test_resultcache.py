@@ -0,0 +1,102 @@
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args, get_command_controls, set_result_cache
+from poc.resultcache import ResultCache
+
+test_files_dir = 'tests/test_files/'
+
+@pytest.fixture
+def run(tmp_path):
+    # runs a command as poc.main does, through the dispatch
+    def run(argv, cache):
+        set_result_cache(cache)
+        try:
+            arguments = set_args().parse_args(argv + ['-o', str(tmp_path/'out')])
+            return get_command_controls(argv[0])['execute'](arguments)
+        finally:
+            set_result_cache(None)
+    return run
+
+#-----------------------------------
+# ResultCache
+#-----------------------------------
+
+def test_result_cache_01_hits(tmp_path, run):
+    cache = ResultCache(str(tmp_path/'cache'))
+    argv = ['split', test_files_dir+'pdf_5_bigboy.pdf', '1-3', '5', '-n', '{stem}_{range}']
+    first = run(argv, cache)
+    again = run(argv, cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert [os.path.basename(path) for path in again] == ['pdf_5_bigboy_1-3_2.pdf', 'pdf_5_bigboy_5_2.pdf']
+    for first_path, path in zip(first, again):
+        with open(first_path, 'rb') as f, open(path, 'rb') as g:
+            assert f.read() == g.read()
+
+    # the same pages given differently, or other options, are a miss
+    run(['split', test_files_dir+'pdf_5_bigboy.pdf', '1-3', '5', '--save-profile', 'compact'], cache)
+    outfile = run(['remove', test_files_dir+'pdf_5_bigboy.pdf', '5', '1-3'], cache)
+    assert run(['remove', test_files_dir+'pdf_5_bigboy.pdf', '1-3', '5'], cache) != outfile
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert cache.stats()['results'] == 3
+    return
+
+@pytest.mark.parametrize('key', ['content', 'stat'])
+def test_result_cache_02_changed_input(tmp_path, run, key):
+    path = str(tmp_path/'src.pdf')
+    shutil.copy(test_files_dir+'pdf_1.pdf', path)
+    cache = ResultCache(str(tmp_path/'cache'), key=key)
+    run(['remove', path, '1'], cache)
+    shutil.copy(test_files_dir+'pdf_5_bigboy.pdf', path)
+    outfile = run(['remove', path, '1'], cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    with fitz.open(outfile) as f:
+        assert len(f) == 19
+    return
+
+def test_result_cache_03_evicts_least_recently_used(tmp_path, run):
+    cache = ResultCache(str(tmp_path/'cache'))
+    merges = [['merge', test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf'],
+              ['merge', test_files_dir+'pdf_2.pdf', test_files_dir+'pdf_3.pdf'],
+              ['merge', test_files_dir+'pdf_3.pdf', test_files_dir+'pdf_1.pdf']]
+    run(merges[0], cache)
+    run(merges[1], cache)
+    # room for two of the three
+    cache.max_bytes = cache.stats()['bytes'] + 1000
+    run(merges[0], cache)
+    run(merges[2], cache)
+    assert cache.stats()['results'] == 2 and cache.evictions == 1
+
+    run(merges[0], cache)
+    run(merges[1], cache)
+    assert (cache.hits, cache.misses) == (2, 4)
+    return
+
+def test_result_cache_04_changed_output(tmp_path, run):
+    # a cached output changed in place is not served
+    cache = ResultCache(str(tmp_path/'cache'))
+    argv = ['insert', test_files_dir+'pdf_1.pdf', test_files_dir+'pdf_2.pdf', '2']
+    outfile = run(argv, cache)
+    with open(outfile, 'ab') as f:
+        f.write(b'% changed')
+    outfile = run(argv, cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+    with fitz.open(outfile) as f:
+        assert len(f) == 6
+    return
+
+def test_result_cache_05_same_pages(tmp_path, run):
+    # pages to remove given differently, but selecting the same pages, are
+    # a hit, and pages worked out from the page count only when given alike
+    cache = ResultCache(str(tmp_path/'cache'))
+    src_pdf = test_files_dir+'pdf_5_bigboy.pdf'
+    for pages in (['1-3', '5'], ['1', '2', '3', '5'], ['5', '2-3', '1-2'], ['1-2', '3', '5', '5']):
+        run(['remove', src_pdf] + pages, cache)
+    assert (cache.hits, cache.misses) == (3, 1)
+    for pages in (['1-3', '18-'], ['3', '1-2', '18-'], ['1-3', '18-20']):
+        run(['remove', src_pdf] + pages, cache)
+    assert (cache.hits, cache.misses) == (4, 3)
+    return
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+import poc.server as server
+import poc.client as client
+
+test_files_dir = 'tests/test_files/'
+
+@pytest.fixture
+def daemon(tmp_path):
+    address = str(tmp_path/'poc.sock')
+    process = subprocess.Popen([sys.executable, 'poc', 'serve', '--address', address, '--jobs', '2'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        if os.path.exists(address):
+            break
+        time.sleep(0.1)
+    yield address
+    process.terminate()
+    process.wait(10)
+
+#-----------------------------------
+# send_request
+#-----------------------------------
+
+def test_send_request_01_no_daemon(tmp_path):
+    assert client.send_request(['split', test_files_dir+'pdf_3.pdf', '1'], str(tmp_path/'none.sock')) is None
+    return
+
+def test_send_request_02_split(daemon, tmp_path, monkeypatch):
+    # outputs are saved to the client's working directory, and relative 
+    # paths are relative to it
+    src_pdf_path = os.path.abspath(test_files_dir+'pdf_5_bigboy.pdf')
+    monkeypatch.chdir(tmp_path)
+    result = client.send_request(['split', os.path.relpath(src_pdf_path), '2', '5-8'], daemon)
+
+    assert result['status'] == 'ok'
+    assert len(result['outputs']) == 2
+    for outfile in result['outputs']:
+        assert os.path.dirname(outfile) == str(tmp_path)
+    with fitz.open(result['outputs'][1]) as f:
+        assert len(f) == 4
+    return
+
+def test_send_request_03_errors(daemon):
+    result = client.send_request(['remove', test_files_dir+'pdf_3.pdf', '7'], daemon)
+    assert result['status'] == 'error'
+    assert 'ValueError' in result['error']
+
+    result = client.send_request(['serve'], daemon)
+    assert result['status'] == 'error'
+    return
+
+#-----------------------------------
+# serve
+#-----------------------------------
+
+def test_serve_01_already_running(daemon):
+    with pytest.raises(RuntimeError):
+        server.serve(argparse.Namespace(address=daemon, jobs=1, cache_mb=1))
+    return
+
+def test_serve_02_remote_address():
+    # a tcp address other than a loopback one needs --allow-remote
+    assert server._is_loopback('127.0.0.1') and server._is_loopback('localhost')
+    assert not server._is_loopback('0.0.0.0')
+    with pytest.raises(ValueError, match='--allow-remote'):
+        server.serve(argparse.Namespace(address='0.0.0.0:0', allow_remote=False, jobs=1, cache_mb=1))
+    return
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.soak as soak
+import poc.commands as commands
+import poc.api as api
+from poc.bench import make_pdf
+
+test_files_dir = 'tests/test_files/'
+
+@pytest.fixture
+def argvs(tmp_path):
+    src_pdf = make_pdf(str(tmp_path/'source.pdf'), 6)
+    bad_pdf = str(tmp_path/'not_a.pdf')
+    with open(bad_pdf, 'wb') as f:
+        f.write(b'not a pdf')
+    return {name: soak._operation_argv(name, src_pdf, test_files_dir+'pdf_1.pdf', bad_pdf, 6)
+            for name in soak.OPERATIONS}
+
+def test_percentile_01():
+    values = list(range(100, 0, -1))
+    assert [soak.percentile(values, p) for p in (0, 50, 99, 100)] == [1, 50, 99, 100]
+    assert soak.percentile([3], 99) == 3 and soak.percentile([], 50) is None
+    return
+
+#-----------------------------------
+# run_soak
+#-----------------------------------
+
+def test_run_soak_01(argvs, tmp_path):
+    result = soak.run_soak(argvs, str(tmp_path), iterations=6, warmup=2, sample_every=3)
+    assert result['runs'] == 6*len(soak.OPERATIONS)
+    assert all(len(latencies) == 6 for latencies in result['latencies'].values())
+    assert [sample['iteration'] for sample in result['samples']] == [0, 3, 6]
+    # nothing is left open, or behind in the output directory
+    assert soak.resource_growth(result['samples'], 32*2**20) == []
+    assert result['samples'][-1]['documents'] == 0
+    assert sorted(os.listdir(str(tmp_path))) == ['not_a.pdf', 'source.pdf']
+    return
+
+def test_run_soak_02_leak(argvs, tmp_path, monkeypatch):
+    # a remove which leaves its source open
+    leaked = []
+    remove = commands.remove
+    def leaky_remove(arguments):
+        leaked.append(fitz.open(arguments.src_pdf))
+        return remove(arguments)
+    monkeypatch.setattr(commands, 'remove', leaky_remove)
+
+    result = soak.run_soak({'remove': argvs['remove']}, str(tmp_path), iterations=4, warmup=1, sample_every=2)
+    growth = dict((resource, (start, end)) for resource, start, end in soak.resource_growth(result['samples'], 2**30))
+    assert growth['documents'] == (1, 5)
+    # each holds its file open, where open files can be counted
+    if soak.open_fds() is not None:
+        assert growth['fds'][1] - growth['fds'][0] == 4
+    for pdf in leaked:
+        pdf.close()
+
+    # a command meant to fail which does not, fails the soak
+    with pytest.raises(RuntimeError):
+        soak.run_soak({'remove_error': argvs['remove']}, str(tmp_path), iterations=1, warmup=0)
+    return
+
+#-----------------------------------
+# closing_on_error
+#-----------------------------------
+
+def test_closing_on_error_01(monkeypatch):
+    # the pdf being built is closed when a copy fails, even while the
+    # traceback is kept
+    def failing_insert_pdf(self, *args, **kwargs):
+        raise RuntimeError('copy failed')
+    monkeypatch.setattr(fitz.Document, 'insert_pdf', failing_insert_pdf)
+
+    with open(test_files_dir+'pdf_1.pdf', 'rb') as f:
+        src_pdf = f.read()
+    open_documents = soak.open_documents()
+    for run in (lambda: api.remove_pages(src_pdf, '2'), lambda: api.insert_pages(src_pdf, src_pdf, 1),
+                lambda: api.split_pdf(src_pdf, ['1-2']), lambda: api.optimize_pdf(src_pdf),
+                lambda: api.Pipeline([src_pdf]).remove('1').run()):
+        with pytest.raises(RuntimeError) as excinfo:
+            run()
+        assert soak.open_documents() == open_documents
+        del excinfo
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_soak_01(tmp_path):
+    json_path = str(tmp_path/'soak.json')
+    args = set_args().parse_args(['soak', '-n', '3', '--warmup', '1', '-j', '2', '-p', '4', '-c', 'split',
+                                  'insert_error', '-o', json_path])
+    assert soak.soak(args) == json_path
+
+    with open(json_path) as f:
+        results = json.load(f)
+    assert [(operation['operation'], operation['runs']) for operation in results['operations']] == \
+        [('split', 6), ('insert_error', 6)]
+    assert all(operation['p99'] >= operation['p50'] > 0 for operation in results['operations'])
+    assert len(results['samples']) == 2 and results['leaks'] == []
+    return
@@ -0,0 +1,51 @@
+import os
+import sys
+import subprocess
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import pytest
+
+# budget for importing poc, in milliseconds. Importing PyMuPDF alone takes 
+# well over this, so the budget catches it being imported at start up.
+STARTUP_BUDGET_MS = float(os.environ.get('POC_STARTUP_BUDGET_MS', 100))
+
+def run_importtime(argv, tmp_path):
+    """
+    Runs poc with -X importtime, without a daemon to send commands to.
+
+    @return (returncode, import_times) : tuple
+        import_times maps each imported module to its cumulative import
+        time in milliseconds.
+    """
+    env = dict(os.environ, POC_SERVER=str(tmp_path/'no_daemon.sock'))
+    process = subprocess.run([sys.executable, '-X', 'importtime', 'poc'] + argv,
+                             capture_output=True, text=True, env=env)
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                import_times[name.strip()] = int(cumulative) / 1000
+    return process.returncode, import_times
+
+#-----------------------------------
+# start up
+#-----------------------------------
+
+def test_startup_01_help(tmp_path):
+    returncode, import_times = run_importtime(['-h'], tmp_path)
+    assert returncode == 0
+    assert 'fitz' not in import_times and 'pymupdf' not in import_times
+    return
+
+def test_startup_02_rejected_arguments(tmp_path):
+    # arguments are checked before PyMuPDF is imported
+    returncode, import_times = run_importtime(['split', 'tests/test_files/does_not_exist.pdf', '1'], tmp_path)
+    assert returncode != 0
+    assert 'fitz' not in import_times and 'pymupdf' not in import_times
+    return
+
+def test_startup_03_budget(tmp_path):
+    # best of a few runs, to allow for a cold disk cache
+    poc_import_ms = min(run_importtime(['-h'], tmp_path)[1]['poc'] for _ in range(3))
+    assert poc_import_ms < STARTUP_BUDGET_MS, 'importing poc took {:.1f} ms'.format(poc_import_ms)
+    return
@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import shutil
+import threading
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+import fitz
+import pytest
+from poc.helpers import set_args
+import poc.watch as watch
+
+test_files_dir = 'tests/test_files/'
+
+def read_log(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def inotify_available(tmp_path):
+    try:
+        watch.InotifyWatcher(str(tmp_path)).close()
+    except OSError:
+        return False
+    return True
+
+#-----------------------------------
+# HotFolder
+#-----------------------------------
+
+def test_hot_folder_01_ready(tmp_path):
+    # a file is taken once unchanged for the settle time, or once closed
+    hot_folder = watch.HotFolder(str(tmp_path), ['split', '--every', '1'], str(tmp_path/'out'), settle=1.0, poll=1.0)
+    with open(str(tmp_path/'growing.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.7\n')
+    hot_folder._scan(set(), 0.0)
+    assert hot_folder._units(0.9) == []
+
+    with open(str(tmp_path/'growing.pdf'), 'ab') as f:
+        f.write(b'more')
+    hot_folder._scan(set(), 0.9)
+    assert hot_folder._units(1.5) == []
+    assert hot_folder._units(1.95) == [('growing', ['growing.pdf'])]
+
+    shutil.copy(test_files_dir+'pdf_1.pdf', str(tmp_path/'closed.pdf'))
+    hot_folder._scan({'closed.pdf'}, 2.0)
+    assert [names for _, names in hot_folder._units(2.0)] == [['growing.pdf'], ['closed.pdf']]
+    hot_folder.watcher.close()
+    return
+
+def test_hot_folder_02_queue(tmp_path):
+    # no more than queue_size jobs are handed out at a time
+    inbox = tmp_path/'in'
+    inbox.mkdir()
+    for i in range(5):
+        shutil.copy(test_files_dir+'pdf_1.pdf', str(inbox/'scan_{}.pdf'.format(i)))
+
+    depths = []
+    class RecordingHotFolder(watch.HotFolder):
+        def _submit(self, executor, now):
+            super()._submit(executor, now)
+            depths.append(len(self._in_flight))
+
+    hot_folder = RecordingHotFolder(str(inbox), ['remove', '2'], str(tmp_path/'out'), queue_size=2, settle=0,
+                                    poll=0.05)
+    hot_folder.run(idle_exit=0.2)
+    assert max(depths) == 2
+    assert hot_folder.processed == 5 and sorted(os.listdir(str(inbox/'done'))) == sorted(
+        'scan_{}.pdf'.format(i) for i in range(5))
+    with open(hot_folder.metrics_path) as f:
+        metrics = json.load(f)
+    assert (metrics['waiting'], metrics['queue_depth'], metrics['processed'], metrics['latency']['jobs']) == (0, 0, 5, 5)
+    return
+
+#-----------------------------------
+# command line
+#-----------------------------------
+
+def test_watch_01_split(tmp_path):
+    if not inotify_available(tmp_path):
+        pytest.skip('inotify is not available')
+    inbox, out_dir = tmp_path/'in', tmp_path/'out'
+    inbox.mkdir()
+    shutil.copy(test_files_dir+'pdf_1.pdf', str(inbox/'waiting.pdf'))
+
+    def arrive():
+        # written under a hidden name, then moved in, as scanners do
+        shutil.copy(test_files_dir+'pdf_2.pdf', str(inbox/'.arriving'))
+        os.rename(str(inbox/'.arriving'), str(inbox/'arrived.pdf'))
+    timer = threading.Timer(0.5, arrive)
+    timer.start()
+
+    parser = set_args()
+    log_path = watch.watch(parser.parse_args(['watch', '-o', str(out_dir), '--settle', '0.2', '--idle-exit', '1',
+                                              str(inbox), 'split', '--every', '1', '-n', '{stem}_{range}']))
+    timer.join()
+    results = read_log(log_path)
+    assert [(result['inputs'], result['status']) for result in results] == [(['waiting.pdf'], 'ok'),
+                                                                             (['arrived.pdf'], 'ok')]
+    # moved in whole, so taken without waiting to settle
+    assert results[1]['latency'] < 0.2
+    assert sorted(os.listdir(str(inbox/'done'))) == ['arrived.pdf', 'waiting.pdf']
+    assert os.path.exists(str(out_dir/'arrived_3.pdf'))
+    return
+
+def test_watch_02_merge_groups(tmp_path):
+    inbox, out_dir = tmp_path/'in', tmp_path/'out'
+    inbox.mkdir()
+    for name, pdf in (('a_2', 'pdf_2'), ('a_1', 'pdf_1'), ('b_1', 'pdf_3')):
+        shutil.copy(test_files_dir+pdf+'.pdf', str(inbox/(name+'.pdf')))
+    with open(str(inbox/'c_1.pdf'), 'wb') as f:
+        f.write(b'not a pdf')
+
+    parser = set_args()
+    log_path = watch.watch(parser.parse_args(['watch', '-o', str(out_dir), '--poll', '0.1', '--settle', '0.1',
+                                              '--group', r'^(\w+)_\d+\.pdf$', '--group-wait', '0.2',
+                                              '--idle-exit', '0.5', str(inbox), 'merge', '-n', '{stem}']))
+    results = {result['id']: result for result in read_log(log_path)}
+    assert (results['a']['inputs'], results['a']['status']) == (['a_1.pdf', 'a_2.pdf'], 'ok')
+    with fitz.open(results['a']['outputs'][0]) as f:
+        assert 'PDF file 1' in f.get_page_text(0) and 'PDF file 2' in f.get_page_text(5)
+    assert results['c']['status'] == 'error'
+    assert os.listdir(str(inbox/'failed')) == ['c_1.pdf']
+    return
+
+def test_watch_03_raise(tmp_path):
+    parser = set_args()
+    for argv in ([str(tmp_path), 'convert'], [str(tmp_path), 'merge'], [str(tmp_path), 'split', '--every', '0'],
+                 ['--group', 'x', str(tmp_path), 'split', '--every', '1']):
+        with pytest.raises(ValueError):
+            watch.watch(parser.parse_args(['watch'] + argv))
+    return